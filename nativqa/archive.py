@@ -0,0 +1,221 @@
+import json
+import logging
+import optparse
+import os
+import sys
+import zlib
+from importlib.util import find_spec
+
+from .journal import query_id
+from .utils import add_log_option, configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILE = 'responses.archive'
+INDEX_FILE = 'responses.idx'
+CHUNK_SIZE = 64
+
+
+class ZlibCodec:
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level=9):
+        import zstandard
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+
+def get_codec(name=None):
+    # zstd when zstandard is installed, zlib otherwise; an existing archive keeps its codec
+    if name is None:
+        name = 'zstd' if find_spec('zstandard') is not None else 'zlib'
+    if name == 'zstd':
+        try:
+            return ZstdCodec()
+        except ImportError:
+            raise ImportError('zstandard is required to read a zstd response archive: pip install zstandard')
+    if name == 'zlib':
+        return ZlibCodec()
+    raise ValueError(f'Unknown archive codec: {name}')
+
+
+class ResponseArchive:
+    """Append-only archive of raw responses in compressed chunks, with an offset index keyed by query hash.
+
+    The index has one ``key, frame offset, frame length, line, query`` row per response, written after the frame,
+    so a crash can only leave an unindexed frame at the end of the archive, which is cut off on open.
+    """
+
+    def __init__(self, directory, strip_diacritics=False, chunk_size=CHUNK_SIZE, codec=None):
+        self.path = os.path.join(directory, ARCHIVE_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.strip_diacritics = strip_diacritics
+        self.chunk_size = chunk_size
+        # key -> (frame offset, frame length, line in the frame)
+        self.index = {}
+        self._chunk = []
+        self._frame = None
+        end = self._read_index()
+        if self.codec is None:
+            self.codec = get_codec(codec)
+        self._f = open(self.path, 'ab')
+        if self._f.tell() != end:
+            self._f.truncate(end)
+            self._f.seek(end)
+        self._index_f = open(self.index_path, 'a', encoding='utf-8')
+        if self._index_f.tell() == 0:
+            self._index_f.write(json.dumps({'codec': self.codec.name}) + '\n')
+
+    def _read_index(self):
+        self.codec = None
+        end = 0
+        if not os.path.exists(self.index_path):
+            return end
+        valid = 0
+        with open(self.index_path, encoding='utf-8') as f:
+            for i, line in enumerate(f):
+                if not line.endswith('\n'):
+                    break
+                if i == 0:
+                    self.codec = get_codec(json.loads(line)['codec'])
+                else:
+                    key, offset, length, line_no, _ = line.split('\t', 4)
+                    offset, length = int(offset), int(length)
+                    self.index[key] = (offset, length, int(line_no))
+                    end = max(end, offset + length)
+                valid += len(line.encode('utf-8'))
+        if valid != os.path.getsize(self.index_path):
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(valid)
+        return end
+
+    def key(self, query):
+        return query_id(query, self.strip_diacritics)
+
+    def __contains__(self, query):
+        return self.key(query) in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def write(self, response):
+        # a normalized response; a query that is already archived is skipped
+        query = response['search_parameters']['q']
+        key = self.key(query)
+        if key in self.index or any(key == chunk_key for chunk_key, _, _ in self._chunk):
+            return False
+        self._chunk.append((key, query, json.dumps(response, ensure_ascii=False)))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if not self._chunk:
+            return
+        frame = self.codec.compress('\n'.join(line for _, _, line in self._chunk).encode('utf-8'))
+        offset = self._f.tell()
+        self._f.write(frame)
+        self._f.flush()
+        rows = []
+        for line_no, (key, query, _) in enumerate(self._chunk):
+            self.index[key] = (offset, len(frame), line_no)
+            rows.append(f'{key}\t{offset}\t{len(frame)}\t{line_no}\t{json.dumps(query, ensure_ascii=False)}\n')
+        self._index_f.writelines(rows)
+        self._index_f.flush()
+        self._chunk = []
+
+    def _read_frame(self, offset, length):
+        if self._frame is not None and self._frame[0] == offset:
+            return self._frame[1]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            lines = self.codec.decompress(f.read(length)).decode('utf-8').split('\n')
+        self._frame = (offset, lines)
+        return lines
+
+    def get(self, query):
+        entry = self.index.get(self.key(query))
+        if entry is None:
+            return None
+        offset, length, line_no = entry
+        return json.loads(self._read_frame(offset, length)[line_no])
+
+    def __iter__(self):
+        # responses in archive order, one frame decompressed at a time
+        frames = sorted({(offset, length) for offset, length, _ in self.index.values()})
+        for offset, length in frames:
+            for line in self._read_frame(offset, length):
+                yield json.loads(line)
+
+    def close(self):
+        self.flush()
+        self._f.close()
+        self._index_f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_archived_queries(directory):
+    # queries of an iteration's archive, read from the index without decompressing any response
+    index_path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return
+    with open(index_path, encoding='utf-8') as f:
+        next(f, None)
+        for line in f:
+            if line.endswith('\n'):
+                yield json.loads(line.split('\t', 4)[4])
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog -d ITERATION_OUTPUT_DIR [-q QUERY]')
+    parser.add_option('-d', '--output_dir', action='store', dest='output_dir', default=None, type="string",
+                      help='iteration output directory holding responses.archive')
+    parser.add_option('-q', '--query', action='store', dest='query', default=None, type="string",
+                      help='print the raw response of this query (default: every response, one per line)')
+    parser.add_option('--strip_diacritics', action='store_true', dest='strip_diacritics', default=False,
+                      help='the archive was written with --strip_diacritics')
+    add_log_option(parser)
+
+    options, args = parser.parse_args()
+    configure_logging(options.log_level)
+    if options.output_dir is None:
+        parser.error('output directory is required')
+    with ResponseArchive(options.output_dir, options.strip_diacritics) as archive:
+        if options.query is not None:
+            response = archive.get(options.query)
+            if response is None:
+                logger.error(f"'{options.query}' is not in the archive")
+                sys.exit(1)
+            print(json.dumps(response, ensure_ascii=False, indent=2))
+        else:
+            for response in archive:
+                print(json.dumps(response, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+
+from .key_pool import KeyPool, OUT_OF_SEARCHES, mask_key
+
+
+logger = logging.getLogger(__name__)
+
+SERPAPI_URL = 'https://serpapi.com'
+ENGINES = ('google', 'bing', 'yahoo', 'google_images', 'bing_images', 'google_videos')
+
+
+class SearchError(Exception):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def throttled(self):
+        return self.status_code == 429
+
+    @property
+    def retryable(self):
+        return self.status_code is not None and (self.status_code == 429 or self.status_code >= 500)
+
+
+class SearchBackend:
+    """Sends one search request and returns the parsed response, raising SearchError on an HTTP error."""
+
+    def search(self, params):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SerpApiBackend(SearchBackend):
+    """SerpAPI over keep-alive connections, with one pooled requests.Session per worker thread."""
+
+    def __init__(self, base_url=None, key_pool=None, timeout=60.0):
+        # base_url defaults to $SERPAPI_URL (or serpapi.com); without a key pool the api_key of each request is used
+        self.base_url = base_url
+        self.key_pool = key_pool
+        self.timeout = timeout
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            session = requests.Session()
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    @property
+    def url(self):
+        return (self.base_url or os.environ.get('SERPAPI_URL') or SERPAPI_URL).rstrip('/')
+
+    def search(self, params):
+        params = dict(params, output='json')
+        if self.key_pool is None:
+            return self._get(params)
+        while True:
+            key = self.key_pool.acquire()
+            if key is None:
+                raise SearchError('every API key is retired (out of searches or invalid)')
+            params['api_key'] = key
+            try:
+                return self._get(params)
+            except SearchError as e:
+                self.key_pool.record_error(key)
+                # an exhausted or rejected key is retired and the query goes to the next key right away
+                if e.status_code == 401 or (e.status_code == 429 and OUT_OF_SEARCHES in str(e)):
+                    self.key_pool.retire(key, str(e))
+                    continue
+                raise
+
+    def _get(self, params):
+        response = self.session.get(f'{self.url}/search', params=params, timeout=self.timeout)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', response.reason)
+            except ValueError:
+                message = response.reason
+            retry_after = response.headers.get('Retry-After')
+            raise SearchError(f'HTTP {response.status_code}: {message}', response.status_code,
+                              float(retry_after) if retry_after and retry_after.isdigit() else None)
+        return dict(response.json())
+
+    def refresh_quota(self):
+        # searches left per key from the SerpAPI Account API, which does not count as a search
+        for key in list(self.key_pool.keys):
+            try:
+                response = self.session.get(f'{self.url}/account', params={'api_key': key}, timeout=self.timeout)
+                response.raise_for_status()
+                remaining = response.json()['total_searches_left']
+            except Exception as e:
+                logger.warning(f'Could not read the quota of API key {mask_key(key)}: {e}')
+                continue
+            if remaining is None:
+                continue
+            # a quota given in API_KEYS caps what this run uses of the account
+            configured = self.key_pool.keys[key].remaining
+            remaining = int(remaining) if configured is None else min(configured, int(remaining))
+            self.key_pool.set_remaining(key, remaining)
+
+    def close(self):
+        if self.key_pool is not None:
+            for key, stats in self.key_pool.stats().items():
+                logger.info(f'API key {key}: {stats}')
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+        self._local = threading.local()
+
+
+class StubBackend(SearchBackend):
+    """In-process backend for tests and dry runs: answers with `handler(params)` and records every request."""
+
+    def __init__(self, handler=None):
+        if handler is None:
+            from .fake_serpapi import generate_response
+            handler = generate_response
+        self.handler = handler
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def search(self, params):
+        with self._lock:
+            self.requests.append(dict(params))
+        return self.handler(dict(params))
+
+
+class EngineRouter(SearchBackend):
+    """Routes each request by its engine to its own backend, falling back to `default`."""
+
+    def __init__(self, backends, default):
+        self.backends = dict(backends)
+        self.default = default
+
+    def search(self, params):
+        return self.backends.get(params.get('engine'), self.default).search(params)
+
+    def close(self):
+        for backend in {id(backend): backend for backend in [*self.backends.values(), self.default]}.values():
+            backend.close()
+
+
+def open_key_pool(spec):
+    return KeyPool.from_spec(spec) if spec else None
+
+
+def open_backend(base_url=None, timeout=60.0, check_quota=None):
+    # API_KEYS="key1:weight:searches_left,key2,..." spreads requests over several accounts (weight and
+    # searches left are optional, the quota is read from the Account API unless SERPAPI_CHECK_QUOTA=0).
+    # SERPAPI_URL_<ENGINE> and API_KEY_<ENGINE> (e.g. API_KEY_GOOGLE_IMAGES, same format as API_KEYS) give an
+    # engine its own connection pool, endpoint and keys; every other engine shares the default backend
+    if check_quota is None:
+        check_quota = os.environ.get('SERPAPI_CHECK_QUOTA', '1') != '0'
+    default = SerpApiBackend(base_url, open_key_pool(os.environ.get('API_KEYS')), timeout)
+    backends = {}
+    for engine in ENGINES:
+        engine_url = os.environ.get(f'SERPAPI_URL_{engine.upper()}')
+        engine_keys = os.environ.get(f'API_KEY_{engine.upper()}')
+        if engine_url is not None or engine_keys is not None:
+            backends[engine] = SerpApiBackend(engine_url or base_url, open_key_pool(engine_keys) or default.key_pool,
+                                              timeout)
+    if check_quota:
+        pools = {id(backend.key_pool): backend for backend in [default, *backends.values()]
+                 if backend.key_pool is not None}
+        for backend in pools.values():
+            backend.refresh_quota()
+    if not backends:
+        return default
+    logger.info(f'Routing {", ".join(backends)} to their own backends')
+    return EngineRouter(backends, default)
@@ -0,0 +1,209 @@
+import csv
+import logging
+import optparse
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import open_backend
+from .cache import ResponseCache
+from .nativqa_framework import run_nativqa, add_run_options
+from .rate_limit import TokenBucket
+from .search_client import SearchClient
+from .utils import add_log_option, configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FIELDS = ('input_file', 'location', 'gl', 'multiple_countries', 'search_type', 'engine', 'name')
+
+
+def job_name(job):
+    name = f"{job['location']}_{job['gl']}_{job['search_type']}"
+    return re.sub(r'[^\w]+', '_', name).strip('_').lower()
+
+
+def read_manifest(filepath):
+    # csv/tsv with a header row; relative input files are resolved against the manifest directory
+    manifest_dir = os.path.dirname(os.path.abspath(filepath))
+    delimiter = ',' if filepath.endswith('.csv') else '\t'
+    jobs = []
+    names = set()
+    with open(filepath, encoding='utf-8') as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            row = {key.strip(): (value or '').strip() for key, value in row.items() if key is not None}
+            if 'country_code' in row and not row.get('gl'):
+                row['gl'] = row['country_code']
+            if not row.get('input_file') or not row.get('location'):
+                raise ValueError(f'{filepath}: every job needs an input_file and a location')
+            job = {field: row.get(field) or None for field in MANIFEST_FIELDS}
+            job['gl'] = job['gl'] or 'qa'
+            job['search_type'] = job['search_type'] or 'text'
+            job['engine'] = job['engine'] or 'google'
+            job['name'] = job['name'] or job_name(job)
+            if job['name'] in names:
+                raise ValueError(f"{filepath}: duplicate job name '{job['name']}'")
+            names.add(job['name'])
+            if not os.path.isabs(job['input_file']):
+                job['input_file'] = os.path.join(manifest_dir, job['input_file'])
+            jobs.append(job)
+    return jobs
+
+
+class BatchJob:
+    """One manifest entry, run with its own search client on the shared worker pool."""
+
+    def __init__(self, job, client):
+        self.job = job
+        self.name = job['name']
+        self.client = client
+        self.status = 'queued'
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    def throughput(self):
+        elapsed = self.elapsed()
+        return self.client.responses / elapsed if elapsed > 0 else 0.0
+
+    def progress(self):
+        return (f'{self.name} [{self.status}]: {self.client.responses} responses, {self.client.errors} errors, '
+                f'{self.client.retries} retries, {self.throughput():.2f} queries/s')
+
+
+def run_job(batch_job, result_dir, env, n_iter, options):
+    job = batch_job.job
+    batch_job.status = 'running'
+    batch_job.started = time.monotonic()
+    try:
+        run_nativqa(job['engine'], job['search_type'], job['input_file'], job['gl'], job['location'],
+                    job['multiple_countries'], os.path.join(result_dir, batch_job.name), env, n_iter,
+                    client=batch_job.client, **options)
+        batch_job.status = 'done'
+    except SystemExit:
+        # run_nativqa exits on invalid arguments, which must not stop the other jobs
+        batch_job.status = 'failed'
+        batch_job.error = 'invalid job arguments'
+    except Exception as e:
+        batch_job.status = 'failed'
+        batch_job.error = str(e)
+        logger.error(f'Job {batch_job.name} failed: {e}')
+    finally:
+        batch_job.client.close()
+        batch_job.finished = time.monotonic()
+    logger.info(f'Finished {batch_job.progress()}, {batch_job.elapsed():.1f}s')
+    return batch_job
+
+
+def report_progress(batch_jobs, stop, report_interval):
+    started = time.monotonic()
+    while not stop.wait(report_interval):
+        for batch_job in batch_jobs:
+            if batch_job.status == 'running':
+                logger.info(batch_job.progress())
+        n_done = sum(batch_job.status in ('done', 'failed') for batch_job in batch_jobs)
+        n_responses = sum(batch_job.client.responses for batch_job in batch_jobs)
+        logger.info(f'Batch: {n_done}/{len(batch_jobs)} jobs finished, {n_responses} responses, '
+                    f'{n_responses / (time.monotonic() - started):.2f} queries/s')
+
+
+def run_batch(jobs, result_dir, env, n_iter, concurrency=1, rate_limit=None, burst=None, max_retries=3,
+              cache_file=None, cache_ttl=None, cache_max_size=None, max_jobs=8, report_interval=30.0, **options):
+    if concurrency < 1 or max_jobs < 1:
+        logger.error('Concurrency and number of parallel jobs should be at least 1.')
+        sys.exit(1)
+    if result_dir is None:
+        result_dir = 'results'
+    # one API worker pool, rate limiter and response cache for every job
+    rate_limiter = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+    cache = None
+    if cache_file is not None:
+        cache = ResponseCache(cache_file,
+                              ttl=cache_ttl * 3600 if cache_ttl is not None else None,
+                              max_size=int(cache_max_size * 1024 * 1024) if cache_max_size is not None else None)
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='nativqa-search')
+    if env is not None:
+        # per-engine endpoints and keys are read from the API key file when the shared backend is built
+        from dotenv import load_dotenv
+        load_dotenv(env)
+    backend = open_backend()
+    batch_jobs = [BatchJob(job, SearchClient(concurrency, rate_limiter=rate_limiter, max_retries=max_retries,
+                                             cache=cache, executor=executor, backend=backend))
+                  for job in jobs]
+    logger.info(f'Running {len(batch_jobs)} jobs, {min(max_jobs, len(batch_jobs))} at a time, '
+                f'on {concurrency} API workers')
+
+    stop = threading.Event()
+    reporter = threading.Thread(target=report_progress, args=(batch_jobs, stop, report_interval), daemon=True)
+    reporter.start()
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='nativqa-job') as job_executor:
+            list(job_executor.map(lambda batch_job: run_job(batch_job, result_dir, env, n_iter, options),
+                                  batch_jobs))
+    finally:
+        stop.set()
+        reporter.join()
+        executor.shutdown(wait=True)
+        backend.close()
+        if cache is not None:
+            hits, misses = cache.reset_stats()
+            logger.info(f'Response cache: {hits} hits, {misses} misses')
+            cache.close()
+
+    elapsed = time.monotonic() - started
+    n_responses = sum(batch_job.client.responses for batch_job in batch_jobs)
+    failed = [batch_job for batch_job in batch_jobs if batch_job.status == 'failed']
+    logger.info(f'Batch finished in {elapsed:.1f}s: {len(batch_jobs) - len(failed)} jobs done, '
+                f'{len(failed)} failed, {n_responses} responses, {n_responses / max(elapsed, 1e-9):.2f} queries/s')
+    for batch_job in failed:
+        logger.info(f'Failed job {batch_job.name}: {batch_job.error}')
+    return batch_jobs
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-b', '--manifest', action="store", dest="manifest", default=None, type="string",
+                      help='csv/tsv manifest with input_file, location, gl, multiple_countries, search_type, '
+                           'engine and name columns, one job per row')
+    parser.add_option('-o', '--output_dir', action="store", dest="output_dir", default=None, type='string',
+                      help="output directory location, each job writes to a sub-directory named after it")
+    parser.add_option('-e', '--env', action='store', dest='env', default=None, type="string",
+                      help='API key file')
+    parser.add_option('-n', '--n_iter', action='store', dest='n_iter', default=3, type="int",
+                      help='Number of iteration for data scrape')
+    parser.add_option('--max_jobs', action='store', dest='max_jobs', default=8, type="int",
+                      help='Number of jobs running at the same time, all sharing the API worker pool')
+    parser.add_option('--report_interval', action='store', dest='report_interval', default=30.0, type="float",
+                      help='Seconds between per-job progress reports')
+    add_run_options(parser)
+    add_log_option(parser)
+
+    options, args = parser.parse_args()
+    configure_logging(options.log_level)
+    if options.manifest is None:
+        logger.error('manifest file is required!')
+        sys.exit(1)
+    jobs = read_manifest(options.manifest)
+    run_options = vars(options)
+    manifest = run_options.pop('manifest')
+    result_dir = run_options.pop('output_dir')
+    env = run_options.pop('env')
+    n_iter = run_options.pop('n_iter')
+    run_options.pop('log_level')
+    logger.info(f'Read {len(jobs)} jobs from {manifest}')
+    batch_jobs = run_batch(jobs, result_dir, env, n_iter, **run_options)
+    if any(batch_job.status == 'failed' for batch_job in batch_jobs):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from .utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_FIELDS = ('engine', 'q', 'location', 'gl', 'cr', 'safe')
+
+
+def cache_key(search_params):
+    key = {}
+    for field in CACHE_KEY_FIELDS:
+        value = search_params.get(field)
+        key[field] = normalize_query(str(value)) if value is not None else ''
+    for field in ('engine', 'gl', 'safe'):
+        key[field] = key[field].lower()
+    payload = json.dumps(key, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """On-disk SQLite cache of raw SerpAPI responses with TTL and LRU size eviction."""
+
+    def __init__(self, path, ttl=None, max_size=None):
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                           'key TEXT PRIMARY KEY, response BLOB NOT NULL, size INTEGER NOT NULL, '
+                           'created REAL NOT NULL, accessed REAL NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._total_size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        logger.info(f'Response cache at {path}: {len(self)} entries, {self._total_size} bytes')
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def get(self, search_params):
+        key = cache_key(search_params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT response, created FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._delete(key)
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+    def put(self, search_params, response):
+        key = cache_key(search_params)
+        blob = zlib.compress(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._delete(key)
+            self._conn.execute('INSERT INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+                               (key, blob, len(blob), now, now))
+            self._total_size += len(blob)
+            if self.max_size is not None and self._total_size > self.max_size:
+                self._evict()
+
+    def _delete(self, key):
+        row = self._conn.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            self._conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._total_size -= row[0]
+
+    def _evict(self):
+        # drop least recently used entries until the cache is back under 90% of its budget
+        target = self.max_size * 0.9
+        evicted = 0
+        keys = []
+        for key, size in self._conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if self._total_size <= target:
+                break
+            keys.append((key,))
+            self._total_size -= size
+            evicted += 1
+        self._conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+        logger.info(f'Evicted {evicted} entries from the response cache')
+
+    def reset_stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+            self.hits = self.misses = 0
+        return hits, misses
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,116 @@
+import json
+import logging
+
+# pyarrow is imported on first use by load_pyarrow, it takes longer to import than the rest of the package
+pa = pq = None
+
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ('default', 'parquet', 'arrow')
+FILE_EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+ROW_GROUP_SIZE = 65536
+
+# column name -> arrow type name; 'entry' keeps the complete result as JSON
+QA_COLUMNS = (('data_id', 'string'), ('category', 'string'), ('input_query', 'string'), ('question', 'string'),
+              ('answer', 'string'), ('question_type', 'string'), ('answer_URLs', 'string'))
+MEDIA_COLUMNS = {
+    'image': (('data_id', 'string'), ('category', 'string'), ('input_query', 'string'), ('position', 'int64'),
+              ('title', 'string'), ('link', 'string'), ('source', 'string'), ('original', 'string'),
+              ('thumbnail', 'string'), ('original_width', 'int64'), ('original_height', 'int64'),
+              ('entry', 'string')),
+    'video': (('data_id', 'string'), ('category', 'string'), ('input_query', 'string'), ('position', 'int64'),
+              ('title', 'string'), ('link', 'string'), ('displayed_link', 'string'), ('snippet', 'string'),
+              ('duration', 'string'), ('date', 'string'), ('thumbnail', 'string'), ('entry', 'string')),
+}
+
+
+def load_pyarrow():
+    global pa, pq
+    if pa is None:
+        import pyarrow
+        import pyarrow.parquet
+        pa, pq = pyarrow, pyarrow.parquet
+    return pa, pq
+
+
+def check_output_format(output_format):
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format: {output_format}, supported formats are {", ".join(OUTPUT_FORMATS)}')
+    if output_format != 'default':
+        try:
+            load_pyarrow()
+        except ImportError:
+            raise ImportError(f'pyarrow is required for --output_format {output_format}: pip install pyarrow')
+
+
+def output_path(filepath, output_format):
+    # dataset/<name>.tsv -> dataset/<name>.parquet
+    return filepath.rsplit('.', 1)[0] + '.' + FILE_EXTENSIONS[output_format]
+
+
+def _value(value, type_name):
+    if value is None:
+        return None
+    if type_name == 'int64':
+        return value if isinstance(value, int) and not isinstance(value, bool) else None
+    return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+
+
+class ColumnarWriter:
+    """Streams rows to a Parquet or Arrow IPC file, one row group (record batch) at a time."""
+
+    def __init__(self, filepath, columns, output_format='parquet', row_group_size=ROW_GROUP_SIZE):
+        check_output_format(output_format)
+        self.filepath = filepath
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.count = 0
+        self.schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in columns])
+        self._buffer = [[] for _ in columns]
+        if output_format == 'parquet':
+            self._writer = pq.ParquetWriter(filepath, self.schema, compression='zstd')
+        else:
+            self._writer = pa.ipc.new_file(filepath, self.schema)
+
+    def writerow(self, row):
+        # a sequence in column order, as for csv.writer
+        for column, (_, type_name), value in zip(self._buffer, self.columns, row):
+            column.append(_value(value, type_name))
+        self._added()
+
+    def write(self, obj):
+        # a result dict; columns it lacks are null
+        for column, (name, type_name) in zip(self._buffer, self.columns):
+            if name == 'entry':
+                column.append(json.dumps(obj, ensure_ascii=False))
+            else:
+                column.append(_value(obj.get(name), type_name))
+        self._added()
+
+    def _added(self):
+        self.count += 1
+        if len(self._buffer[0]) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer[0]:
+            return
+        batch = pa.RecordBatch.from_arrays([pa.array(column, type=field.type)
+                                            for column, field in zip(self._buffer, self.schema)],
+                                           schema=self.schema)
+        if isinstance(self._writer, pq.ParquetWriter):
+            self._writer.write_batch(batch, row_group_size=self.row_group_size)
+        else:
+            self._writer.write_batch(batch)
+        self._buffer = [[] for _ in self.columns]
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
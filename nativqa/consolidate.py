@@ -0,0 +1,132 @@
+import csv
+import hashlib
+import logging
+import os
+import sqlite3
+
+from .columnar import ColumnarWriter, QA_COLUMNS, MEDIA_COLUMNS
+from .utils import normalize_query, iter_completed_data, find_files, read_json_data, JsonArrayWriter
+
+
+logger = logging.getLogger(__name__)
+
+QA_HEADER = ['data_id', 'category', 'input_query', 'question', 'answer', 'question_type', 'answer_URLs']
+
+
+def qa_key(question, answer, strip_diacritics=False):
+    text = normalize_query(question, strip_diacritics) + '\t' + normalize_query(answer, strip_diacritics)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class SeenSet:
+    """In-memory set of fixed-size keys."""
+
+    def __init__(self):
+        self._keys = set()
+
+    def add(self, key):
+        # returns True when the key was not seen before
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def __len__(self):
+        return len(self._keys)
+
+    def close(self):
+        self._keys.clear()
+
+
+class DiskSeenSet:
+    """SQLite-backed set used when the keys of a very large run should not be held in memory."""
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            os.remove(path)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=OFF')
+        self._conn.execute('PRAGMA synchronous=OFF')
+        self._conn.execute('CREATE TABLE seen (key BLOB PRIMARY KEY) WITHOUT ROWID')
+        self._count = 0
+
+    def add(self, key):
+        cursor = self._conn.execute('INSERT OR IGNORE INTO seen (key) VALUES (?)', (key,))
+        if cursor.rowcount == 1:
+            self._count += 1
+            return True
+        return False
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._conn.close()
+        os.remove(self.path)
+
+
+class TsvWriter:
+    """Tab-separated file with a header row, closed like the columnar writers."""
+
+    def __init__(self, filepath, header):
+        self._f = open(filepath, 'w', encoding='utf-8')
+        self._writer = csv.writer(self._f, delimiter='\t')
+        self._writer.writerow(header)
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_qa_writer(filepath, output_format='default'):
+    if output_format != 'default':
+        return ColumnarWriter(filepath, QA_COLUMNS, output_format)
+    return TsvWriter(filepath, QA_HEADER)
+
+
+def open_media_writer(filepath, search_type, output_format='default'):
+    if output_format != 'default':
+        return ColumnarWriter(filepath, MEDIA_COLUMNS[search_type], output_format)
+    return JsonArrayWriter(filepath)
+
+
+def consolidate_qa(result_dir, dataset_file, duplicate_file, spill=False, strip_diacritics=False,
+                   output_format='default'):
+    seen = DiskSeenSet(dataset_file + '.keys.sqlite') if spill else SeenSet()
+    n_unique = n_duplicate = 0
+    with open_qa_writer(dataset_file, output_format) as unique_writer, \
+            open_qa_writer(duplicate_file, output_format) as duplicate_writer:
+        for file_path in find_files(result_dir, 'all_related_question_answers.tsv'):
+            for row in iter_completed_data(file_path):
+                if row[3] == 'Not Available' or row[4] == 'NA' or not seen.add(
+                        qa_key(row[3], row[4], strip_diacritics)):
+                    duplicate_writer.writerow(row)
+                    n_duplicate += 1
+                else:
+                    unique_writer.writerow(row)
+                    n_unique += 1
+    seen.close()
+    return n_unique, n_duplicate
+
+
+def consolidate_img_vid(result_dir, search_type, dataset_file, duplicate_file, output_format='default'):
+    ids = set()
+    with open_media_writer(dataset_file, search_type, output_format) as filtered_output, \
+            open_media_writer(duplicate_file, search_type, output_format) as duplicate:
+        for file_path in find_files(result_dir, f'{search_type}_results.json'):
+            for obj in read_json_data(file_path):
+                if obj['data_id'] not in ids:
+                    ids.add(obj['data_id'])
+                    filtered_output.write(obj)
+                else:
+                    duplicate.write(obj)
+    return filtered_output.count, duplicate.count
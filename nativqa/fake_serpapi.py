@@ -0,0 +1,263 @@
+import json
+import logging
+import optparse
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+from .rate_limit import TokenBucket
+from .utils import add_log_option, configure_logging, find_files, normalize_query
+
+
+logger = logging.getLogger(__name__)
+
+N_RELATED_QUESTIONS = (1, 4)
+N_RELATED_SEARCHES = (1, 4)
+N_MEDIA_RESULTS = (5, 20)
+
+
+def engine_kind(engine):
+    if 'image' in engine:
+        return 'image'
+    if 'video' in engine:
+        return 'video'
+    return 'text'
+
+
+def generate_response(params):
+    # deterministic stand-in for a query without a recorded response, shaped like a SerpAPI response
+    engine, query = params.get('engine', 'google'), params['q']
+    rng = random.Random(f'{engine}:{query}')
+    response = {'search_metadata': {'status': 'Success'},
+                'search_parameters': {'engine': engine, 'q': query, 'location_requested': params.get('location'),
+                                      'gl': params.get('gl')}}
+    related_searches = []
+    for i in range(rng.randint(*N_RELATED_SEARCHES)):
+        related = f'{query} {rng.choice(("near me", "history", "recipe", "price", "best", "meaning"))} {i}'
+        related_searches.append({'query': related,
+                                 'link': f'https://www.google.com/search?q={related.replace(" ", "+")}'})
+    response['related_searches'] = related_searches
+    kind = engine_kind(engine)
+    if kind == 'text':
+        response['related_questions'] = [
+            {'question': f'{query} question {i}?', 'snippet': f'Answer {rng.randint(0, 9)} for {query}.',
+             'link': f'https://example.com/{rng.getrandbits(32):x}/{i}'}
+            for i in range(rng.randint(*N_RELATED_QUESTIONS))]
+        return response
+    response['suggested_searches'] = [{'name': search['query'], 'link': search['link']} for search in related_searches]
+    key = 'images_results' if kind == 'image' else 'video_results'
+    results = []
+    for i in range(rng.randint(*N_MEDIA_RESULTS)):
+        url = f'https://example.com/{kind}/{rng.getrandbits(48):x}'
+        result = {'position': i + 1, 'title': f'{query} {i}', 'link': url, 'thumbnail': url + '/thumb'}
+        if kind == 'image':
+            result.update(original=url + '.jpg', original_width=640, original_height=480)
+        results.append(result)
+    response[key] = results
+    return response
+
+
+class ResponseStore:
+    """Recorded responses keyed by search kind and normalized query, loaded from summary.jsonl files."""
+
+    def __init__(self, paths=(), generate=True):
+        self.generate = generate
+        self._responses = {}
+        for path in paths:
+            self.load(path)
+
+    def load(self, path):
+        # a summary.jsonl file, or a result directory searched for them
+        files = [path] if path.endswith('.jsonl') else find_files(path, 'summary.jsonl')
+        n_before = len(self._responses)
+        for filepath in files:
+            with open(filepath, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        params = json.loads(line)['search_parameters']
+                    except (ValueError, KeyError):
+                        continue
+                    key = (engine_kind(params.get('engine', 'google')), normalize_query(params['q']))
+                    self._responses.setdefault(key, line.strip().encode('utf-8'))
+        logger.info(f'Loaded {len(self._responses) - n_before} recorded responses from {path}')
+
+    def __len__(self):
+        return len(self._responses)
+
+    def get(self, params):
+        # response body, or None when the query was not recorded and generation is off
+        body = self._responses.get((engine_kind(params.get('engine', 'google')), normalize_query(params['q'])))
+        if body is None and self.generate:
+            body = json.dumps(generate_response(params), ensure_ascii=False).encode('utf-8')
+        return body
+
+
+class FakeSerpApi:
+    """Local SerpAPI-compatible HTTP server with configurable latency, server errors and 429s."""
+
+    def __init__(self, store=None, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, rate_limit=None, burst=None, retry_after=1, seed=None, quota=None):
+        self.store = store if store is not None else ResponseStore()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limiter = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        self.retry_after = retry_after
+        # searches per API key, None for unlimited
+        self.quota = quota
+        self.searches = {}
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def respond(self, params):
+        # (status, body, headers) for one request
+        with self._lock:
+            self.requests += 1
+            draw = self._random.random()
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+        throttled = self.rate_limiter is not None and not self.rate_limiter.try_acquire()
+        if throttled or draw < self.throttle_rate:
+            with self._lock:
+                self.throttled += 1
+            return 429, {'error': 'Too many requests, please slow down.'}, {'Retry-After': str(self.retry_after)}
+        if draw < self.throttle_rate + self.error_rate:
+            with self._lock:
+                self.errors += 1
+            return 500, {'error': 'Internal server error.'}, {}
+        if 'q' not in params:
+            return 400, {'error': 'Missing query `q` parameter.'}, {}
+        if self.quota is not None:
+            with self._lock:
+                used = self.searches.get(params.get('api_key'), 0)
+                if used >= self.quota:
+                    return 429, {'error': 'Your account has run out of searches.'}, {}
+                self.searches[params.get('api_key')] = used + 1
+        body = self.store.get(params)
+        if body is None:
+            return 200, {'search_metadata': {'status': 'Success'}, 'search_parameters': params,
+                         'error': "Google hasn't returned any results for this query."}, {}
+        return 200, body, {}
+
+    def account(self, api_key):
+        # the part of the SerpAPI Account API that the key pool reads
+        with self._lock:
+            used = self.searches.get(api_key, 0)
+        left = None if self.quota is None else self.quota - used
+        return {'api_key': api_key, 'this_month_usage': used, 'total_searches_left': left,
+                'plan_searches_left': left}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = dict(parse_qsl(url.query))
+                if url.path == '/search':
+                    status, body, headers = fake.respond(params)
+                elif url.path == '/account':
+                    status, body, headers = 200, fake.account(params.get('api_key')), {}
+                else:
+                    status, body, headers = 404, {'error': f'Unknown path {url.path}'}, {}
+                if not isinstance(body, bytes):
+                    body = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), name='fake-serpapi',
+                                        daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-r', '--replay', action='append', dest='replay', default=[], type="string",
+                      help='summary.jsonl file or result directory whose responses are replayed (repeatable)')
+    parser.add_option('--no_generate', action='store_false', dest='generate', default=True,
+                      help='Answer queries that were not recorded with an empty result instead of a generated one')
+    parser.add_option('--host', action='store', dest='host', default='127.0.0.1', type="string",
+                      help='Address to listen on')
+    parser.add_option('-p', '--port', action='store', dest='port', default=8000, type="int",
+                      help='Port to listen on (0 picks a free port)')
+    parser.add_option('--latency', action='store', dest='latency', default=0.0, type="float",
+                      help='Seconds added to every response')
+    parser.add_option('--jitter', action='store', dest='jitter', default=0.0, type="float",
+                      help='Up to this many seconds added at random on top of --latency')
+    parser.add_option('--error_rate', action='store', dest='error_rate', default=0.0, type="float",
+                      help='Fraction of requests answered with HTTP 500')
+    parser.add_option('--throttle_rate', action='store', dest='throttle_rate', default=0.0, type="float",
+                      help='Fraction of requests answered with HTTP 429')
+    parser.add_option('--rate_limit', action='store', dest='rate_limit', default=None, type="float",
+                      help='Requests per second above which requests are answered with HTTP 429')
+    parser.add_option('--burst', action='store', dest='burst', default=None, type="int",
+                      help='Number of requests allowed in a burst above --rate_limit')
+    parser.add_option('--retry_after', action='store', dest='retry_after', default=1, type="int",
+                      help='Retry-After seconds sent with HTTP 429')
+    parser.add_option('--quota', action='store', dest='quota', default=None, type="int",
+                      help='Searches per API key before HTTP 429 "out of searches" (default: unlimited)')
+    parser.add_option('--seed', action='store', dest='seed', default=None, type="int",
+                      help='Random seed for latency, errors and 429s')
+    add_log_option(parser)
+
+    options, args = parser.parse_args()
+    configure_logging(options.log_level)
+    store = ResponseStore(options.replay, options.generate)
+    fake = FakeSerpApi(store, options.host, options.port, options.latency, options.jitter, options.error_rate,
+                       options.throttle_rate, options.rate_limit, options.burst, options.retry_after, options.seed,
+                       options.quota)
+    # the URL goes to stdout first so that a parent process can read it when --port 0 is used
+    print(fake.url, flush=True)
+    logger.info(f'Serving {len(store)} recorded responses on {fake.url}, set SERPAPI_URL={fake.url} to use it')
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.server.server_close()
+        logger.info(f'{fake.requests} requests, {fake.errors} errors, {fake.throttled} throttled')
+
+
+if __name__ == "__main__":
+    main()
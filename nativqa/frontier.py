@@ -0,0 +1,65 @@
+import hashlib
+import logging
+
+from .utils import normalize_query
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryFrontier:
+    """Candidate queries for the next iteration, deduplicated and ranked by how many parents suggested them."""
+
+    def __init__(self, completed=None, max_size=None, category_quota=None, strip_diacritics=False):
+        self.completed = completed
+        self.max_size = max_size
+        self.category_quota = category_quota
+        self.strip_diacritics = strip_diacritics
+        # normalized query -> [category, query, number of parents, insertion order]
+        self._entries = {}
+        self._skipped = set()
+        self._edges = set()
+
+    def add(self, category, query, parent=None):
+        query = query.strip()
+        if not query or query == 'Not Available':
+            return False
+        key = normalize_query(query, self.strip_diacritics)
+        if key in self._skipped:
+            return False
+        entry = self._entries.get(key)
+        if entry is None:
+            if self.completed is not None and query in self.completed:
+                self._skipped.add(key)
+                return False
+            entry = self._entries[key] = [category.strip(), query, 0, len(self._entries)]
+        if parent is None or self._add_edge(key, parent):
+            entry[2] += 1
+        return entry[2] == 1
+
+    def _add_edge(self, key, parent):
+        edge = hashlib.blake2b(f'{key}\t{normalize_query(parent, self.strip_diacritics)}'.encode('utf-8'),
+                               digest_size=8).digest()
+        if edge in self._edges:
+            return False
+        self._edges.add(edge)
+        return True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def select(self):
+        ranked = sorted(self._entries.values(), key=lambda entry: (-entry[2], entry[3]))
+        selected = []
+        per_category = {}
+        for category, query, _, _ in ranked:
+            if self.max_size is not None and len(selected) >= self.max_size:
+                break
+            if self.category_quota is not None:
+                if per_category.get(category, 0) >= self.category_quota:
+                    continue
+                per_category[category] = per_category.get(category, 0) + 1
+            selected.append([category, query])
+        logger.info(f'Query frontier: {len(self._entries)} candidates, {len(selected)} selected, '
+                    f'{len(self._skipped)} already completed')
+        return selected
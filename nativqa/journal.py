@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from .utils import normalize_query, open_jsonl_append
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def query_id(query, strip_diacritics=False):
+    return hashlib.blake2b(normalize_query(query, strip_diacritics).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class QueryJournal:
+    """Append-only, fsync'd record of per-query state for one iteration.
+
+    A ``done`` record stores the size of summary.jsonl after the response was written. Records are
+    group-committed only after summary.jsonl itself has been fsync'd, so summary lines past the last
+    committed offset belong to queries that are still outstanding and can be dropped on restart.
+    """
+
+    def __init__(self, path, strip_diacritics=False, sync_every=100, sync_interval=1.0):
+        self.path = path
+        self.strip_diacritics = strip_diacritics
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        # query id -> [state, attempts]
+        self.states = {}
+        self.summary_offset = 0
+        self.summary_file = None
+        self._buffer = []
+        self._last_sync = time.monotonic()
+        n_records = self._replay()
+        if n_records > 2 * len(self.states) + 1000:
+            self._compact()
+        self._f = open_jsonl_append(path)
+
+    def _replay(self):
+        n_records = 0
+        if not os.path.exists(self.path):
+            return n_records
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # torn write of the last record, it was never committed
+                    break
+                n_records += 1
+                if record.get('id') is not None:
+                    self.states[record['id']] = [record['state'], record.get('attempts', 0)]
+                if 'offset' in record:
+                    self.summary_offset = max(self.summary_offset, record['offset'])
+        return n_records
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'offset': self.summary_offset}) + '\n')
+            for qid, (state, attempts) in self.states.items():
+                f.write(json.dumps({'id': qid, 'state': state, 'attempts': attempts}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def id(self, query):
+        return query_id(query, self.strip_diacritics)
+
+    def state(self, query):
+        entry = self.states.get(self.id(query))
+        return entry[0] if entry is not None else None
+
+    def attempts(self, query):
+        entry = self.states.get(self.id(query))
+        return entry[1] if entry is not None else 0
+
+    def _record(self, text, state, **extra):
+        qid = self.id(text)
+        entry = self.states.setdefault(qid, [state, 0])
+        entry[0] = state
+        if state == IN_FLIGHT:
+            entry[1] += 1
+        record = {'id': qid, 'state': state, 'attempts': entry[1]}
+        record.update(extra)
+        self._buffer.append(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def add_pending(self, data, commit=True):
+        added = 0
+        for example in data:
+            if self.id(example[1]) not in self.states:
+                self._record(example[1], PENDING, query=example[1].strip(), category=example[0])
+                added += 1
+        if commit:
+            self.commit()
+        return added
+
+    def outstanding(self, data):
+        return [example for example in data if self.state(example[1]) != DONE]
+
+    def track(self, data):
+        # marks each query in flight as the request engine pulls it for submission
+        for example in data:
+            self.start(example)
+            yield example
+
+    def start(self, example):
+        self._record(example[1], IN_FLIGHT)
+
+    def bind_summary(self, summary_file):
+        self.summary_file = summary_file
+
+    def done(self, example):
+        self.summary_file.flush()
+        self._record(example[1], DONE, offset=os.fstat(self.summary_file.fileno()).st_size)
+        self._maybe_commit()
+
+    def failed(self, example, error):
+        self._record(example[1], FAILED, error=error)
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        if len(self._buffer) >= self.sync_every or time.monotonic() - self._last_sync >= self.sync_interval:
+            self.commit()
+
+    def commit(self):
+        if self.summary_file is not None:
+            self.summary_file.flush()
+            os.fsync(self.summary_file.fileno())
+        if self._buffer:
+            self._f.writelines(self._buffer)
+            self._buffer = []
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._last_sync = time.monotonic()
+
+    def counts(self):
+        counts = {}
+        for state, _ in self.states.values():
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def close(self):
+        self.commit()
+        self._f.close()
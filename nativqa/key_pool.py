@@ -0,0 +1,101 @@
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# SerpAPI answers a search on an account without searches left with HTTP 429 and this message
+OUT_OF_SEARCHES = 'run out of searches'
+
+
+def mask_key(key):
+    return f'...{key[-4:]}'
+
+
+class ApiKey:
+    def __init__(self, key, weight=1, remaining=None):
+        if weight <= 0:
+            raise ValueError('API key weight should be greater than 0')
+        self.key = key
+        self.weight = weight
+        # searches left on the account, None until known
+        self.remaining = remaining
+        self.requests = 0
+        self.errors = 0
+        self.retired = None
+        self.current = 0
+
+
+class KeyPool:
+    """Spreads requests across API keys by smooth weighted round-robin and retires exhausted keys."""
+
+    def __init__(self, keys):
+        self.keys = {api_key.key: api_key for api_key in keys}
+        if not self.keys:
+            raise ValueError('at least one API key is required')
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec):
+        # "key1:2,key2,key3:1:5000" -> key, optional weight, optional searches left
+        keys = []
+        for entry in spec.split(','):
+            parts = entry.strip().split(':')
+            if not parts[0]:
+                continue
+            weight = float(parts[1]) if len(parts) > 1 and parts[1] else 1
+            remaining = int(parts[2]) if len(parts) > 2 and parts[2] else None
+            keys.append(ApiKey(parts[0], weight, remaining))
+        return cls(keys)
+
+    @property
+    def active(self):
+        return [api_key for api_key in self.keys.values() if api_key.retired is None]
+
+    def acquire(self):
+        # None when every key is retired
+        with self._lock:
+            active = self.active
+            if not active:
+                return None
+            total = 0
+            best = None
+            for api_key in active:
+                api_key.current += api_key.weight
+                total += api_key.weight
+                if best is None or api_key.current > best.current:
+                    best = api_key
+            best.current -= total
+            best.requests += 1
+            if best.remaining is not None:
+                best.remaining -= 1
+                if best.remaining <= 0:
+                    self._retire(best, 'quota used up')
+            return best.key
+
+    def set_remaining(self, key, remaining):
+        with self._lock:
+            api_key = self.keys[key]
+            api_key.remaining = remaining
+            if remaining <= 0:
+                self._retire(api_key, 'no searches left')
+
+    def record_error(self, key):
+        with self._lock:
+            self.keys[key].errors += 1
+
+    def retire(self, key, reason):
+        with self._lock:
+            self._retire(self.keys[key], reason)
+
+    def _retire(self, api_key, reason):
+        if api_key.retired is None:
+            api_key.retired = reason
+            logger.warning(f'Retiring API key {mask_key(api_key.key)} ({reason}), '
+                           f'{len(self.active)} of {len(self.keys)} keys left')
+
+    def stats(self):
+        with self._lock:
+            return {mask_key(api_key.key): {'requests': api_key.requests, 'errors': api_key.errors,
+                                            'remaining': api_key.remaining, 'retired': api_key.retired}
+                    for api_key in self.keys.values()}
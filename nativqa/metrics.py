@@ -0,0 +1,182 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        # cumulative bucket counts keyed by upper bound, as in the Prometheus exposition format
+        buckets = {}
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            buckets['+Inf' if bound == math.inf else str(bound)] = total
+        return {'buckets': buckets, 'count': self.count, 'sum': round(self.sum, 6)}
+
+
+class Metrics:
+    """Thread-safe run metrics: counters, per-stage wall-clock timers and a request latency histogram.
+
+    Everything only grows during a run; per-iteration figures are the difference of two snapshots.
+    """
+
+    def __init__(self, tracing=False):
+        self.counters = {}
+        self.stages = {}
+        self.latency = Histogram()
+        self._lock = threading.Lock()
+        self._tracer = None
+        if tracing:
+            try:
+                from opentelemetry import trace
+            except ImportError:
+                raise ImportError('opentelemetry-api is required for --otel: pip install opentelemetry-api')
+            self._tracer = trace.get_tracer('nativqa')
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            self.latency.observe(seconds)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+            stage['seconds'] += seconds
+            stage['count'] += 1
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        started = time.perf_counter()
+        if self._tracer is None:
+            try:
+                yield
+            finally:
+                self.add_stage(name, time.perf_counter() - started)
+            return
+        with self._tracer.start_as_current_span(f'nativqa.{name}', attributes=attributes):
+            try:
+                yield
+            finally:
+                self.add_stage(name, time.perf_counter() - started)
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters),
+                    'stages': {name: {'seconds': round(stage['seconds'], 6), 'count': stage['count']}
+                               for name, stage in self.stages.items()},
+                    'request_latency_seconds': self.latency.to_dict()}
+
+    def prometheus(self):
+        # Prometheus text exposition format
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot['counters'].items()):
+            lines += [f'# TYPE nativqa_{name}_total counter', f'nativqa_{name}_total {value}']
+        lines.append('# TYPE nativqa_stage_seconds_total counter')
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(f'nativqa_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}')
+        lines.append('# TYPE nativqa_stage_runs_total counter')
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(f'nativqa_stage_runs_total{{stage="{name}"}} {stage["count"]}')
+        latency = snapshot['request_latency_seconds']
+        lines.append('# TYPE nativqa_request_latency_seconds histogram')
+        for bound, count in latency['buckets'].items():
+            lines.append(f'nativqa_request_latency_seconds_bucket{{le="{bound}"}} {count}')
+        lines += [f'nativqa_request_latency_seconds_sum {latency["sum"]}',
+                  f'nativqa_request_latency_seconds_count {latency["count"]}']
+        return '\n'.join(lines) + '\n'
+
+
+def timed(metrics, name):
+    # metrics.stage(name), or nothing when the caller has no metrics
+    return nullcontext() if metrics is None else metrics.stage(name)
+
+
+def metrics_delta(after, before):
+    # what happened between two snapshots
+    if isinstance(after, dict):
+        return {key: metrics_delta(value, before.get(key, 0 if not isinstance(value, dict) else {}))
+                for key, value in after.items()}
+    return round(after - before, 6) if isinstance(after, float) else after - before
+
+
+def metrics_sum(first, second):
+    # counterpart of metrics_delta: the metrics of two runs over the same work
+    if isinstance(first, dict):
+        merged = dict(first)
+        for key, value in second.items():
+            merged[key] = metrics_sum(first[key], value) if key in first else value
+        return merged
+    total = first + second
+    return round(total, 6) if isinstance(total, float) else total
+
+
+def dir_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def write_metrics(filepath, snapshot, merge=False):
+    # adds the derived throughput figures and writes one JSON file; with merge, the figures already in the
+    # file (from an earlier, interrupted run over the same iteration) are added up instead of overwritten
+    if merge and os.path.exists(filepath):
+        with open(filepath, encoding='utf-8') as f:
+            previous = json.load(f)
+        previous.pop('queries_per_second', None)
+        snapshot = metrics_sum(previous, snapshot)
+    fetch = snapshot['stages'].get('fetch', {}).get('seconds', 0)
+    snapshot = dict(snapshot, stages={name: stage for name, stage in snapshot['stages'].items() if stage['count']},
+                    queries_per_second=round(snapshot['counters'].get('responses', 0) / fetch, 2) if fetch else None)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    logger.info(f'writing metrics to: {filepath}')
+
+
+def serve_metrics(metrics, port, host='0.0.0.0'):
+    # /metrics for Prometheus, served from a daemon thread until server.shutdown()
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, args=(0.5,), name='nativqa-metrics', daemon=True).start()
+    logger.info(f'Serving Prometheus metrics on http://{host}:{server.server_address[1]}/metrics')
+    return server
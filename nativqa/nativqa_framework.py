@@ -5,351 +5,485 @@ import sys
 import json
 import csv
 import logging
-from dotenv import load_dotenv
-from pathlib import Path
-from tqdm import tqdm
 import hashlib
-from urllib.parse import urlparse
-from urllib.parse import parse_qs
-from serpapi import GoogleSearch
+import heapq
+import itertools
+from concurrent.futures import wait, FIRST_COMPLETED
+from contextlib import ExitStack, nullcontext
 from shutil import copyfile
 
-from .utils import (read_seed_queries,
+from .archive import ResponseArchive, read_archived_queries
+from .cache import ResponseCache
+from .columnar import (ColumnarWriter, QA_COLUMNS, MEDIA_COLUMNS, OUTPUT_FORMATS, check_output_format,
+                       output_path)
+from .consolidate import QA_HEADER, consolidate_qa, consolidate_img_vid
+from .frontier import QueryFrontier
+from .journal import QueryJournal, DONE, query_id
+from .metrics import Metrics, dir_size, metrics_delta, serve_metrics, timed, write_metrics
+from .query_index import CompletedQueryIndex
+from .rate_limit import TokenBucket
+from .records import (get_id_hash, normalize_response, iter_records, ResponseRecord, QARecord,
+                      SearchRecord)
+from .search_client import SearchClient, SearchError
+from .task_queue import open_task_queue
+from .utils import (add_log_option,
+                    configure_logging,
+                    normalize_query,
+                    read_seed_queries,
                     ensure_directory,
-                    read_failed_data,
-                    read_summary_data,
-                    write_init_summary,
-                    write_file,
+                    iter_summary_data,
+                    open_jsonl_append,
+                    JsonArrayWriter,
                     write_csv_file,
+                    find_files,
                     read_completed_data,
+                    iter_completed_data,
                     read_txt_data,
                     write_txt_file,
                     read_json_data)
 
 
-urllib3_logger = logging.getLogger('urllib3')
-urllib3_logger.setLevel(logging.CRITICAL)
 logger = logging.getLogger(__name__)
-logging.basicConfig(format='%(asctime)s %(module)s %(filename)s:%(lineno)s - %(message)s',
-                    encoding='utf-8', level=logging.DEBUG)
 
 
-def extract_completed_img_vid_queries(output_dir):
-    output = []
-    completed_queries = []
+def extract_completed_img_vid_queries(output_dir, strip_diacritics=False):
+    completed_queries = {}
     for root, dirs, files in os.walk(output_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            if file_path.endswith("original_response.json"):
-                with open(file_path) as f:
-                    data = json.load(f)
-                for result in data:
-                    if 'search_parameters' in result:
-                        completed_queries.append(result['search_parameters']['q'])
+        # the archive index is the cheapest to read, then original_response.json of older runs, then the summary
+        if "responses.idx" in files:
+            queries = read_archived_queries(root)
+        elif "original_response.json" in files:
+            queries = (result['search_parameters']['q']
+                       for result in read_json_data(os.path.join(root, "original_response.json"))
+                       if 'search_parameters' in result)
+        elif "summary.jsonl" in files:
+            queries = (result['search_parameters']['q']
+                       for result in iter_summary_data(os.path.join(root, "summary.jsonl"))
+                       if 'search_parameters' in result)
+        else:
+            continue
+        for query in queries:
+            completed_queries.setdefault(normalize_query(query, strip_diacritics), query)
 
     output_file = os.path.join(output_dir, 'completed_queries.txt')
     logger.info(f'Total completed queries: {len(completed_queries)}')
     logger.info(f'writing completed queries to: {output_file}')
-    write_txt_file(output_file, completed_queries)
+    write_txt_file(output_file, completed_queries.values())
     return output_file
 
 
-def extract_completed_queries(output_dir):
-    output = []
-    completed_queries = []
+def extract_completed_queries(output_dir, strip_diacritics=False):
+    # normalized query -> first spelling seen, in insertion order
+    completed_queries = {}
     for root, dirs, files in os.walk(output_dir):
         for file in files:
             file_path = os.path.join(root, file)
             if file_path.endswith("all_related_question_answers.tsv"):
-                data = read_completed_data(file_path)
-                output.extend(data)
-    for row in output:
-        if row[2].strip() not in completed_queries:
-            completed_queries.append(row[2].strip())
+                for row in read_completed_data(file_path):
+                    completed_queries.setdefault(normalize_query(row[2], strip_diacritics), row[2].strip())
 
     output_file = os.path.join(output_dir, 'completed_queries.txt')
     logger.info(f'Total completed queries: {len(completed_queries)}')
     logger.info(f'writing completed queries to: {output_file}')
-    write_txt_file(output_file, completed_queries)
+    write_txt_file(output_file, completed_queries.values())
     return output_file
 
-def video_scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None):
-    # engine = 'google_videos'
-    search_params = {
-        "engine": engine,
-        "q": "",
-        "location": location,
-        "gl": gl,
-        # "safe": "active",
-        # "cr": "countryJO|countryEG|countryPS|countryMA|countryLB|countryAE|countryKW|countrySA",
-        "api_key": os.getenv('API_KEY')
-    }
-    # if mc is not None:
-    #     search_params['cr'] = mc
-    # print(data)
-    for example in tqdm(data, desc="API request processing"):
-        category, query = example[0], example[1]
-        search_params['q'] = query.strip()
-        try:
-            search = GoogleSearch(search_params)
-            response = search.get_dict()
-            # output_response.append(response)
-            # print(response)
-            response['search_parameters']['category'] = category
-            suggested_srch = []
-            if 'suggested_searches' in response:
-                for entry in response['suggested_searches']:
-                    hash_str = entry['link']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    parsed_url = urlparse(entry['link'])
-                    query = parse_qs(parsed_url.query)['q'][0]
-                    entry['query'] = query
-                    entry['category'] = category
-                    suggested_srch.append(entry)
-                response['suggested_searches'] = suggested_srch
-            rel_resp = []
-            if 'related_searches' in response:
-                for entry in response['related_searches']:
-                    hash_str = entry['link']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    entry['category'] = category
-                    rel_resp.append(entry)
-                response['related_searches'] = rel_resp
-            img_resp = []
-            if 'video_results' in response:
-                for entry in response['video_results']:
-                    hash_str = entry['link']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    entry['category'] = category
-                    img_resp.append(entry)
-                response['video_results'] = img_resp
-            summary_writer.write(f"{json.dumps(response, ensure_ascii=False)}\n")
-        except Exception as e:
-            logger.error(e)
-            entry = {"query": query, "category": category, "Error": str(e)}
-            failed_writer.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
-
-
-def image_scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None):
-    # engine = 'google_images'
+def get_search_params(search_type, engine, location, gl, mc=None):
     search_params = {
         "engine": engine,
-        "q": "",
         "location": location,
         "gl": gl,
-        "safe": "active",
         # "cr": "countryJO|countryEG|countryPS|countryMA|countryLB|countryAE|countryKW|countrySA",
         "api_key": os.getenv('API_KEY')
     }
-    if mc is not None:
-        search_params['cr'] = mc
-    for example in tqdm(data, desc="API request processing"):
-        category, query = example[0], example[1]
-        search_params['q'] = query.strip()
-        try:
-            search = GoogleSearch(search_params)
-            response = search.get_dict()
-            # output_response.append(response)
-            response['search_parameters']['category'] = category
-            suggested_srch = []
-            if 'suggested_searches' in response:
-                for entry in response['suggested_searches']:
-                    hash_str = entry['link']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    parsed_url = urlparse(entry['link'])
-                    query = parse_qs(parsed_url.query)['q'][0]
-                    entry['query'] = query
-                    entry['category'] = category
-                    suggested_srch.append(entry)
-                response['suggested_searches'] = suggested_srch
-            rel_resp = []
-            if 'related_searches' in response:
-                for entry in response['related_searches']:
-                    hash_str = entry['link']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    entry['category'] = category
-                    rel_resp.append(entry)
-                response['related_searches'] = rel_resp
-            img_resp = []
-            if 'images_results' in response:
-                for entry in response['images_results']:
-                    hash_str = entry['original']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    entry['category'] = category
-                    img_resp.append(entry)
-                response['images_results'] = img_resp
-            summary_writer.write(f"{json.dumps(response, ensure_ascii=False)}\n")
-        except Exception as e:
-            logger.error(e)
-            entry = {"query": query, "category": category, "Error": str(e)}
-            failed_writer.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
-
-
-def scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None):
-    search_params = {
-        "engine": engine,
-        "q": "",
-        "location": location,
-        "gl": gl,
-        "safe": "active",
-        # "cr": "countryJO|countryEG|countryPS|countryMA|countryLB|countryAE|countryKW|countrySA",
-        "api_key": os.getenv('API_KEY')
-    }
-    # output_response = []
-    if mc is not None:
-        search_params['cr'] = mc
-    for example in tqdm(data, desc="API request processing"):
-        category, query = example[0], example[1]
-        search_params['q'] = query.strip()
-        try:
-            search = GoogleSearch(search_params)
-            response = search.get_dict()
-            # output_response.append(response)
-            response['search_parameters']['category'] = category
-            resp = []
-            if 'related_questions' in response:
-                for entry in response['related_questions']:
-                    hash_str = response['search_parameters']['q'] + " " + entry['question']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    resp.append(entry)
-                response['related_questions'] = resp
-            qa_resp = []
-            if 'questions_and_answers' in response:
-                for entry in response['questions_and_answers']:
-                    hash_str = response['search_parameters']['q'] + " " + entry['question']
-                    hash_id = hashlib.md5(hash_str.encode())
-                    entry['data_id'] = hash_id.hexdigest()
-                    qa_resp.append(entry)
-                response['questions_and_answers'] = qa_resp
-            summary_writer.write(f"{json.dumps(response, ensure_ascii=False)}\n")
-        except Exception as e:
-            logger.error(e)
-            entry = {"query": query, "category": category, "Error": str(e)}
-            failed_writer.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
-
-
-
-def gen_img_vid_output_files(working_dir, summary, search_type="image"):
-    output_data = read_summary_data(summary)
-    out_file = os.path.join(working_dir, 'original_response.json')
-    logger.info(f'writing response to: {out_file}...')
-    write_file(out_file, output_data)
-    rel_search = []
-    sug_search = []
-    img_result = []
-    for results in output_data:
-        category = results['search_parameters']['category']
-        query = results['search_parameters']['q']
-        if 'related_searches' in results:
-            for entry in results['related_searches']:
-                rel_search.append(entry)
-        if 'suggested_searches' in results:
-            for entry in results['suggested_searches']:
-                sug_search.append(entry)
-        if search_type == "image":
-            if 'images_results' in results:
-                for entry in results['images_results']:
-                    entry['category'] = category
-                    entry['input_query'] = query
-                    img_result.append(entry)
-        else:
-            if "video_results" in results:
-                for entry in results['video_results']:
-                    entry['category'] = category
-                    entry['input_query'] = query
-                    img_result.append(entry)
-
-    out_file = os.path.join(working_dir, 'related_search.json')
-    logger.info(f'writing related questions to: {out_file}...')
-    write_file(out_file, rel_search)
-    out_file = os.path.join(working_dir, 'suggested_search.json')
-    logger.info(f'writing questions answers to: {out_file}...')
-    write_file(out_file, sug_search)
-    out_file = os.path.join(working_dir, f'{search_type}_results.json')
-    logger.info(f'writing questions answers to: {out_file}...')
-    write_file(out_file, img_result)
-
-
-def generate_output_files(working_dir, summary):
-    output_data = read_summary_data(summary)
-    out_file = os.path.join(working_dir, 'original_response.json')
-    logger.info(f'writing response to: {out_file}...')
-    write_file(out_file, output_data)
-    # category = get_category(summary)
-    header = ['data_id', 'category', 'input_query', 'question', 'answer', 'question_type', 'answer_URLs']
-    rqa_resp = [header]
-    rquestion_resp = []
-    qa_response = []
-    rsearch_resp = [['category', 'seed_query', 'related_query']]
-
-    for results in output_data:
-        null_entry = True
-        category = results['search_parameters']['category']
-        if 'related_searches' in results:
-            for relq in results['related_searches']:
-                if 'query' in relq:
-                    rsearch_resp.append([category, results['search_parameters']["q"], relq['query']])
-        if 'related_questions' in results:
-            null_entry = False
-            for entry in results['related_questions']:
-                ans = ''
-                if 'snippet' in entry:
-                    ans = entry['snippet']
-                elif 'list' in entry:
-                    ans = "\n".join(entry['list'])
-                if "link" in entry:
-                    rqa_resp.append([entry['data_id'], category, results['search_parameters']["q"], entry['question'], ans,
-                                     'related_questions', entry['link']])
-            rq = {'search_parameters': results['search_parameters'], 'related_questions': results['related_questions']}
-            rquestion_resp.append(rq)
-        if 'questions_and_answers' in results:
-            null_entry = False
-            for entry in results['related_questions']:
-                # print(entry)
-                if 'answer' in entry:
-                    rqa_resp.append(
-                        [entry['data_id'], category, results['search_parameters']["q"], entry['question'],
-                         entry['answer'], 'questions_and_answers', entry['link']])
-            rq = {'search_parameters': results['search_parameters'],
-                  'questions_and_answers': results['questions_and_answers']}
-            qa_response.append(rq)
-        if null_entry:
-            if 'search_parameters' in results:
-                rqa_resp.append([None, category, results['search_parameters']["q"], 'Not Available', 'NA', 'NA', 'NA'])
-
-    out_file = os.path.join(working_dir, 'related_questions.json')
-    logger.info(f'writing related questions to: {out_file}...')
-    write_file(out_file, rquestion_resp)
-    out_file = os.path.join(working_dir, 'questions_answers.json')
-    logger.info(f'writing questions answers to: {out_file}...')
-    write_file(out_file, qa_response)
-
-    out_file = os.path.join(working_dir, 'all_related_question_answers.tsv')
-    logger.info(f'writing all related question answers to: {out_file}...')
-    write_csv_file(out_file, rqa_resp)
-    # unique_qa = [rqa_resp[0]]
-    # temp = []
-    # for row in rqa_resp[1:]:
-    #     if row[3].strip() not in temp and row[3] !='NA':
-    #         temp.append(row[3].strip())
-    #         unique_qa.append(row)
-    # out_file = working_dir + f'/{folder_name}_unique_questions.tsv'
-    # print(f'writing response to: {out_file}...')
-    # write_csv_file(out_file, unique_qa, delim='\t')
-
-    out_file = os.path.join(working_dir, 'related_search.tsv')
-    logger.info(f'writing related search to: {out_file}...')
-    write_csv_file(out_file, rsearch_resp)
-
-
-def run_nativqa(engine, search_type, input_file, gl, location, multiple_country, result_dir, env, n_iter):
+    # video search runs without safe search and country restriction
+    if search_type != 'video':
+        search_params['safe'] = 'active'
+        if mc is not None:
+            search_params['cr'] = mc
+    return search_params
+
+
+def record_response(search_type, example, response, error, summary_writer, failed_writer, completed_index=None,
+                    journal=None, id_hash=None, normalized=False):
+    category, query = example[0], example[1]
+    try:
+        if error is not None:
+            raise error
+        if not normalized:
+            response = normalize_response(response, search_type, category, id_hash)
+        summary_writer.write(f"{json.dumps(response, ensure_ascii=False)}\n")
+        if completed_index is not None:
+            completed_index.add(response['search_parameters']['q'])
+        if journal is not None:
+            journal.done(example)
+        return response
+    except Exception as e:
+        logger.error(e)
+        entry = {"query": query, "category": category, "Error": str(e)}
+        failed_writer.write(f"{json.dumps(entry, ensure_ascii=False)}\n")
+        if journal is not None:
+            journal.failed(example, str(e))
+        return None
+
+
+def expand_response(search_type, response):
+    # queries suggested by a response, as [category, query] candidates for the next iteration
+    for record in iter_records(response, search_type):
+        if isinstance(record, QARecord) and record.question_type != 'NA':
+            yield [record.category, record.question]
+        elif isinstance(record, SearchRecord) and record.query is not None:
+            yield [record.category, record.query]
+
+
+def run_scrape(search_type, engine, data, location, gl, summary_writer, failed_writer, mc=None, client=None,
+               completed_index=None, journal=None, id_hash=None):
+    search_params = get_search_params(search_type, engine, location, gl, mc)
+    if client is None:
+        client = SearchClient()
+    total = len(data)
+    if journal is not None:
+        data = journal.track(data)
+    responses = client.iter_responses(search_params, data)
+    from tqdm import tqdm
+    for example, response, error in tqdm(responses, total=total, desc="API request processing"):
+        with timed(client.metrics, 'record'):
+            record_response(search_type, example, response, error, summary_writer, failed_writer, completed_index,
+                            journal, id_hash)
+
+
+def run_queue_scrape(task_queue, group, search_type, engine, data, location, gl, summary_writer, failed_writer,
+                     mc=None, completed_index=None, journal=None, id_hash='md5', poll_interval=1.0, metrics=None):
+    # coordinator side of a distributed run: workers fetch and process the queries, results are recorded here
+    search_params = get_search_params(search_type, engine, location, gl, mc)
+    # workers sign requests with their own API key
+    search_params.pop('api_key')
+    tasks = [{'id': f'{group}:{query_id(example[1])}', 'group': group, 'category': example[0],
+              'query': example[1].strip(), 'search_type': search_type, 'id_hash': id_hash, 'params': search_params}
+             for example in data]
+    task_queue.put(tasks)
+    if journal is not None:
+        for example in data:
+            journal.start(example)
+    remaining = {task['id'] for task in tasks}
+    from tqdm import tqdm
+    with tqdm(total=len(tasks), desc="Queued query processing") as progress:
+        while remaining:
+            finished = task_queue.drain(group)
+            if not finished:
+                time.sleep(poll_interval)
+                continue
+            for task in finished:
+                if task['id'] not in remaining:
+                    # finished in an earlier run of the coordinator and already recorded
+                    continue
+                remaining.discard(task['id'])
+                error = SearchError(task['error']) if task['state'] != DONE else None
+                with timed(metrics, 'record'):
+                    record_response(search_type, [task['category'], task['query']], task['result'], error,
+                                    summary_writer, failed_writer, completed_index, journal, normalized=True)
+                progress.update(1)
+
+
+def video_scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None, client=None,
+                 completed_index=None, journal=None, id_hash=None):
+    run_scrape('video', engine, data, location, gl, summary_writer, failed_writer, mc, client, completed_index,
+               journal, id_hash)
+
+
+def image_scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None, client=None,
+                 completed_index=None, journal=None, id_hash=None):
+    run_scrape('image', engine, data, location, gl, summary_writer, failed_writer, mc, client, completed_index,
+               journal, id_hash)
+
+
+def scrape(engine, data, location, gl, summary_writer, failed_writer, mc=None, client=None,
+           completed_index=None, journal=None, id_hash=None):
+    run_scrape('text', engine, data, location, gl, summary_writer, failed_writer, mc, client, completed_index,
+               journal, id_hash)
+
+
+def open_iteration(output_dir, strip_diacritics=False):
+    summary = os.path.join(output_dir, 'summary.jsonl')
+    failed = os.path.join(output_dir, 'failed.jsonl')
+    journal_file = os.path.join(output_dir, 'journal.jsonl')
+    new_journal = not os.path.exists(journal_file)
+    journal = QueryJournal(journal_file, strip_diacritics)
+    # summary lines past the last checkpoint have no durable 'done' record, they are fetched again
+    summary_writer = open_jsonl_append(summary, None if new_journal else journal.summary_offset)
+    journal.bind_summary(summary_writer)
+    if new_journal and os.path.getsize(summary) > 0:
+        # output directory from a run that predates the journal
+        logger.info(f'Recording scraped queries of {summary} in {journal_file}')
+        for results in iter_summary_data(summary):
+            journal.done([results['search_parameters']['category'], results['search_parameters']['q']])
+    failed_writer = open(failed, 'w', encoding='utf-8')
+    return journal, summary_writer, failed_writer
+
+
+def run_pipeline(search_type, engine, query_name, location, gl, result_dir, n_iter, mc=None, client=None,
+                 completed_index=None, strip_diacritics=False, max_frontier=None, category_quota=None,
+                 id_hash=None):
+    # Fetches all iterations from one queue: the children of a response are queued for the next
+    # iteration as soon as it arrives, and shallower iterations are always submitted first.
+    search_params = get_search_params(search_type, engine, location, gl, mc)
+    if client is None:
+        client = SearchClient()
+    iterations = {}
+    seen = set()
+    queue = []
+    order = itertools.count()
+    n_queries = {}
+    n_category = {}
+    from tqdm import tqdm
+    progress = tqdm(total=0, desc="API request processing")
+
+    def open_depth(depth):
+        working_dir = os.path.join(result_dir, f'iteration_{depth}')
+        output_dir = os.path.join(working_dir, 'output')
+        ensure_directory(output_dir)
+        journal, summary_writer, failed_writer = open_iteration(output_dir, strip_diacritics)
+        query_file = os.path.join(working_dir, query_name)
+        new_file = not os.path.exists(query_file) or os.path.getsize(query_file) == 0
+        data = [] if new_file else read_seed_queries(query_file, strip_diacritics)
+        query_f = open(query_file, 'a', encoding='utf-8')
+        query_writer = csv.writer(query_f, delimiter=',' if query_file.endswith('.csv') else '\t')
+        if new_file:
+            query_writer.writerow(['topic', 'query'])
+            query_f.flush()
+        iterations[depth] = {'output_dir': output_dir, 'journal': journal, 'summary_writer': summary_writer,
+                             'failed_writer': failed_writer, 'query_f': query_f, 'query_writer': query_writer}
+        for example in data:
+            schedule(depth, example, new=False)
+        if depth < n_iter:
+            # restart: re-expand the responses that are already in the summary
+            for response in iter_summary_data(os.path.join(output_dir, 'summary.jsonl')):
+                for child in expand_response(search_type, response):
+                    schedule(depth + 1, child)
+        return iterations[depth]
+
+    def schedule(depth, example, new=True):
+        category, query = example[0].strip(), example[1].strip()
+        if not query or query == 'Not Available':
+            return
+        key = normalize_query(query, strip_diacritics)
+        if key in seen:
+            return
+        if depth not in iterations:
+            open_depth(depth)
+        if key in seen:
+            return
+        if new:
+            if completed_index is not None and query in completed_index:
+                seen.add(key)
+                return
+            if max_frontier is not None and n_queries.get(depth, 0) >= max_frontier:
+                return
+            if category_quota is not None and n_category.get((depth, category), 0) >= category_quota:
+                return
+        seen.add(key)
+        n_queries[depth] = n_queries.get(depth, 0) + 1
+        n_category[(depth, category)] = n_category.get((depth, category), 0) + 1
+        it = iterations[depth]
+        example = [category, query]
+        if new:
+            it['query_writer'].writerow(example)
+            it['query_f'].flush()
+        if it['journal'].state(query) == DONE:
+            return
+        it['journal'].add_pending([example], commit=False)
+        heapq.heappush(queue, (depth, next(order), example))
+        progress.total += 1
+
+    for depth in range(1, n_iter + 1):
+        if depth == 1 or (depth not in iterations and
+                          os.path.exists(os.path.join(result_dir, f'iteration_{depth}', query_name))):
+            open_depth(depth)
+    window = client.concurrency * 4
+    in_flight = {}
+    while queue or in_flight:
+        while queue and len(in_flight) < window:
+            depth, _, example = heapq.heappop(queue)
+            iterations[depth]['journal'].start(example)
+            in_flight[client.submit(search_params, example[1])] = (depth, example)
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            depth, example = in_flight.pop(future)
+            _, response, error = client.collect(example, future)
+            it = iterations[depth]
+            with timed(client.metrics, 'record'):
+                response = record_response(search_type, example, response, error, it['summary_writer'],
+                                           it['failed_writer'], completed_index, it['journal'], id_hash)
+            progress.update(1)
+            if response is not None and depth < n_iter:
+                for child in expand_response(search_type, response):
+                    schedule(depth + 1, child)
+    progress.close()
+
+    for depth in sorted(iterations):
+        it = iterations[depth]
+        logger.info(f'Iteration {depth} query states: {it["journal"].counts()}')
+        it['journal'].close()
+        it['summary_writer'].close()
+        it['failed_writer'].close()
+        it['query_f'].close()
+    return [iterations[depth]['output_dir'] for depth in sorted(iterations)]
+
+
+class TeeWriter:
+    """Writes every response to several writers and closes all of them."""
+
+    def __init__(self, *writers):
+        self.writers = writers
+
+    def write(self, response):
+        for writer in self.writers:
+            writer.write(response)
+
+    def close(self):
+        with ExitStack() as stack:
+            for writer in self.writers:
+                stack.callback(writer.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_response_writer(working_dir, strip_diacritics=False, original_response=False, response_archive=False):
+    # summary.jsonl already holds every raw response; further copies are only written on request
+    writers = []
+    if response_archive:
+        logger.info(f'writing response archive to: {os.path.join(working_dir, "responses.archive")}...')
+        writers.append(ResponseArchive(working_dir, strip_diacritics))
+    if original_response:
+        response_file = os.path.join(working_dir, 'original_response.json')
+        logger.info(f'writing response to: {response_file}...')
+        writers.append(JsonArrayWriter(response_file))
+    if not writers:
+        return nullcontext()
+    return writers[0] if len(writers) == 1 else TeeWriter(*writers)
+
+
+def gen_img_vid_output_files(working_dir, summary, search_type="image", output_format='default',
+                             strip_diacritics=False, original_response=False, response_archive=False):
+    rel_file = os.path.join(working_dir, 'related_search.json')
+    sug_file = os.path.join(working_dir, 'suggested_search.json')
+    result_file = os.path.join(working_dir, f'{search_type}_results.json')
+    logger.info(f'writing related search to: {rel_file}...')
+    logger.info(f'writing suggested search to: {sug_file}...')
+    logger.info(f'writing {search_type} results to: {result_file}...')
+    # columnar copy of the results, the JSON file is still read by consolidation
+    columnar = None
+    if output_format != 'default':
+        columnar = ColumnarWriter(output_path(result_file, output_format), MEDIA_COLUMNS[search_type], output_format)
+    try:
+        with open_response_writer(working_dir, strip_diacritics, original_response,
+                                  response_archive) as response_writer, \
+                JsonArrayWriter(rel_file) as rel_search, \
+                JsonArrayWriter(sug_file) as sug_search, JsonArrayWriter(result_file) as img_result:
+            search_writers = {'related_searches': rel_search, 'suggested_searches': sug_search}
+            for results in iter_summary_data(summary):
+                for record in iter_records(results, search_type):
+                    if isinstance(record, ResponseRecord):
+                        if response_writer is not None:
+                            response_writer.write(record.response)
+                    elif isinstance(record, SearchRecord):
+                        search_writers[record.kind].write(record.entry)
+                    else:
+                        img_result.write(record.entry)
+                        if columnar is not None:
+                            columnar.write(record.entry)
+    finally:
+        if columnar is not None:
+            columnar.close()
+
+
+def generate_output_files(working_dir, summary, output_format='default', strip_diacritics=False,
+                          original_response=False, response_archive=False):
+    rq_file = os.path.join(working_dir, 'related_questions.json')
+    qa_file = os.path.join(working_dir, 'questions_answers.json')
+    rqa_file = os.path.join(working_dir, 'all_related_question_answers.tsv')
+    rs_file = os.path.join(working_dir, 'related_search.tsv')
+    logger.info(f'writing related questions to: {rq_file}...')
+    logger.info(f'writing questions answers to: {qa_file}...')
+    logger.info(f'writing all related question answers to: {rqa_file}...')
+    logger.info(f'writing related search to: {rs_file}...')
+    # columnar copy of the QA pairs, the TSV is still read by query expansion and consolidation
+    columnar = None
+    if output_format != 'default':
+        columnar = ColumnarWriter(output_path(rqa_file, output_format), QA_COLUMNS, output_format)
+    try:
+        with open_response_writer(working_dir, strip_diacritics, original_response,
+                                  response_archive) as response_writer, \
+                JsonArrayWriter(rq_file) as rquestion_resp, \
+                JsonArrayWriter(qa_file) as qa_response, open(rqa_file, 'w', encoding='utf-8') as f_rqa, \
+                open(rs_file, 'w', encoding='utf-8') as f_rs:
+            rqa_resp = csv.writer(f_rqa, delimiter='\t')
+            rqa_resp.writerow(QA_HEADER)
+            rsearch_resp = csv.writer(f_rs, delimiter='\t')
+            rsearch_resp.writerow(['category', 'seed_query', 'related_query'])
+
+            for results in iter_summary_data(summary):
+                for record in iter_records(results, 'text'):
+                    if isinstance(record, QARecord):
+                        rqa_resp.writerow(record)
+                        if columnar is not None:
+                            columnar.writerow(record)
+                    elif isinstance(record, SearchRecord):
+                        rsearch_resp.writerow([record.category, record.input_query, record.query])
+                    else:
+                        if response_writer is not None:
+                            response_writer.write(record.response)
+                        if 'related_questions' in results:
+                            rquestion_resp.write({'search_parameters': results['search_parameters'],
+                                                  'related_questions': results['related_questions']})
+                        if 'questions_and_answers' in results:
+                            qa_response.write({'search_parameters': results['search_parameters'],
+                                               'questions_and_answers': results['questions_and_answers']})
+    finally:
+        if columnar is not None:
+            columnar.close()
+
+
+def expand_iteration(search_type, result_dir, depth, input_file, output_dir, completed_index, max_frontier=None,
+                     category_quota=None, strip_diacritics=False):
+    # writes the query file of iteration `depth` from the outputs in `output_dir`, returns it with its output dir
+    working_dir = os.path.join(result_dir, f'iteration_{depth}')
+    ensure_directory(working_dir)
+    query_file = os.path.join(working_dir, os.path.basename(input_file))
+    next_output_dir = os.path.join(working_dir, 'output')
+    if os.path.exists(os.path.join(next_output_dir, 'journal.jsonl')):
+        # the next iteration already started in an earlier run, keep its query file
+        return query_file, next_output_dir
+    frontier = QueryFrontier(completed_index, max_frontier, category_quota, strip_diacritics)
+    if search_type == 'text':
+        result_file = os.path.join(output_dir, 'all_related_question_answers.tsv')
+        for row in iter_completed_data(result_file):
+            frontier.add(row[1], row[3], parent=row[2])
+
+        rs_file = os.path.join(output_dir, 'related_search.tsv')
+        for row in iter_completed_data(rs_file):
+            frontier.add(row[0], row[2], parent=row[1])
+    else:
+        rs_file = os.path.join(output_dir, 'related_search.json')
+        sug_file = os.path.join(output_dir, 'suggested_search.json')
+        for obj in read_json_data(rs_file) + read_json_data(sug_file):
+            frontier.add(obj['category'], obj['query'], parent=obj.get('input_query'))
+    output_data = [['topic', 'query']] + frontier.select()
+    write_csv_file(query_file, output_data)
+    ensure_directory(next_output_dir)
+    return query_file, next_output_dir
+
+
+def run_nativqa(engine, search_type, input_file, gl, location, multiple_country, result_dir, env, n_iter,
+                concurrency=1, rate_limit=None, burst=None, max_retries=3, cache_file=None, cache_ttl=None,
+                cache_max_size=None, strip_diacritics=False, dedup_spill=False, max_frontier=None,
+                category_quota=None, pipeline=False, client=None, task_queue=None, id_hash='md5',
+                output_format='default', original_response=False, backend=None, otel=False, metrics_port=None,
+                response_archive=False):
     accepted_input_file = ['csv', 'tsv']
     accepted_search_engine = ['google', 'yahoo', 'bing']
     if engine.lower() in accepted_search_engine:
@@ -386,20 +520,46 @@ def run_nativqa(engine, search_type, input_file, gl, location, multiple_country,
     if n_iter < 1:
         logger.error('Number of iteration should be more than 1.')
         logger.info('The number of iteration set to default value 3.')
-    if env is None:
+    if concurrency < 1:
+        logger.error('Concurrency should be at least 1.')
+        sys.exit(1)
+    if rate_limit is not None and rate_limit <= 0:
+        logger.error('Rate limit should be greater than 0 requests per second.')
+        sys.exit(1)
+    if max_retries < 0:
+        logger.error('Number of retries should not be negative.')
+        sys.exit(1)
+    if (max_frontier is not None and max_frontier < 1) or (category_quota is not None and category_quota < 1):
+        logger.error('Frontier size and category quota should be at least 1.')
+        sys.exit(1)
+    try:
+        id_hash_fn = get_id_hash(id_hash)
+        check_output_format(output_format)
+        metrics = Metrics(tracing=otel)
+    except (ValueError, ImportError) as e:
+        logger.error(e)
+        sys.exit(1)
+    if pipeline and task_queue is not None:
+        logger.error('Pipelined iterations are not supported with a task queue.')
+        sys.exit(1)
+    # a coordinator never calls SerpAPI itself, the workers load their own API key
+    if env is None and task_queue is None:
         logger.error('API key file is required to use SerpApi!')
         sys.exit(1)
-    else:
+    elif env is not None and task_queue is None:
+        from dotenv import load_dotenv
         load_dotenv(env)
-        if os.getenv('API_KEY') is None:
-            logger.error('API_KEY not found in the system environment!')
+        if os.getenv('API_KEY') is None and os.getenv('API_KEYS') is None:
+            logger.error('API_KEY or API_KEYS not found in the system environment!')
             sys.exit(1)
     folder_name = os.path.splitext(os.path.basename(input_file))[0]
     if result_dir is None:
         result_dir = f'./results/{search_type}/'+ folder_name
     else:
-        result_dir = f'./{result_dir}/{search_type}/'+ folder_name
+        result_dir = os.path.join(result_dir, search_type, folder_name)
     ensure_directory(result_dir)
+    run_id = hashlib.blake2b(os.path.abspath(result_dir).encode('utf-8'), digest_size=8).hexdigest()
+    metrics_server = serve_metrics(metrics, metrics_port) if metrics_port is not None else None
 
     working_dir = os.path.join(result_dir, 'iteration_1')
     ensure_directory(working_dir)
@@ -411,193 +571,198 @@ def run_nativqa(engine, search_type, input_file, gl, location, multiple_country,
         logger.info(f'Copying file to {working_dir}')
         copyfile(input_file, query_file)
 
-    for iteration in range(n_iter):
-        # working_dir = os.path.join(result_dir, f'iteration_{iteration+1}')
-        # ensure_directory(working_dir)
-        # output_dir = os.path.join(working_dir, 'output')
-        # ensure_directory(output_directory)
-
+    # a client passed in (batch runs) is shared with other jobs, together with its rate limiter and cache
+    own_client = client is None
+    cache = None
+    if own_client:
+        rate_limiter = TokenBucket(rate_limit, burst) if rate_limit is not None else None
+        if cache_file is not None:
+            cache = ResponseCache(cache_file,
+                                  ttl=cache_ttl * 3600 if cache_ttl is not None else None,
+                                  max_size=int(cache_max_size * 1024 * 1024) if cache_max_size is not None else None)
+        client = SearchClient(concurrency, rate_limiter=rate_limiter, max_retries=max_retries, cache=cache,
+                              backend=backend)
+    client.metrics = metrics
+
+    def log_cache_stats(label, since):
+        # counted by this run's client, the cache itself may be shared with other batch jobs
+        if client.cache is None:
+            return
+        counters = metrics_delta(metrics.snapshot(), since)['counters']
+        logger.info(f'{label}: {counters.get("cache_hits", 0)} hits, {counters.get("cache_misses", 0)} misses')
+
+    def generate_outputs(output_dir):
         summary = os.path.join(output_dir, 'summary.jsonl')
-        failed = os.path.join(output_dir, 'failed.jsonl')
-
-        if not os.path.exists(failed):
-            check_cache = False
-        else:
-            check_cache = True
-        failed_data = []
-        if check_cache:
-            failed_data = read_failed_data(failed)
-
-        # get summary
-        summary_data = []
-        if os.path.exists(summary):
-            summary_data = read_summary_data(summary)
-        summary_writer = open(summary, 'w', encoding='utf-8')
-        if len(summary_data) > 0:
-            logger.info('writing initial summary')
-            summary_writer = write_init_summary(summary_writer, summary_data)
-        failed_writer = open(failed, 'w', encoding='utf-8')
-        # read data
-        logger.info(f'reading file: {query_file}...')
-        data = read_seed_queries(query_file)
-        if len(failed_data) > 0:
-            if len(failed_data) + len(summary_data) != len(data):
-                # print("scrapping both failed and rest data")
-                logger.info(f'Skipping total data: {len(summary_data)}')
-                # print("failed, continuing from failed first followed by summary")
-                # first try to scrape failed data, then try to scrape rest
-                if search_type == 'text':
-                    scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-                elif search_type == 'video':
-                    video_scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-                else:
-                    image_scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-                start_index = len(failed_data) + len(summary_data)
-                data = data[start_index:]
-                if search_type == 'text':
-                    scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                elif search_type == 'video':
-                    video_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                else:
-                    image_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-            else:
-                # scrape only failed data
-                # print("scrapping only failed data")
-                if search_type == 'text':
-                    scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-                elif search_type == 'video':
-                    video_scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-                else:
-                    image_scrape(engine, failed_data, location, gl, summary_writer, failed_writer, multiple_country)
-        else:
-            # no failed data, need to check summary data
-            if len(summary_data) == len(data):
-                logger.info('All the data is scraped!')
-            elif len(summary_data) > 0:
-                # print("No failed, only continuing from summary")
-                logger.info(f'Skipping total data: {len(summary_data)}')
-                data = data[len(summary_data):]
-                if search_type == 'text':
-                    scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                elif search_type == 'video':
-                    video_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                else:
-                    image_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-            else:
-                # starting from input file
-                # print("starting from input file")
-                if search_type == 'text':
-                    scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                elif search_type == 'video':
-                    video_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-                else:
-                    image_scrape(engine, data, location, gl, summary_writer, failed_writer, multiple_country)
-        summary_writer.close()
-        failed_writer.close()
-        if search_type == 'text':
-            generate_output_files(output_dir, summary)
-            completed_query_file = extract_completed_queries(result_dir)
-        else:
-            gen_img_vid_output_files(output_dir, summary, search_type)
-            completed_query_file = extract_completed_img_vid_queries(result_dir)
-
-        if iteration < (n_iter - 1):
-            working_dir = os.path.join(result_dir, f'iteration_{iteration + 2}')
-            ensure_directory(working_dir)
-            query_file = os.path.join(working_dir, os.path.basename(input_file))
-            output_data = [['topic', 'query']]
-            completed_query = read_txt_data(completed_query_file)
+        with metrics.stage('generate_outputs'):
+            metrics.incr('bytes_read', os.path.getsize(summary))
             if search_type == 'text':
-                result_file = os.path.join(output_dir, 'all_related_question_answers.tsv')
-                search_result = read_completed_data(result_file)
-                for row in search_result:
-                    if row[3].strip() == 'Not Available':
-                        continue
-                    if row[3].strip() not in completed_query and row[3].strip() not in output_data:
-                        output_data.append([row[1].strip(), row[3].strip()])
-
-                rs_file = os.path.join(output_dir, 'related_search.tsv')
-                rsearch_data = read_completed_data(rs_file)
-                for row in rsearch_data:
-                    if row[2].strip() == 'Not Available':
-                        continue
-                    if row[2].strip() not in completed_query and row[2].strip() not in output_data:
-                        output_data.append([row[0].strip(), row[2].strip()])
+                generate_output_files(output_dir, summary, output_format, strip_diacritics, original_response,
+                                      response_archive)
             else:
-                rs_file = os.path.join(output_dir, 'related_search.json')
-                sug_file = os.path.join(output_dir, 'suggested_search.json')
-                rs_data = read_json_data(rs_file)
-                sug_data = read_json_data(sug_file)
-                for obj in rs_data:
-                    output_data.append([obj['category'], obj['query']])
-                for obj in sug_data:
-                    output_data.append([obj['category'], obj['query']])
-            write_csv_file(query_file, output_data)
-            output_dir = os.path.join(working_dir, 'output')
-            ensure_directory(output_dir)
-
-    # merge data and consolidate final QA pair
-    if search_type == 'text':
-        header = ['data_id', 'category', 'input_query', 'question', 'answer', 'question_type', 'answer_URLs']
-        output = []
-        filtered_output = [header]
-
-        duplicate = [header]
-
-        for root, dirs, files in os.walk(result_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file_path.endswith("all_related_question_answers.tsv"):
-                    data = read_completed_data(file_path)
-                    output.extend(data)
-
-        for row in output:
-            flag = False
-            for data in filtered_output:
-                if row[3].strip() == data[3].strip() and row[4].strip() == data[4].strip():
-                    flag = True
-                if row[3] == 'Not Available' or row[4] == 'NA':
-                    flag = True
-            if not flag:
-                filtered_output.append(row)
+                gen_img_vid_output_files(output_dir, summary, search_type, output_format, strip_diacritics,
+                                         original_response, response_archive)
+
+    completed_query_file = os.path.join(result_dir, 'completed_queries.txt')
+    index_file = os.path.join(result_dir, 'completed_queries.sqlite')
+    new_index = not os.path.exists(index_file)
+    completed_index = CompletedQueryIndex(index_file, strip_diacritics)
+    with metrics.stage('index_rebuild'):
+        if new_index and find_files(result_dir, 'summary.jsonl'):
+            # result directory from a run that predates the index: rebuild it once from the outputs
+            logger.info(f'Building completed query index: {index_file}')
+            if search_type == 'text':
+                extract_completed_queries(result_dir, strip_diacritics)
             else:
-                duplicate.append(row)
+                extract_completed_img_vid_queries(result_dir, strip_diacritics)
+            completed_index.add_many(read_txt_data(completed_query_file))
+            completed_index.mark_exported()
+
+    if pipeline:
+        # iterations overlap, so only the run-level metrics.json is written
+        pipeline_metrics = metrics.snapshot()
+        with metrics.stage('fetch'):
+            output_dirs = run_pipeline(search_type, engine, os.path.basename(input_file), location, gl,
+                                       result_dir, n_iter, multiple_country, client, completed_index,
+                                       strip_diacritics, max_frontier, category_quota, id_hash_fn)
+        for output_dir in output_dirs:
+            generate_outputs(output_dir)
+        log_cache_stats('Response cache', pipeline_metrics)
+        n_new = completed_index.export_new(completed_query_file)
+        logger.info(f'Total completed queries: {len(completed_index)} ({n_new} new)')
     else:
-        filtered_output = []
-        ids = []
-        duplicate = []
-        for root, dirs, files in os.walk(result_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file_path.endswith(f"{search_type}_results.json"):
-                    data = read_json_data(file_path)
-                    for obj in data:
-                        if obj['data_id'] not in ids:
-                            ids.append(obj['data_id'])
-                            filtered_output.append(obj)
-                        else:
-                            duplicate.append(obj)
+        for iteration in range(n_iter):
+            # working_dir = os.path.join(result_dir, f'iteration_{iteration+1}')
+            # ensure_directory(working_dir)
+            # output_dir = os.path.join(working_dir, 'output')
+            # ensure_directory(output_directory)
+
+            # per-iteration figures are the difference of two snapshots of the run metrics
+            iteration_metrics = metrics.snapshot()
+            output_bytes = dir_size(output_dir)
+            journal, summary_writer, failed_writer = open_iteration(output_dir, strip_diacritics)
+            # read data
+            logger.info(f'reading file: {query_file}...')
+            with metrics.stage('read_queries'):
+                metrics.incr('bytes_read', os.path.getsize(query_file))
+                data = read_seed_queries(query_file, strip_diacritics)
+                journal.add_pending(data)
+                outstanding = journal.outstanding(data)
+            metrics.incr('queries', len(outstanding))
+            if len(outstanding) == 0:
+                logger.info('All the data is scraped!')
+            else:
+                logger.info(f'Skipping total data: {len(data) - len(outstanding)}')
+                with metrics.stage('fetch'):
+                    if task_queue is not None:
+                        # tasks are namespaced by run so that several coordinators can share one queue
+                        group = f'{run_id}:{iteration + 1}'
+                        run_queue_scrape(task_queue, group, search_type, engine, outstanding, location, gl,
+                                         summary_writer, failed_writer, multiple_country, completed_index,
+                                         journal, id_hash, metrics=metrics)
+                    else:
+                        run_scrape(search_type, engine, outstanding, location, gl, summary_writer, failed_writer,
+                                   multiple_country, client, completed_index, journal, id_hash_fn)
+            logger.info(f'Iteration {iteration + 1} query states: {journal.counts()}')
+            journal.close()
+            summary_writer.close()
+            failed_writer.close()
+            log_cache_stats(f'Iteration {iteration + 1} response cache', iteration_metrics)
+            generate_outputs(output_dir)
+            n_new = completed_index.export_new(completed_query_file)
+            logger.info(f'Total completed queries: {len(completed_index)} ({n_new} new)')
+            metrics.incr('bytes_written', max(dir_size(output_dir) - output_bytes, 0))
+
+            iteration_dir = output_dir
+            if iteration < (n_iter - 1):
+                with metrics.stage('expand'):
+                    query_file, output_dir = expand_iteration(search_type, result_dir, iteration + 2, input_file,
+                                                              output_dir, completed_index, max_frontier,
+                                                              category_quota, strip_diacritics)
+            write_metrics(os.path.join(iteration_dir, 'metrics.json'),
+                          metrics_delta(metrics.snapshot(), iteration_metrics), merge=True)
+
+    if own_client:
+        client.close()
+    completed_index.close()
+    if cache is not None:
+        cache.close()
 
+    # merge data and consolidate final QA pair
     dataset_dir = os.path.join(result_dir, 'dataset')
     ensure_directory(dataset_dir)
     if search_type == 'text':
         dataset_file = os.path.join(dataset_dir, f'{folder_name}.tsv')
         duplicate_file = os.path.join(dataset_dir, f'{folder_name}.duplicate_qa.tsv')
-        logger.info(f'Total unique data collected: {len(filtered_output)}')
-        logger.info(f'Total duplicate data collected: {len(duplicate)}')
+        if output_format != 'default':
+            dataset_file = output_path(dataset_file, output_format)
+            duplicate_file = output_path(duplicate_file, output_format)
         logger.info(f'writing output to: {dataset_file}')
-        write_csv_file(dataset_file, filtered_output)
         logger.info(f'writing duplicate to: {duplicate_file}')
-        write_csv_file(duplicate_file, duplicate)
+        with metrics.stage('consolidate'):
+            n_unique, n_duplicate = consolidate_qa(result_dir, dataset_file, duplicate_file, dedup_spill,
+                                                   strip_diacritics, output_format)
+        logger.info(f'Total unique data collected: {n_unique}')
+        logger.info(f'Total duplicate data collected: {n_duplicate}')
     else:
         dataset_file = os.path.join(dataset_dir, f'{folder_name}.json')
         duplicate_file = os.path.join(dataset_dir, f'{folder_name}.duplicate_qa.json')
-        logger.info(f'Total unique data collected: {len(filtered_output)}')
-        logger.info(f'Total duplicate data collected: {len(duplicate)}')
+        if output_format != 'default':
+            dataset_file = output_path(dataset_file, output_format)
+            duplicate_file = output_path(duplicate_file, output_format)
         logger.info(f'writing output to: {dataset_file}')
-        write_file(dataset_file, filtered_output)
         logger.info(f'writing duplicate to: {duplicate_file}')
-        write_file(duplicate_file, duplicate)
+        with metrics.stage('consolidate'):
+            n_unique, n_duplicate = consolidate_img_vid(result_dir, search_type, dataset_file, duplicate_file,
+                                                        output_format)
+        logger.info(f'Total unique data collected: {n_unique}')
+        logger.info(f'Total duplicate data collected: {n_duplicate}')
+    metrics.incr('bytes_written', sum(os.path.getsize(path) for path in (dataset_file, duplicate_file)
+                                      if os.path.exists(path)))
+    write_metrics(os.path.join(result_dir, 'metrics.json'), metrics.snapshot(), merge=True)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+
+def add_run_options(parser):
+    # options shared by the single-run and batch command lines
+    parser.add_option('--concurrency', action='store', dest='concurrency', default=1, type="int",
+                      help='Number of concurrent API requests')
+    parser.add_option('--rate_limit', action='store', dest='rate_limit', default=None, type="float",
+                      help='Maximum API requests per second (default: unlimited)')
+    parser.add_option('--burst', action='store', dest='burst', default=None, type="int",
+                      help='Number of requests allowed in a burst above the rate limit')
+    parser.add_option('--max_retries', action='store', dest='max_retries', default=3, type="int",
+                      help='Number of retries on HTTP 429/5xx before a query is marked as failed')
+    parser.add_option('--cache', action='store', dest='cache_file', default=None, type="string",
+                      help='SQLite file used to cache API responses across runs')
+    parser.add_option('--cache_ttl', action='store', dest='cache_ttl', default=None, type="float",
+                      help='Hours after which a cached response expires (default: never)')
+    parser.add_option('--cache_max_size', action='store', dest='cache_max_size', default=None, type="float",
+                      help='Maximum cache size in MB, least recently used responses are evicted first')
+    parser.add_option('--strip_diacritics', action='store_true', dest='strip_diacritics', default=False,
+                      help='Ignore Arabic diacritics and tatweel when deduplicating queries')
+    parser.add_option('--dedup_spill', action='store_true', dest='dedup_spill', default=False,
+                      help='Keep final deduplication keys on disk instead of in memory (for very large runs)')
+    parser.add_option('--max_frontier', action='store', dest='max_frontier', default=None, type="int",
+                      help='Maximum number of queries in each expanded iteration (default: unlimited)')
+    parser.add_option('--category_quota', action='store', dest='category_quota', default=None, type="int",
+                      help='Maximum number of queries per category in each expanded iteration (default: unlimited)')
+    parser.add_option('--pipeline', action='store_true', dest='pipeline', default=False,
+                      help='Start fetching the next iteration while the current one is still running')
+    parser.add_option('--output_format', action='store', dest='output_format', default='default', type="choice",
+                      choices=list(OUTPUT_FORMATS),
+                      help='Also write QA pairs and image/video results as parquet or arrow, and the dataset in '
+                           'that format instead of tsv/json (needs pyarrow)')
+    parser.add_option('--id_hash', action='store', dest='id_hash', default='md5', type="choice",
+                      choices=['md5', 'blake2b', 'xxhash'],
+                      help='Hash used for data ids: md5 (default, compatible with earlier runs), blake2b or xxhash')
+    parser.add_option('--original_response', action='store_true', dest='original_response', default=False,
+                      help='Also write raw responses to original_response.json, as before the response archive')
+    parser.add_option('--response_archive', action='store_true', dest='response_archive', default=False,
+                      help='Also write raw responses to a compressed archive indexed by query (responses.archive)')
+    parser.add_option('--otel', action='store_true', dest='otel', default=False,
+                      help='Emit an OpenTelemetry span for every stage of the run (needs opentelemetry-api)')
+
 
 def main():
     parser = optparse.OptionParser()
@@ -620,8 +785,16 @@ def main():
                       help='API key file')
     parser.add_option('-n', '--n_iter', action='store', dest='n_iter', default=3, type="int",
                       help='Number of iteration for data scrape')
+    add_run_options(parser)
+    add_log_option(parser)
+    parser.add_option('-q', '--queue', action='store', dest='queue', default=None, type="string",
+                      help='Run as coordinator: put queries on this task queue (sqlite:///path or '
+                           'redis://host:port/db) for `python -m nativqa.worker` processes to fetch')
+    parser.add_option('--metrics_port', action='store', dest='metrics_port', default=None, type="int",
+                      help='Serve run metrics for Prometheus on http://0.0.0.0:PORT/metrics')
 
     options, args = parser.parse_args()
+    configure_logging(options.log_level)
     engine = options.engine
     search_type = options.search_type
     input_file = options.input_file
@@ -631,7 +804,34 @@ def main():
     result_dir = options.output_dir
     n_iter = options.n_iter
     multiple_country = options.multiple_countries
-    run_nativqa(engine, search_type, input_file, gl, location, multiple_country, result_dir, env, n_iter)
+    concurrency = options.concurrency
+    rate_limit = options.rate_limit
+    burst = options.burst
+    max_retries = options.max_retries
+    cache_file = options.cache_file
+    cache_ttl = options.cache_ttl
+    cache_max_size = options.cache_max_size
+    strip_diacritics = options.strip_diacritics
+    dedup_spill = options.dedup_spill
+    max_frontier = options.max_frontier
+    category_quota = options.category_quota
+    pipeline = options.pipeline
+    id_hash = options.id_hash
+    output_format = options.output_format
+    original_response = options.original_response
+    response_archive = options.response_archive
+    otel = options.otel
+    metrics_port = options.metrics_port
+    task_queue = open_task_queue(options.queue) if options.queue is not None else None
+    run_nativqa(engine, search_type, input_file, gl, location, multiple_country, result_dir, env, n_iter,
+                concurrency, rate_limit, burst, max_retries, cache_file, cache_ttl, cache_max_size,
+                strip_diacritics, dedup_spill, max_frontier, category_quota, pipeline, task_queue=task_queue,
+                id_hash=id_hash, output_format=output_format, original_response=original_response, otel=otel,
+                metrics_port=metrics_port, response_archive=response_archive)
+    if task_queue is not None:
+        # lets the workers exit once they are idle
+        task_queue.shutdown()
+        task_queue.close()
 
 if __name__=="__main__":
     main()
@@ -0,0 +1,77 @@
+import logging
+import sqlite3
+import threading
+
+from .utils import normalize_query
+
+
+logger = logging.getLogger(__name__)
+
+
+class CompletedQueryIndex:
+    """Append-only SQLite index of the queries that already have a response."""
+
+    def __init__(self, path, strip_diacritics=False):
+        self.path = path
+        self.strip_diacritics = strip_diacritics
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS completed ('
+                           'id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL UNIQUE, query TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS exported (last_id INTEGER NOT NULL)')
+        if self._conn.execute('SELECT COUNT(*) FROM exported').fetchone()[0] == 0:
+            self._conn.execute('INSERT INTO exported (last_id) VALUES (0)')
+
+    def _key(self, query):
+        return normalize_query(query, self.strip_diacritics)
+
+    def add(self, query):
+        with self._lock:
+            cursor = self._conn.execute('INSERT OR IGNORE INTO completed (key, query) VALUES (?, ?)',
+                                        (self._key(query), query.strip()))
+        return cursor.rowcount == 1
+
+    def add_many(self, queries):
+        with self._lock:
+            self._conn.execute('BEGIN')
+            added = 0
+            for query in queries:
+                if not query.strip():
+                    continue
+                cursor = self._conn.execute('INSERT OR IGNORE INTO completed (key, query) VALUES (?, ?)',
+                                            (self._key(query), query.strip()))
+                added += cursor.rowcount
+            self._conn.execute('COMMIT')
+        return added
+
+    def __contains__(self, query):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM completed WHERE key = ?', (self._key(query),)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM completed').fetchone()[0]
+
+    def export_new(self, filepath):
+        # append the queries added since the last export to a plain text file
+        with self._lock:
+            last_id = self._conn.execute('SELECT last_id FROM exported').fetchone()[0]
+            rows = self._conn.execute('SELECT id, query FROM completed WHERE id > ? ORDER BY id', (last_id,))
+            n_rows = 0
+            with open(filepath, 'a', encoding='utf-8') as f:
+                for last_id, query in rows:
+                    f.write(query + "\n")
+                    n_rows += 1
+            self._conn.execute('UPDATE exported SET last_id = ?', (last_id,))
+        return n_rows
+
+    def mark_exported(self):
+        with self._lock:
+            self._conn.execute('UPDATE exported SET last_id = (SELECT COALESCE(MAX(id), 0) FROM completed)')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,58 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by all request workers."""
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate should be greater than 0')
+        self.rate = float(rate)
+        self.capacity = float(burst if burst else max(1, int(rate)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self):
+        # non-blocking acquire, False when no token is available
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return False
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def pause(self, seconds):
+        # Throttled by the server: hold back every worker, not only the one that got the 429,
+        # and drop the accumulated burst so traffic ramps up again at the configured rate.
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    # exponential backoff with full jitter
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
@@ -0,0 +1,131 @@
+import hashlib
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import unquote_plus
+
+
+ID_HASHES = ('md5', 'blake2b', 'xxhash')
+
+# first `q` parameter of a suggested-search link, as parse_qs(urlparse(link).query)['q'][0] returns it
+QUERY_PARAM = re.compile(r'[?&]q=([^&#]+)')
+
+
+def get_id_hash(name='md5'):
+    # md5 keeps the data ids of earlier runs; blake2b and xxhash give different, equally stable ids
+    if name == 'md5':
+        md5 = hashlib.md5
+        return lambda text: md5(text.encode()).hexdigest()
+    if name == 'blake2b':
+        blake2b = hashlib.blake2b
+        return lambda text: blake2b(text.encode(), digest_size=16).hexdigest()
+    if name == 'xxhash':
+        try:
+            import xxhash
+        except ImportError:
+            raise ImportError('xxhash is required for --id_hash xxhash: pip install xxhash')
+        xxh128 = xxhash.xxh3_128_hexdigest
+        return lambda text: xxh128(text.encode())
+    raise ValueError(f'Unknown id hash: {name}, supported hashes are {", ".join(ID_HASHES)}')
+
+
+def link_query(link):
+    match = QUERY_PARAM.search(link)
+    if match is None:
+        raise KeyError('q')
+    return unquote_plus(match.group(1))
+
+
+class ResponseRecord(NamedTuple):
+    response: dict
+
+
+class QARecord(NamedTuple):
+    data_id: Optional[str]
+    category: str
+    input_query: str
+    question: str
+    answer: str
+    question_type: str
+    answer_urls: str
+
+
+class SearchRecord(NamedTuple):
+    kind: str
+    category: str
+    input_query: str
+    query: Optional[str]
+    entry: dict
+
+
+class MediaRecord(NamedTuple):
+    kind: str
+    data_id: str
+    category: str
+    input_query: str
+    entry: dict
+
+
+MEDIA_RESULTS = {'image': ('images_results', 'original'), 'video': ('video_results', 'link')}
+
+
+def normalize_response(response, search_type, category, id_hash=None):
+    # annotates a raw SerpAPI response in place (data ids, categories, suggested queries) in one pass
+    id_hash = id_hash or get_id_hash()
+    response['search_parameters']['category'] = category
+    if search_type == 'text':
+        query = response['search_parameters']['q']
+        for key in ('related_questions', 'questions_and_answers'):
+            for entry in response.get(key, ()):
+                entry['data_id'] = id_hash(query + " " + entry['question'])
+        return response
+    for entry in response.get('suggested_searches', ()):
+        entry['data_id'] = id_hash(entry['link'])
+        entry['query'] = link_query(entry['link'])
+        entry['category'] = category
+    for entry in response.get('related_searches', ()):
+        entry['data_id'] = id_hash(entry['link'])
+        entry['category'] = category
+    key, id_field = MEDIA_RESULTS[search_type]
+    for entry in response.get(key, ()):
+        entry['data_id'] = id_hash(entry[id_field])
+        entry['category'] = category
+    return response
+
+
+def qa_answer(entry):
+    if 'snippet' in entry:
+        return entry['snippet']
+    if 'list' in entry:
+        return "\n".join(entry['list'])
+    return ''
+
+
+def iter_records(response, search_type):
+    # typed records of a normalized response, shared by the output writers and query expansion
+    yield ResponseRecord(response)
+    category = response['search_parameters']['category']
+    query = response['search_parameters']['q']
+    if search_type == 'text':
+        for entry in response.get('related_searches', ()):
+            if 'query' in entry:
+                yield SearchRecord('related_searches', category, query, entry['query'], entry)
+        if 'related_questions' not in response and 'questions_and_answers' not in response:
+            yield QARecord(None, category, query, 'Not Available', 'NA', 'NA', 'NA')
+        for entry in response.get('related_questions', ()):
+            if 'link' in entry:
+                yield QARecord(entry['data_id'], category, query, entry['question'], qa_answer(entry),
+                               'related_questions', entry['link'])
+        for entry in response.get('questions_and_answers', ()):
+            if 'answer' in entry:
+                yield QARecord(entry['data_id'], category, query, entry['question'], entry['answer'],
+                               'questions_and_answers', entry.get('link', 'NA'))
+        return
+    for kind in ('related_searches', 'suggested_searches'):
+        for entry in response.get(kind, ()):
+            entry['input_query'] = query
+            yield SearchRecord(kind, category, query, entry.get('query'), entry)
+    key, _ = MEDIA_RESULTS[search_type]
+    for entry in response.get(key, ()):
+        entry['category'] = category
+        entry['input_query'] = query
+        yield MediaRecord(key, entry['data_id'], category, query, entry)
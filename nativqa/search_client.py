@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import SearchError, open_backend
+from .rate_limit import backoff_delay
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_retryable(error):
+    if isinstance(error, SearchError):
+        return error.retryable
+    import requests
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class SearchClient:
+    """Runs search requests on a bounded, shared thread pool."""
+
+    def __init__(self, concurrency=1, rate_limiter=None, max_retries=3, base_delay=1.0, max_delay=60.0,
+                 cache=None, executor=None, base_url=None, backend=None, metrics=None):
+        if concurrency < 1:
+            raise ValueError('concurrency should be at least 1')
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cache = cache
+        # a backend passed in is shared with other clients and is not closed by close(); base_url points the
+        # default SerpAPI backend at another SerpAPI-compatible endpoint, e.g. nativqa.fake_serpapi
+        self._owns_backend = backend is None
+        if backend is None:
+            backend = open_backend(base_url)
+        self.backend = backend
+        self.retries = 0
+        self.responses = 0
+        self.errors = 0
+        # optional nativqa.metrics.Metrics for request latency, cache hits, retries and rate limit waits
+        self.metrics = metrics
+        # an executor passed in is shared with other clients and is not shut down by close()
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                    thread_name_prefix='nativqa-search')
+            return self._executor
+
+    def _request(self, search_params):
+        return self.backend.search(search_params)
+
+    def _timed_request(self, search_params):
+        if self.metrics is None:
+            return self._request(search_params)
+        started = time.perf_counter()
+        try:
+            return self._request(search_params)
+        finally:
+            self.metrics.incr('requests')
+            self.metrics.observe_latency(time.perf_counter() - started)
+
+    def fetch(self, search_params):
+        try:
+            response = self._fetch(search_params)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            if self.metrics is not None:
+                self.metrics.incr('errors')
+            raise
+        with self._lock:
+            self.responses += 1
+        if self.metrics is not None:
+            self.metrics.incr('responses')
+        return response
+
+    def _fetch(self, search_params):
+        metrics = self.metrics
+        if self.cache is not None:
+            response = self.cache.get(search_params)
+            if metrics is not None:
+                metrics.incr('cache_hits' if response is not None else 'cache_misses')
+            if response is not None:
+                return response
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                started = time.perf_counter()
+                self.rate_limiter.acquire()
+                if metrics is not None:
+                    metrics.incr('rate_limit_wait_seconds', time.perf_counter() - started)
+            try:
+                response = self._timed_request(search_params)
+                if self.cache is not None:
+                    self.cache.put(search_params, response)
+                return response
+            except Exception as e:
+                if isinstance(e, SearchError) and e.throttled and metrics is not None:
+                    metrics.incr('throttled')
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+                if isinstance(e, SearchError) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                if isinstance(e, SearchError) and e.throttled and self.rate_limiter is not None:
+                    self.rate_limiter.pause(delay)
+                attempt += 1
+                with self._lock:
+                    self.retries += 1
+                if metrics is not None:
+                    metrics.incr('retries')
+                logger.warning(f"Retrying '{search_params.get('q')}' in {delay:.2f}s "
+                               f"(attempt {attempt}/{self.max_retries}): {e}")
+                time.sleep(delay)
+
+    def submit(self, search_params, query):
+        params = dict(search_params)
+        params['q'] = query.strip()
+        return self.executor.submit(self.fetch, params)
+
+    def iter_responses(self, search_params, data):
+        # Responses are yielded in input order so that summary.jsonl/failed.jsonl
+        # always cover a prefix of `data`; at most `concurrency * 4` requests are in flight.
+        window = self.concurrency * 4
+        pending = deque()
+        for example in data:
+            pending.append((example, self.submit(search_params, example[1])))
+            if len(pending) >= window:
+                yield self.collect(*pending.popleft())
+        while pending:
+            yield self.collect(*pending.popleft())
+
+    @staticmethod
+    def collect(example, future):
+        # (example, response, None) or (example, None, error) for a future returned by submit()
+        try:
+            return example, future.result(), None
+        except Exception as e:
+            return example, None, e
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None and self._owns_executor:
+                self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._owns_backend:
+            self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,363 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# A task is a dict with 'id', 'group' (run and iteration), 'category', 'query', 'search_type' and the
+# search 'params' without the API key. Workers claim tasks under a lease; a task whose lease expires
+# is delivered again, and fails once it has been claimed `max_attempts` times. Finished tasks are
+# handed to the coordinator once through drain().
+
+
+def encode_result(result):
+    return zlib.compress(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+
+def decode_result(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8')) if blob is not None else None
+
+
+class MemoryTaskQueue:
+    """In-process task queue, a stand-in for the shared backends in tests and single-host runs."""
+
+    def __init__(self, max_attempts=3):
+        self.max_attempts = max_attempts
+        self.closed_at = None
+        self._tasks = {}
+        self._pending = OrderedDict()
+        self._leased = {}
+        self._finished = {}
+        self._lock = threading.Lock()
+
+    def put(self, tasks):
+        added = 0
+        with self._lock:
+            self.closed_at = None
+            for task in tasks:
+                entry = self._tasks.get(task['id'])
+                if entry is None:
+                    entry = self._tasks[task['id']] = {'task': task, 'state': PENDING, 'attempts': 0,
+                                                       'result': None, 'error': None}
+                    self._pending[task['id']] = None
+                    added += 1
+                elif entry['state'] == DONE:
+                    self._finished.setdefault(task['group'], OrderedDict())[task['id']] = None
+                elif entry['state'] == FAILED:
+                    entry.update(state=PENDING, attempts=0, error=None)
+                    self._pending[task['id']] = None
+        return added
+
+    def _expire_leases(self, now):
+        for task_id in [task_id for task_id, lease_until in self._leased.items() if lease_until < now]:
+            del self._leased[task_id]
+            self._release(task_id, self._tasks[task_id])
+
+    def _release(self, task_id, entry):
+        if entry['attempts'] >= self.max_attempts:
+            self._finish(task_id, entry, FAILED, error=f"lease expired {entry['attempts']} times")
+        else:
+            entry['state'] = PENDING
+            self._pending[task_id] = None
+
+    def _finish(self, task_id, entry, state, result=None, error=None):
+        entry.update(state=state, result=result, error=error)
+        self._finished.setdefault(entry['task']['group'], OrderedDict())[task_id] = None
+
+    def claim(self, worker, n, lease_seconds=300):
+        now = time.time()
+        claimed = []
+        with self._lock:
+            self._expire_leases(now)
+            while self._pending and len(claimed) < n:
+                task_id, _ = self._pending.popitem(last=False)
+                entry = self._tasks[task_id]
+                entry.update(state=LEASED, worker=worker)
+                entry['attempts'] += 1
+                self._leased[task_id] = now + lease_seconds
+                claimed.append(dict(entry['task'], attempts=entry['attempts']))
+        return claimed
+
+    def complete(self, task_id, result):
+        with self._lock:
+            entry = self._tasks[task_id]
+            if entry['state'] != DONE:
+                self._pending.pop(task_id, None)
+                self._leased.pop(task_id, None)
+                self._finish(task_id, entry, DONE, result=result)
+
+    def fail(self, task_id, error):
+        with self._lock:
+            entry = self._tasks[task_id]
+            if entry['state'] == LEASED:
+                self._leased.pop(task_id, None)
+                self._finish(task_id, entry, FAILED, error=error)
+
+    def drain(self, group, limit=1000):
+        finished = []
+        with self._lock:
+            ids = self._finished.get(group, OrderedDict())
+            while ids and len(finished) < limit:
+                task_id, _ = ids.popitem(last=False)
+                entry = self._tasks[task_id]
+                finished.append(dict(entry['task'], state=entry['state'], result=entry['result'],
+                                     error=entry['error']))
+        return finished
+
+    def counts(self):
+        counts = {}
+        with self._lock:
+            for entry in self._tasks.values():
+                counts[entry['state']] = counts.get(entry['state'], 0) + 1
+        return counts
+
+    def shutdown(self):
+        self.closed_at = time.time()
+
+    def close(self):
+        pass
+
+
+class SQLiteTaskQueue:
+    """Task queue in a SQLite file, shared between hosts through file locking on a common filesystem."""
+
+    def __init__(self, path, max_attempts=3, timeout=60.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        # rollback journal rather than WAL, WAL needs shared memory that network filesystems do not provide
+        self._conn.execute('PRAGMA journal_mode=DELETE')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                           'id TEXT PRIMARY KEY, grp TEXT NOT NULL, seq INTEGER NOT NULL, task TEXT NOT NULL, '
+                           'state TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL, '
+                           'result BLOB, error TEXT, collected INTEGER NOT NULL)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, seq)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (grp, collected, state)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+
+    def _transaction(self, fn, *args):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                value = fn(*args)
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+        return value
+
+    @property
+    def closed_at(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'closed_at'").fetchone()
+        return float(row[0]) if row is not None else None
+
+    def _set_closed_at(self, value):
+        if value is None:
+            self._conn.execute("DELETE FROM meta WHERE key = 'closed_at'")
+        else:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('closed_at', ?)", (str(value),))
+
+    def put(self, tasks):
+        def put():
+            self._set_closed_at(None)
+            seq = self._conn.execute('SELECT COALESCE(MAX(seq), 0) FROM tasks').fetchone()[0]
+            added = 0
+            for task in tasks:
+                seq += 1
+                cursor = self._conn.execute(
+                    'INSERT OR IGNORE INTO tasks (id, grp, seq, task, state, attempts, collected) '
+                    'VALUES (?, ?, ?, ?, ?, 0, 0)',
+                    (task['id'], task['group'], seq, json.dumps(task, ensure_ascii=False), PENDING))
+                if cursor.rowcount == 1:
+                    added += 1
+                    continue
+                self._conn.execute('UPDATE tasks SET collected = 0 WHERE id = ? AND state = ?', (task['id'], DONE))
+                self._conn.execute('UPDATE tasks SET state = ?, attempts = 0, error = NULL, seq = ? '
+                                   'WHERE id = ? AND state = ?', (PENDING, seq, task['id'], FAILED))
+            return added
+        return self._transaction(put)
+
+    def claim(self, worker, n, lease_seconds=300):
+        def claim():
+            now = time.time()
+            self._conn.execute('UPDATE tasks SET state = ?, error = ?, collected = 0 '
+                               'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                               (FAILED, 'lease expired', LEASED, now, self.max_attempts))
+            self._conn.execute('UPDATE tasks SET state = ? WHERE state = ? AND lease_until < ?',
+                               (PENDING, LEASED, now))
+            rows = self._conn.execute('SELECT id, task, attempts FROM tasks WHERE state = ? ORDER BY seq LIMIT ?',
+                                      (PENDING, n)).fetchall()
+            self._conn.executemany('UPDATE tasks SET state = ?, worker = ?, lease_until = ?, '
+                                   'attempts = attempts + 1 WHERE id = ?',
+                                   [(LEASED, worker, now + lease_seconds, task_id) for task_id, _, _ in rows])
+            return [dict(json.loads(task), attempts=attempts + 1) for _, task, attempts in rows]
+        return self._transaction(claim)
+
+    def complete(self, task_id, result):
+        with self._lock:
+            self._conn.execute('UPDATE tasks SET state = ?, result = ?, error = NULL, collected = 0 '
+                               'WHERE id = ? AND state != ?', (DONE, encode_result(result), task_id, DONE))
+
+    def fail(self, task_id, error):
+        with self._lock:
+            self._conn.execute('UPDATE tasks SET state = ?, error = ?, collected = 0 WHERE id = ? AND state = ?',
+                               (FAILED, error, task_id, LEASED))
+
+    def drain(self, group, limit=1000):
+        def drain():
+            rows = self._conn.execute('SELECT id, task, state, result, error FROM tasks '
+                                      'WHERE grp = ? AND collected = 0 AND state IN (?, ?) LIMIT ?',
+                                      (group, DONE, FAILED, limit)).fetchall()
+            self._conn.executemany('UPDATE tasks SET collected = 1 WHERE id = ?', [(row[0],) for row in rows])
+            return [dict(json.loads(task), state=state, result=decode_result(result), error=error)
+                    for _, task, state, result, error in rows]
+        return self._transaction(drain)
+
+    def counts(self):
+        with self._lock:
+            return dict(self._conn.execute('SELECT state, COUNT(*) FROM tasks GROUP BY state').fetchall())
+
+    def shutdown(self):
+        self._transaction(self._set_closed_at, time.time())
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisTaskQueue:
+    """Task queue on a Redis-compatible server, keys are namespaced by `prefix`."""
+
+    def __init__(self, client, prefix='nativqa', max_attempts=3):
+        self.client = client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + tuple(str(part) for part in parts))
+
+    @property
+    def closed_at(self):
+        value = self.client.get(self._key('closed_at'))
+        return float(value) if value is not None else None
+
+    def put(self, tasks):
+        self.client.delete(self._key('closed_at'))
+        added = 0
+        for task in tasks:
+            task_key = self._key('task', task['id'])
+            if self.client.hsetnx(task_key, 'task', json.dumps(task, ensure_ascii=False)):
+                self.client.hset(task_key, mapping={'state': PENDING, 'attempts': 0})
+                self.client.zadd(self._key('pending'), {task['id']: self.client.incr(self._key('seq'))})
+                added += 1
+                continue
+            state = self._state(task['id'])
+            if state == DONE:
+                self.client.rpush(self._key('finished', task['group']), task['id'])
+            elif state == FAILED:
+                self.client.hset(task_key, mapping={'state': PENDING, 'attempts': 0, 'error': ''})
+                self.client.srem(self._key('completed'), task['id'])
+                self.client.zadd(self._key('pending'), {task['id']: self.client.incr(self._key('seq'))})
+        return added
+
+    def _state(self, task_id):
+        state = self.client.hget(self._key('task', task_id), 'state')
+        return state.decode('utf-8') if isinstance(state, bytes) else state
+
+    def _finish(self, task_id, state, **fields):
+        # the completed set lets exactly one of several late results finish a task
+        if not self.client.sadd(self._key('completed'), task_id):
+            return
+        task = json.loads(self.client.hget(self._key('task', task_id), 'task'))
+        self.client.hset(self._key('task', task_id), mapping=dict(fields, state=state))
+        self.client.rpush(self._key('finished', task['group']), task_id)
+
+    def claim(self, worker, n, lease_seconds=300):
+        now = time.time()
+        for task_id in self.client.zrangebyscore(self._key('leased'), '-inf', now):
+            # only the client that removes an expired lease re-delivers the task
+            if self.client.zrem(self._key('leased'), task_id):
+                task_id = task_id.decode('utf-8') if isinstance(task_id, bytes) else task_id
+                if int(self.client.hget(self._key('task', task_id), 'attempts')) >= self.max_attempts:
+                    self._finish(task_id, FAILED, error='lease expired')
+                else:
+                    self.client.hset(self._key('task', task_id), 'state', PENDING)
+                    self.client.zadd(self._key('pending'), {task_id: self.client.incr(self._key('seq'))})
+        claimed = []
+        for task_id, _ in self.client.zpopmin(self._key('pending'), n):
+            task_id = task_id.decode('utf-8') if isinstance(task_id, bytes) else task_id
+            task_key = self._key('task', task_id)
+            self.client.zadd(self._key('leased'), {task_id: now + lease_seconds})
+            self.client.hset(task_key, mapping={'state': LEASED, 'worker': worker})
+            attempts = self.client.hincrby(task_key, 'attempts', 1)
+            claimed.append(dict(json.loads(self.client.hget(task_key, 'task')), attempts=attempts))
+        return claimed
+
+    def complete(self, task_id, result):
+        self.client.zrem(self._key('leased'), task_id)
+        self._finish(task_id, DONE, result=encode_result(result), error='')
+
+    def fail(self, task_id, error):
+        if self._state(task_id) == LEASED:
+            self.client.zrem(self._key('leased'), task_id)
+            self._finish(task_id, FAILED, error=error)
+
+    def drain(self, group, limit=1000):
+        finished = []
+        for _ in range(limit):
+            task_id = self.client.lpop(self._key('finished', group))
+            if task_id is None:
+                break
+            task_id = task_id.decode('utf-8') if isinstance(task_id, bytes) else task_id
+            entry = self.client.hgetall(self._key('task', task_id))
+            entry = {(key.decode('utf-8') if isinstance(key, bytes) else key): value for key, value in entry.items()}
+            state = entry['state'].decode('utf-8') if isinstance(entry['state'], bytes) else entry['state']
+            error = entry.get('error') or None
+            finished.append(dict(json.loads(entry['task']), state=state,
+                                 result=decode_result(entry.get('result')) if state == DONE else None,
+                                 error=error.decode('utf-8') if isinstance(error, bytes) else error))
+        return finished
+
+    def counts(self):
+        n_pending = self.client.zcard(self._key('pending'))
+        n_leased = self.client.zcard(self._key('leased'))
+        return {PENDING: n_pending, LEASED: n_leased, 'finished': self.client.scard(self._key('completed'))}
+
+    def shutdown(self):
+        self.client.set(self._key('closed_at'), time.time())
+
+    def close(self):
+        self.client.close()
+
+
+def open_task_queue(url, max_attempts=3):
+    # sqlite:///path/to/queue.sqlite, redis://host:port/db?prefix=name or memory://
+    parsed = urlparse(url)
+    if parsed.scheme == 'memory':
+        return MemoryTaskQueue(max_attempts)
+    if parsed.scheme in ('redis', 'rediss'):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('redis is required for a Redis task queue: pip install redis')
+        prefix = dict(part.split('=', 1) for part in parsed.query.split('&') if '=' in part).get('prefix', 'nativqa')
+        client = redis.Redis.from_url(url.split('?', 1)[0])
+        return RedisTaskQueue(client, prefix, max_attempts)
+    if parsed.scheme in ('sqlite', ''):
+        path = url[len('sqlite:///'):] if parsed.scheme == 'sqlite' else url
+        return SQLiteTaskQueue(path, max_attempts)
+    raise ValueError(f'Unsupported task queue: {url}')
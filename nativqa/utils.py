@@ -1,16 +1,42 @@
 import os
+import re
 import csv
 import json
 import logging
+import unicodedata
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format='%(asctime)s %(module)s %(filename)s:%(lineno)s - %(message)s',
-                    encoding='utf-8', level=logging.DEBUG)
 
-def read_seed_queries(fpath):
+LOG_FORMAT = '%(asctime)s %(module)s %(filename)s:%(lineno)s - %(message)s'
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+# Arabic harakat, superscript alef and Quranic annotation marks, plus tatweel (U+0640)
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06dc\u06df-\u06e8\u06ea-\u06ed\u0640]')
+
+
+def add_log_option(parser):
+    parser.add_option('--log_level', '--log-level', action='store', dest='log_level', default='INFO',
+                      type="choice", choices=[*LOG_LEVELS, *(level.lower() for level in LOG_LEVELS)],
+                      help='Logging level: DEBUG, INFO (default), WARNING or ERROR')
+
+
+def configure_logging(level='INFO'):
+    # only the command-line entry points configure logging, importing the package leaves it to the caller
+    logging.basicConfig(format=LOG_FORMAT, encoding='utf-8', level=level.upper())
+    logging.getLogger('urllib3').setLevel(logging.CRITICAL)
+
+
+def normalize_query(query, strip_diacritics=False):
+    query = unicodedata.normalize('NFC', query)
+    if strip_diacritics:
+        query = ARABIC_DIACRITICS.sub('', query)
+    return ' '.join(query.split())
+
+
+def read_seed_queries(fpath, strip_diacritics=False):
     delim = ',' if fpath.endswith('.csv') else '\t'
     data = []
-    unique = []
+    unique = set()
     with open(fpath, 'r', encoding='utf-8') as f:
         reader = csv.reader(f, delimiter=delim)
         next(reader)
@@ -19,8 +45,9 @@ def read_seed_queries(fpath):
             # if topic not in data:
             #     data[topic] = []
             # data[topic].append(query)
-            if row[1].strip() not in unique:
-                unique.append(row[1].strip())
+            key = normalize_query(row[1], strip_diacritics)
+            if key not in unique:
+                unique.add(key)
                 data.append([row[0].strip(), row[1].strip()])
     logger.info(f"Number of queries to be searched: {len(data)}")
     return data
@@ -42,39 +69,79 @@ def ensure_directory(path):
 #         os.makedirs(dir_path, exist_ok=True)
 #         logging.info(f'Directry created at {dir_path}')
 
-def read_failed_data(filepath):
-    q_texts = []
+def iter_jsonl(filepath):
     with open(filepath, encoding='utf-8') as f:
-        lines = f.read().strip().split("\n")
-    if len(lines) == 1 and lines[0] == '':
-        return q_texts
-    else:
-        for line in lines:
-            dict_obj = json.loads(line)
-            q_texts.append([dict_obj['category'], dict_obj['query']])
-        return q_texts
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # a run killed mid-write leaves a truncated last line behind
+                logger.warning(f'Skipping malformed line in {filepath}')
+
+def iter_failed_data(filepath):
+    for dict_obj in iter_jsonl(filepath):
+        yield [dict_obj['category'], dict_obj['query']]
+
+def read_failed_data(filepath):
+    return list(iter_failed_data(filepath))
+
+def iter_summary_data(filepath):
+    return iter_jsonl(filepath)
 
 def read_summary_data(filepath):
-    data = []
-    with open(filepath) as f:
-        lines = f.read().strip().split("\n")
-    # print(lines)
-    if len(lines) == 1 and lines[0] == '':
-        return data
-    else:
-        for line in lines:
-            data.append(json.loads(line))
-        return data
+    return list(iter_summary_data(filepath))
 
-def read_completed_data(filepath):
+def open_jsonl_append(filepath, max_size=None):
+    # drop an incomplete trailing line so that appended records start on a fresh line,
+    # and anything past max_size (bytes not covered by a checkpoint)
+    if os.path.exists(filepath):
+        with open(filepath, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if max_size is not None and size > max_size:
+                logger.warning(f'Dropping {size - max_size} uncommitted bytes from {filepath}')
+                f.truncate(max_size)
+                size = max_size
+            if size > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    pos = size - 1
+                    while pos > 0:
+                        step = min(65536, pos)
+                        f.seek(pos - step)
+                        chunk = f.read(step)
+                        idx = chunk.rfind(b'\n')
+                        if idx != -1:
+                            pos = pos - step + idx + 1
+                            break
+                        pos -= step
+                    logger.warning(f'Truncating incomplete last line of {filepath}')
+                    f.truncate(pos)
+    return open(filepath, 'a', encoding='utf-8')
+
+def iter_completed_data(filepath):
     delim = ',' if filepath.endswith('.csv') else '\t'
-    data = []
-    with open(filepath) as f:
+    with open(filepath, encoding='utf-8') as f:
         reader = csv.reader(f, delimiter=delim)
-        next(reader)
+        next(reader, None)
         for row in reader:
-            data.append(row)
-    return data
+            yield row
+
+def read_completed_data(filepath):
+    return list(iter_completed_data(filepath))
+
+def find_files(root_dir, suffix):
+    # paths under root_dir ending with suffix, iteration_2 sorted before iteration_10
+    def natural_key(path):
+        return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+    paths = []
+    for root, dirs, files in os.walk(root_dir):
+        for file in files:
+            if file.endswith(suffix):
+                paths.append(os.path.join(root, file))
+    return sorted(paths, key=natural_key)
 
 def read_txt_data(filepath):
     queries = open(filepath, 'r', encoding='utf-8').read().strip().split("\n")
@@ -85,6 +152,31 @@ def read_json_data(fpath):
         data = json.load(f)
     return data
 
+class JsonArrayWriter:
+    """Writes a JSON list one element at a time, producing the same text as json.dump(list)."""
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.count = 0
+        self._f = open(filepath, 'w', encoding='utf-8')
+        self._f.write('[')
+
+    def write(self, obj):
+        if self.count:
+            self._f.write(', ')
+        json.dump(obj, self._f, ensure_ascii=False)
+        self.count += 1
+
+    def close(self):
+        self._f.write(']')
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 def write_init_summary(filewriter, data):
     for line in data:
         filewriter.write(f"{json.dumps(line, ensure_ascii=False)}\n")
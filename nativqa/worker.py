@@ -0,0 +1,115 @@
+import logging
+import optparse
+import os
+import socket
+import sys
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from .cache import ResponseCache
+from .rate_limit import TokenBucket
+from .records import get_id_hash, normalize_response
+from .search_client import SearchClient
+from .task_queue import open_task_queue
+from .utils import add_log_option, configure_logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(task_queue, client, worker_id=None, batch_size=None, lease_seconds=300, poll_interval=1.0,
+               idle_timeout=None):
+    # claims tasks until the coordinator shuts the queue down (or nothing arrives for `idle_timeout` seconds)
+    if worker_id is None:
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    if batch_size is None:
+        batch_size = client.concurrency * 2
+    api_key = os.getenv('API_KEY')
+    id_hashes = {}
+    in_flight = {}
+    n_done = n_failed = 0
+    started = time.time()
+    idle_since = time.monotonic()
+    while True:
+        if len(in_flight) < batch_size:
+            for task in task_queue.claim(worker_id, batch_size - len(in_flight), lease_seconds):
+                params = dict(task['params'], api_key=api_key)
+                in_flight[client.submit(params, task['query'])] = task
+        if not in_flight:
+            closed_at = task_queue.closed_at
+            # a shutdown left over from an earlier run does not stop a worker that starts before the coordinator
+            if closed_at is not None and closed_at >= started:
+                break
+            if idle_timeout is not None and time.monotonic() - idle_since > idle_timeout:
+                logger.info(f'No task for {idle_timeout}s, stopping')
+                break
+            time.sleep(poll_interval)
+            continue
+        idle_since = time.monotonic()
+        finished, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+        for future in finished:
+            task = in_flight.pop(future)
+            try:
+                id_hash_name = task.get('id_hash', 'md5')
+                if id_hash_name not in id_hashes:
+                    id_hashes[id_hash_name] = get_id_hash(id_hash_name)
+                response = normalize_response(future.result(), task['search_type'], task['category'],
+                                              id_hashes[id_hash_name])
+                task_queue.complete(task['id'], response)
+                n_done += 1
+            except Exception as e:
+                logger.error(f"{task['query']}: {e}")
+                task_queue.fail(task['id'], str(e))
+                n_failed += 1
+    logger.info(f'Worker {worker_id} finished: {n_done} done, {n_failed} failed')
+    return n_done, n_failed
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-q', '--queue', action='store', dest='queue', default=None, type="string",
+                      help='Task queue shared with the coordinator (sqlite:///path or redis://host:port/db)')
+    parser.add_option('-e', '--env', action='store', dest='env', default=None, type="string",
+                      help='API key file')
+    parser.add_option('--worker_id', action='store', dest='worker_id', default=None, type="string",
+                      help='Name of this worker (default: host:pid)')
+    parser.add_option('--lease', action='store', dest='lease', default=300.0, type="float",
+                      help='Seconds after which a claimed task that is not finished is delivered again')
+    parser.add_option('--idle_timeout', action='store', dest='idle_timeout', default=None, type="float",
+                      help='Stop after this many seconds without tasks (default: wait for the coordinator)')
+    parser.add_option('--concurrency', action='store', dest='concurrency', default=1, type="int",
+                      help='Number of concurrent API requests')
+    parser.add_option('--rate_limit', action='store', dest='rate_limit', default=None, type="float",
+                      help='Maximum API requests per second for this worker (default: unlimited)')
+    parser.add_option('--burst', action='store', dest='burst', default=None, type="int",
+                      help='Number of requests allowed in a burst above the rate limit')
+    parser.add_option('--max_retries', action='store', dest='max_retries', default=3, type="int",
+                      help='Number of retries on HTTP 429/5xx before a task is marked as failed')
+    parser.add_option('--cache', action='store', dest='cache_file', default=None, type="string",
+                      help='SQLite file used to cache API responses across runs')
+    add_log_option(parser)
+
+    options, args = parser.parse_args()
+    configure_logging(options.log_level)
+    if options.queue is None or options.env is None:
+        logger.error('task queue and API key file are required!')
+        sys.exit(1)
+    from dotenv import load_dotenv
+    load_dotenv(options.env)
+    if os.getenv('API_KEY') is None and os.getenv('API_KEYS') is None:
+        logger.error('API_KEY or API_KEYS not found in the system environment!')
+        sys.exit(1)
+    task_queue = open_task_queue(options.queue)
+    rate_limiter = TokenBucket(options.rate_limit, options.burst) if options.rate_limit is not None else None
+    cache = ResponseCache(options.cache_file) if options.cache_file is not None else None
+    with SearchClient(options.concurrency, rate_limiter=rate_limiter, max_retries=options.max_retries,
+                      cache=cache) as client:
+        run_worker(task_queue, client, options.worker_id, lease_seconds=options.lease,
+                   idle_timeout=options.idle_timeout)
+    task_queue.close()
+    if cache is not None:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import json
+import optparse
+import os
+import time
+
+import numpy as np
+
+from filter_near_duplicates_flann import INDEXES, EmbeddingStore, ExactIndex, l2_normalize
+
+
+# recall vs. time of the near-duplicate index backends, measured against exact search on a sample of queries:
+#   python scripts/benchmark_ann.py --store_dir results/embedding_store --indexes exact,hnsw,ivfpq
+#   python scripts/benchmark_ann.py --n_points 1000000 --dim 512 --indexes hnsw,ivfpq
+
+
+def synthetic_features(n_points, dim, duplicate_rate=0.3, noise=0.05, seed=0):
+    # non-negative "embeddings" (like pooled ResNet features) plus noisy copies of some of them
+    rng = np.random.default_rng(seed)
+    n_copies = int(n_points * duplicate_rate)
+    originals = np.abs(rng.standard_normal((n_points - n_copies, dim), dtype=np.float32))
+    copies = originals[rng.integers(0, len(originals), n_copies)]
+    copies += noise * rng.standard_normal(copies.shape, dtype=np.float32)
+    features = np.vstack([originals, copies])
+    return features[rng.permutation(n_points)].astype(np.float16)
+
+
+def load_store(store_dir):
+    with open(os.path.join(store_dir, 'meta.json'), encoding='utf-8') as f:
+        meta = json.load(f)
+    return EmbeddingStore(store_dir, meta['dim'], meta['model']).matrix()
+
+
+def recall(found, truth):
+    # fraction of the true neighbors that were found, over all queries
+    n_found = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    n_truth = sum(len(t) for t in truth)
+    return round(n_found / n_truth, 4) if n_truth else None
+
+
+def within(indices, dists, threshold):
+    return [row_i[(row_d <= threshold) & (row_i >= 0)].tolist() for row_i, row_d in zip(indices, dists)]
+
+
+def run_index(name, features, queries, k, threshold, truth_knn, truth_radius, threads, metric):
+    index = INDEXES[name](threads=threads)
+    started = time.perf_counter()
+    index.build(features)
+    build_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    indices, dists = index.search(queries, k)
+    search_seconds = time.perf_counter() - started
+    if metric == 'cosine':
+        dists = dists / 2
+    return {'index': name, 'build_seconds': round(build_seconds, 3),
+            'queries_per_second': round(len(queries) / search_seconds, 1),
+            # time to search every point, as compute_duplicates does
+            'estimated_seconds': round(build_seconds + search_seconds * len(features) / len(queries), 1),
+            'recall_at_k': recall(indices.tolist(), truth_knn),
+            'radius_recall': recall(within(indices, dists, threshold), truth_radius)}
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('-s', '--store_dir', action='store', dest='store_dir', default=None, type="string",
+                      help='embedding store to benchmark on (default: synthetic features)')
+    parser.add_option('--n_points', action='store', dest='n_points', default=100000, type="int",
+                      help='number of synthetic features')
+    parser.add_option('--dim', action='store', dest='dim', default=512, type="int",
+                      help='dimension of the synthetic features')
+    parser.add_option('--indexes', action='store', dest='indexes', default='exact,hnsw,ivfpq', type="string",
+                      help=f'comma separated index backends out of {", ".join(INDEXES)}')
+    parser.add_option('-q', '--n_queries', action='store', dest='n_queries', default=1000, type="int",
+                      help='number of sampled queries for which the exact neighbors are computed')
+    parser.add_option('-k', '--max_neighbors', action='store', dest='max_neighbors', default=32, type="int",
+                      help='neighbors per query')
+    parser.add_option('-t', '--threshold', action='store', dest='threshold', default=1.5, type="float",
+                      help='duplicate threshold, as in filter_near_duplicates_flann.py')
+    parser.add_option('--metric', action='store', dest='metric', default='l2', type="choice",
+                      choices=['l2', 'cosine'], help='distance the threshold applies to')
+    parser.add_option('--threads', action='store', dest='threads', default=0, type="int",
+                      help='search threads, 0 for all cores')
+    parser.add_option('-o', '--output_file', action='store', dest='output_file', default=None, type="string",
+                      help='write the results as JSON to this file')
+
+    options, args = parser.parse_args()
+    if options.store_dir is not None:
+        features = load_store(options.store_dir)
+    else:
+        features = synthetic_features(options.n_points, options.dim)
+    if options.metric == 'cosine':
+        features = l2_normalize(features)
+    rng = np.random.default_rng(0)
+    sample = np.sort(rng.choice(len(features), min(options.n_queries, len(features)), replace=False))
+    queries = np.asarray(features[sample], dtype=np.float32)
+    k = min(options.max_neighbors, len(features))
+    print(f'{len(features)} features of dimension {features.shape[1]}, {len(queries)} queries, k={k}', flush=True)
+
+    exact = ExactIndex()
+    exact.build(features)
+    truth_i, truth_d = exact.search(queries, k)
+    if options.metric == 'cosine':
+        truth_d = truth_d / 2
+    truth_knn = truth_i.tolist()
+    truth_radius = within(truth_i, truth_d, options.threshold)
+
+    results = []
+    for name in options.indexes.split(','):
+        try:
+            result = run_index(name, features, queries, k, options.threshold, truth_knn, truth_radius,
+                               options.threads, options.metric)
+        except ImportError as e:
+            print(f'{name:>8}  skipped: {e}', flush=True)
+            continue
+        results.append(result)
+        print(f"{name:>8}  build {result['build_seconds']:>9.2f}s  {result['queries_per_second']:>10.1f} q/s  "
+              f"all points ~{result['estimated_seconds']:>9.1f}s  recall@{k} {result['recall_at_k']}  "
+              f"radius recall {result['radius_recall']}", flush=True)
+    if options.output_file is not None:
+        with open(options.output_file, 'w') as f:
+            json.dump({'options': vars(options), 'n_points': len(features), 'dim': int(features.shape[1]),
+                       'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
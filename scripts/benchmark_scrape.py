@@ -0,0 +1,136 @@
+import json
+import optparse
+import os
+import resource
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+from nativqa.nativqa_framework import run_nativqa
+
+
+# end-to-end benchmark of run_nativqa against nativqa.fake_serpapi, one fresh process per size:
+#   python scripts/benchmark_scrape.py --sizes 1000,10000,100000 --concurrency 32 --latency 0.05
+
+
+def write_seed_file(filepath, n_queries, n_categories=20):
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write('topic,query\n')
+        for i in range(n_queries):
+            f.write(f'category {i % n_categories},benchmark query {i}\n')
+
+
+def start_server(options):
+    command = [sys.executable, '-m', 'nativqa.fake_serpapi', '--port', '0', '--log_level', 'WARNING',
+               '--latency', str(options.latency), '--jitter', str(options.jitter),
+               '--error_rate', str(options.error_rate), '--throttle_rate', str(options.throttle_rate),
+               '--retry_after', '0', '--seed', '0']
+    for path in options.replay:
+        command += ['--replay', path]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+
+def iteration_times(run_dir, started):
+    # an iteration ends with the last output file written to its directory
+    times = []
+    previous = started
+    n = 1
+    while os.path.isdir(os.path.join(run_dir, f'iteration_{n}', 'output')):
+        output_dir = os.path.join(run_dir, f'iteration_{n}', 'output')
+        finished = max(os.path.getmtime(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+        times.append(round(finished - previous, 3))
+        previous = finished
+        n += 1
+    return times
+
+
+def run_size(n_queries, options):
+    # runs in its own process so that peak memory is measured per size
+    with TemporaryDirectory() as tmp_dir:
+        input_file = os.path.join(tmp_dir, f'seed_{n_queries}.csv')
+        write_seed_file(input_file, n_queries)
+        env_file = os.path.join(tmp_dir, 'api_key.env')
+        with open(env_file, 'w') as f:
+            f.write('API_KEY="benchmark"\n')
+        os.environ['SERPAPI_URL'] = options.url
+        started = time.time()
+        run_nativqa(options.engine, options.search_type, input_file, 'qa', 'Doha, Qatar', None, tmp_dir, env_file,
+                    options.n_iter, concurrency=options.concurrency, max_retries=options.max_retries,
+                    pipeline=options.pipeline)
+        elapsed = time.time() - started
+        run_dir = os.path.join(tmp_dir, options.search_type, f'seed_{n_queries}')
+        n_fetched = 0
+        for name in os.listdir(run_dir):
+            summary = os.path.join(run_dir, name, 'output', 'summary.jsonl')
+            if os.path.exists(summary):
+                with open(summary, 'rb') as f:
+                    n_fetched += sum(1 for _ in f)
+        return {'seed_queries': n_queries, 'fetched_queries': n_fetched, 'seconds': round(elapsed, 3),
+                'queries_per_second': round(n_fetched / elapsed, 2),
+                'iteration_seconds': iteration_times(run_dir, started),
+                'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--sizes', action='store', dest='sizes', default='1000,10000,100000', type="string",
+                      help='comma separated numbers of seed queries')
+    parser.add_option('-t', '--search_type', action='store', dest='search_type', default='text', type="string",
+                      help='image, text, or video')
+    parser.add_option('-s', '--engine', action='store', dest='engine', default='google', type="string",
+                      help='search engine')
+    parser.add_option('-n', '--n_iter', action='store', dest='n_iter', default=1, type="int",
+                      help='number of iterations')
+    parser.add_option('--concurrency', action='store', dest='concurrency', default=16, type="int",
+                      help='number of concurrent API requests')
+    parser.add_option('--max_retries', action='store', dest='max_retries', default=3, type="int",
+                      help='retries on HTTP 429/5xx')
+    parser.add_option('--pipeline', action='store_true', dest='pipeline', default=False,
+                      help='run with --pipeline')
+    parser.add_option('--latency', action='store', dest='latency', default=0.05, type="float",
+                      help='fake server latency in seconds')
+    parser.add_option('--jitter', action='store', dest='jitter', default=0.0, type="float",
+                      help='random extra latency in seconds')
+    parser.add_option('--error_rate', action='store', dest='error_rate', default=0.0, type="float",
+                      help='fraction of HTTP 500 responses')
+    parser.add_option('--throttle_rate', action='store', dest='throttle_rate', default=0.0, type="float",
+                      help='fraction of HTTP 429 responses')
+    parser.add_option('-r', '--replay', action='append', dest='replay', default=[], type="string",
+                      help='summary.jsonl file or result directory to replay')
+    parser.add_option('-o', '--output_file', action='store', dest='output_file', default=None, type="string",
+                      help='write the results as JSON to this file')
+    parser.add_option('--url', action='store', dest='url', default=None, type="string",
+                      help=optparse.SUPPRESS_HELP)
+    parser.add_option('--size', action='store', dest='size', default=None, type="int", help=optparse.SUPPRESS_HELP)
+
+    options, args = parser.parse_args()
+    if options.size is not None:
+        # child process: one size against the server started by the parent
+        print(json.dumps(run_size(options.size, options)))
+        return
+
+    server, url = start_server(options)
+    results = []
+    try:
+        for size in [int(size) for size in options.sizes.split(',')]:
+            child_args = [arg for arg in sys.argv[1:]]
+            output = subprocess.run([sys.executable, __file__, *child_args, '--url', url, '--size', str(size)],
+                                    stdout=subprocess.PIPE, text=True, check=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+            results.append(result)
+            print(f"{result['seed_queries']:>8} seeds  {result['fetched_queries']:>8} fetched  "
+                  f"{result['seconds']:>9.2f}s  {result['queries_per_second']:>9.2f} q/s  "
+                  f"{result['max_rss_mb']:>8.1f} MB  iterations {result['iteration_seconds']}", flush=True)
+    finally:
+        server.terminate()
+        server.wait()
+    if options.output_file is not None:
+        with open(options.output_file, 'w') as f:
+            json.dump({'options': {k: v for k, v in vars(options).items() if k not in ('url', 'size')},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,22 @@
 import argparse
 import datetime
+import hashlib
+import io
 import json
 import logging
 import os
 import pickle
 import time
 import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 
 import numpy as np
 import torch
 import torchvision.transforms as transforms
 from PIL import Image
-from pyflann import FLANN
-from sklearn.neighbors import NearestNeighbors
 from torch import nn
+from torch.utils.data import DataLoader, Dataset, default_collate
 from torchvision.models import resnet18, ResNet18_Weights
 from tqdm import tqdm
 
@@ -38,13 +41,33 @@ def check_dir(directory):
         os.makedirs(directory)
 
 
-def load_model():
+def get_device(device=None):
+    """
+    Resolve the device to run the model on.
+
+    Args:
+        device (str): "cuda", "cpu" or None to use a GPU when one is available.
+
+    Returns:
+        torch.device: The device.
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    return torch.device(device)
+
+
+def load_model(device=None):
     """
     Load a pre-trained ResNet-18 model and remove the final classification layer.
 
+    Args:
+        device (str): "cuda", "cpu" or None to use a GPU when one is available.
+
     Returns:
         torch.nn.Module: The feature extraction model.
     """
+    device = get_device(device)
+
     # Load pre-trained ResNet-18
     model = resnet18(weights=ResNet18_Weights.DEFAULT)
 
@@ -52,7 +75,12 @@ def load_model():
     model = nn.Sequential(*list(model.children())[:-1])
 
     # Enable multi-GPU support
-    model = torch.nn.DataParallel(model).cuda()
+    if device.type == "cuda" and torch.cuda.device_count() > 1:
+        model = torch.nn.DataParallel(model)
+    model = model.to(device)
+    if device.type == "cpu":
+        # NHWC convolutions are faster on CPU
+        model = model.to(memory_format=torch.channels_last)
 
     # Set model to evaluation mode (important for feature extraction)
     model.eval()
@@ -93,8 +121,316 @@ def read_image_list_jsonl(file_path):
     return data
 
 
+# Image preprocessing pipeline
+TRANSFORM = transforms.Compose(
+    [
+        transforms.Resize((256, 256)),
+        transforms.CenterCrop(224),
+        transforms.ToTensor(),
+        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+    ]
+)
+
+
+class ImageDataset(Dataset):
+    """Decodes and transforms images in DataLoader worker processes."""
+
+    def __init__(self, image_objects, transform=TRANSFORM):
+        self.image_paths = [img_object.get("image_path") for img_object in image_objects]
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.image_paths)
+
+    def __getitem__(self, index):
+        try:
+            img = Image.open(self.image_paths[index]).convert("RGB")
+            return self.transform(img), index
+        except Exception as e:
+            logging.error(f"Error processing {self.image_paths[index]}: {e}")
+            return None
+
+
+def collate_images(batch):
+    # Drop the images that could not be read
+    batch = [item for item in batch if item is not None]
+    if not batch:
+        return None
+    return default_collate(batch)
+
+
+def embed_images(model, image_objects, batch_size=64, num_workers=None, device=None):
+    """
+    Runs the model over the images in batches.
+
+    Args:
+        model (torch.nn.Module): The feature extraction model.
+        image_objects (list): List of image metadata dictionaries with "image_path" key.
+        batch_size (int): Number of images per forward pass.
+        num_workers (int): Number of image decoding processes, defaults to the number of CPUs (at most 8).
+        device (str): "cuda", "cpu" or None to use a GPU when one is available.
+
+    Yields:
+        tuple: (indices, features), the positions in image_objects of the images in the batch that
+               could be read and their float32 feature rows.
+    """
+    device = get_device(device)
+    if num_workers is None:
+        num_workers = min(os.cpu_count() or 1, 8)
+    loader_kwargs = {}
+    if num_workers > 0:
+        # torch < 2.0 rejects any prefetch_factor, even None, without worker processes
+        loader_kwargs["prefetch_factor"] = 4
+    loader = DataLoader(
+        ImageDataset(image_objects),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        collate_fn=collate_images,
+        pin_memory=device.type == "cuda",
+        **loader_kwargs,
+    )
+    memory_format = (
+        torch.channels_last if device.type == "cpu" else torch.contiguous_format
+    )
+
+    with torch.inference_mode():
+        for batch in tqdm(loader, desc="Extracting features"):
+            if batch is None:
+                continue
+            images, indices = batch
+            images = images.to(device, non_blocking=True, memory_format=memory_format)
+
+            # Forward pass to get features
+            yield indices.tolist(), model(images).flatten(1).float().cpu().numpy()
+
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_images(image_objects, num_threads=8):
+    """
+    Computes the SHA-256 of every image file.
+
+    Args:
+        image_objects (list): List of image metadata dictionaries with "image_path" key.
+        num_threads (int): Number of files read at the same time.
+
+    Returns:
+        list: Hex digests in the order of image_objects, None for files that could not be read.
+    """
+
+    def safe_sha256(image_path):
+        try:
+            return file_sha256(image_path)
+        except OSError as e:
+            logging.error(f"Error reading {image_path}: {e}")
+            return None
+
+    image_paths = [img_object["image_path"] for img_object in image_objects]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        return list(
+            tqdm(
+                executor.map(safe_sha256, image_paths),
+                total=len(image_paths),
+                desc="Hashing images",
+            )
+        )
+
+
+class EmbeddingStore:
+    """
+    Append-only float16 embedding matrix keyed by image content hash.
+
+    The store directory holds embeddings.f16 (rows of `dim` float16 values), ids.txt (the
+    SHA-256 of each row, one per line) and meta.json (dimension and model). Rows are read
+    through a memory map, so a store larger than RAM can be searched.
+    """
+
+    HASH_LINE = 65  # 64 hex digits and a newline
+
+    def __init__(self, directory, dim, model_name="resnet18"):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.embeddings_file = os.path.join(directory, "embeddings.f16")
+        self.ids_file = os.path.join(directory, "ids.txt")
+        meta_file = os.path.join(directory, "meta.json")
+        meta = {"dim": dim, "dtype": "float16", "model": model_name}
+        stored = None
+        if os.path.exists(meta_file):
+            with open(meta_file, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        # a store without a single complete id line has no embeddings and can be reopened with other settings
+        has_rows = (
+            os.path.exists(self.ids_file)
+            and os.path.getsize(self.ids_file) >= self.HASH_LINE
+        )
+        if stored is not None and stored != meta and has_rows:
+            raise ValueError(f"Embedding store {directory} holds {stored}, not {meta}")
+        if stored != meta:
+            with open(meta_file, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+        # embeddings are written before their ids, so an interrupted append leaves extra
+        # embedding rows or a partial id line, which are cut off here
+        row_bytes = dim * np.dtype(np.float16).itemsize
+        n_ids = (
+            os.path.getsize(self.ids_file) // self.HASH_LINE
+            if os.path.exists(self.ids_file)
+            else 0
+        )
+        n_rows = (
+            os.path.getsize(self.embeddings_file) // row_bytes
+            if os.path.exists(self.embeddings_file)
+            else 0
+        )
+        n = min(n_ids, n_rows)
+        self._embeddings_f = open(self.embeddings_file, "ab")
+        self._embeddings_f.truncate(n * row_bytes)
+        self._ids_f = open(self.ids_file, "a+", encoding="ascii")
+        self._ids_f.truncate(n * self.HASH_LINE)
+        self._ids_f.seek(0)
+        self.index = {line.rstrip("\n"): row for row, line in enumerate(self._ids_f)}
+        self._matrix = None
+        logging.info(f"Embedding store {directory}: {len(self.index)} embeddings")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, content_hash):
+        return content_hash in self.index
+
+    def append(self, content_hashes, features):
+        # the hashes must be new to the store
+        if features.ndim != 2 or features.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding store {self.directory} holds {self.dim}-dimensional embeddings, "
+                f"got features of shape {features.shape} (check --fc_dim)"
+            )
+        if len(content_hashes) != len(features):
+            raise ValueError(
+                f"{len(content_hashes)} content hashes for {len(features)} embeddings"
+            )
+        self._embeddings_f.write(
+            np.ascontiguousarray(features, dtype=np.float16).tobytes()
+        )
+        self._embeddings_f.flush()
+        os.fsync(self._embeddings_f.fileno())
+        self._ids_f.write("".join(f"{content_hash}\n" for content_hash in content_hashes))
+        self._ids_f.flush()
+        for content_hash in content_hashes:
+            self.index[content_hash] = len(self.index)
+        self._matrix = None
+
+    def matrix(self):
+        """Read-only memory map of every embedding in the store."""
+        if self._matrix is None:
+            if not self.index:
+                return np.empty((0, self.dim), dtype=np.float16)
+            self._matrix = np.memmap(
+                self.embeddings_file,
+                dtype=np.float16,
+                mode="r",
+                shape=(len(self.index), self.dim),
+            )
+        return self._matrix
+
+    def take(self, content_hashes):
+        """
+        Embeddings of the given hashes, in that order.
+
+        The memory map itself is returned when the hashes are exactly the rows of the store,
+        otherwise the rows are copied into memory.
+        """
+        rows = np.fromiter(
+            (self.index[content_hash] for content_hash in content_hashes),
+            dtype=np.int64,
+            count=len(content_hashes),
+        )
+        matrix = self.matrix()
+        if len(rows) == len(matrix) and np.array_equal(rows, np.arange(len(rows))):
+            return matrix
+        return matrix[rows]
+
+    def close(self):
+        self._embeddings_f.close()
+        self._ids_f.close()
+        self._matrix = None
+
+
+def extract_features_incremental(
+    model,
+    image_objects,
+    store,
+    batch_size=64,
+    num_workers=None,
+    device=None,
+    content_hashes=None,
+):
+    """
+    Embeds only the images whose content is not in the store yet.
+
+    Args:
+        model (torch.nn.Module): The feature extraction model.
+        image_objects (list): List of image metadata dictionaries with "image_path" key.
+        store (EmbeddingStore): Store the new embeddings are appended to.
+        batch_size (int): Number of images per forward pass.
+        num_workers (int): Number of image decoding processes.
+        device (str): "cuda", "cpu" or None to use a GPU when one is available.
+        content_hashes (list): SHA-256 of every image if already known, e.g. from perceptual_prefilter.
+
+    Returns:
+        tuple: (features, filtered_images), where features is a float16 array (or memory map)
+               with one row per image in filtered_images.
+    """
+    if content_hashes is None:
+        content_hashes = hash_images(image_objects)
+    # byte-identical images share one embedding
+    new_images = {}
+    for img_idx, content_hash in enumerate(content_hashes):
+        if (
+            content_hash is not None
+            and content_hash not in store
+            and content_hash not in new_images
+        ):
+            new_images[content_hash] = img_idx
+    logging.info(
+        f"Embedding {len(new_images)} new images, {len(image_objects) - len(new_images)} "
+        f"are in the store, duplicates or unreadable"
+    )
+    new_hashes = list(new_images)
+    to_embed = [image_objects[img_idx] for img_idx in new_images.values()]
+    for indices, output in embed_images(
+        model, to_embed, batch_size, num_workers, device
+    ):
+        store.append([new_hashes[i] for i in indices], output)
+
+    kept = [
+        img_idx
+        for img_idx, content_hash in enumerate(content_hashes)
+        if content_hash is not None and content_hash in store
+    ]
+    features = store.take([content_hashes[img_idx] for img_idx in kept])
+    filtered_image_objects = [image_objects[img_idx] for img_idx in kept]
+    logging.info(f"Loaded {len(kept)} features from the store, shape: {features.shape}")
+    return features, filtered_image_objects
+
+
 def extract_features(
-    model, image_objects, output_file_name, fc_dim=1024, calculate_img_scores=True
+    model,
+    image_objects,
+    output_file_name,
+    fc_dim=512,
+    calculate_img_scores=True,
+    batch_size=64,
+    num_workers=None,
+    device=None,
 ):
     """
     Extracts image features using a pre-trained model.
@@ -105,20 +441,14 @@ def extract_features(
         output_file_name (str): File path for saving extracted features.
         calculate_img_scores (bool): Whether to compute features or load from file.
         fc_dim (int): Feature dimension.
+        batch_size (int): Number of images per forward pass.
+        num_workers (int): Number of image decoding processes, defaults to the number of CPUs (at most 8).
+        device (str): "cuda", "cpu" or None to use a GPU when one is available.
 
     Returns:
         tuple: (features, filtered_images), where features is a NumPy array of extracted features
                and filtered_images contains successfully processed image metadata.
     """
-    # Define image preprocessing pipeline
-    transform = transforms.Compose(
-        [
-            transforms.Resize((256, 256)),
-            transforms.CenterCrop(224),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-        ]
-    )
 
     # Prepare output paths
     output_dir = os.path.dirname(output_file_name)
@@ -140,26 +470,20 @@ def extract_features(
     features = np.empty((len(image_objects), fc_dim), dtype=np.float32)
     filtered_image_objects = []
 
-    # Set model to evaluation mode
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model.to(device)
+    n_features = 0
+    for indices, output in embed_images(
+        model, image_objects, batch_size, num_workers, device
+    ):
+        features[n_features : n_features + len(output)] = output
+        n_features += len(output)
+        filtered_image_objects.extend(image_objects[i] for i in indices)
+    # Rows of the images that could not be read are dropped
+    features = features[:n_features]
 
-    with torch.no_grad():
-        for img_idx, img_object in enumerate(
-            tqdm(image_objects, desc="Extracting features")
-        ):
-            img_name = img_object.get("image_path")
-            try:
-                img = Image.open(img_name).convert("RGB")
-                input_tensor = transform(img).unsqueeze(0).to(device)
-
-                # Forward pass to get features
-                features[img_idx] = model(input_tensor).squeeze().cpu().numpy()
-                filtered_image_objects.append(img_object)
-            except Exception as e:
-                logging.error(f"Error processing {img_object['image_path']}: {e}")
     # Save features and metadata
     np.save(feature_file, features)
+    with open(img_info_file, "wb") as f:
+        pickle.dump(filtered_image_objects, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     print(
         f"Saved {len(filtered_image_objects)} extracted features to {feature_file}, shape: {features.shape}"
@@ -167,29 +491,518 @@ def extract_features(
     return features, filtered_image_objects
 
 
-def compute_duplicate_flann(features, output_file_name, threshold):
+def connected_components(n_points, rows, cols):
+    """
+    Union-find over the duplicate edges, vectorized as hooking and pointer jumping.
+
+    Args:
+        n_points (int): Number of points.
+        rows (np.ndarray): First point of each edge.
+        cols (np.ndarray): Second point of each edge.
+
+    Returns:
+        np.ndarray: The label of every point, which is the smallest index in its connected component.
+    """
+    labels = np.arange(n_points)
+    while True:
+        # hook the root of every edge end to the smaller of the two roots
+        root_rows, root_cols = labels[rows], labels[cols]
+        low = np.minimum(root_rows, root_cols)
+        parents = labels.copy()
+        np.minimum.at(parents, root_rows, low)
+        np.minimum.at(parents, root_cols, low)
+        # compress every path to its root
+        while True:
+            grandparents = parents[parents]
+            if np.array_equal(grandparents, parents):
+                break
+            parents = grandparents
+        if np.array_equal(parents, labels):
+            return labels
+        labels = parents
+
+
+def group_duplicates(n_points, nbr_indices):
+    """
+    Groups transitive duplicates and picks the smallest index of each group as its representative.
+
+    Args:
+        n_points (int): Number of points.
+        nbr_indices (np.ndarray): Neighbor indices of every point within the threshold.
+
+    Returns:
+        tuple: (nonduplicate_indices, duplicate_indices), the sorted representatives and a dict
+               mapping each representative to the sorted indices of its group.
+    """
+    counts = np.fromiter((len(nbrs) for nbrs in nbr_indices), dtype=np.int64, count=n_points)
+    rows = np.repeat(np.arange(n_points), counts)
+    cols = (
+        np.concatenate([np.asarray(nbrs, dtype=np.int64) for nbrs in nbr_indices])
+        if counts.sum()
+        else np.empty(0, dtype=np.int64)
+    )
+    labels = connected_components(n_points, rows, cols)
+
+    order = np.argsort(labels, kind="stable")
+    representatives, starts = np.unique(labels[order], return_index=True)
+    groups = np.split(order, starts[1:])
+    nonduplicate_indices = [int(rep) for rep in representatives]
+    duplicate_indices = {
+        int(rep): [int(j) for j in group] for rep, group in zip(representatives, groups)
+    }
+    return nonduplicate_indices, duplicate_indices
+
+
+def _dct_matrix(size):
+    # unnormalized DCT-II basis, rows are frequencies
+    n = np.arange(size)
+    return np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size))
+
+
+PHASH_SIZE = 8
+DCT_32 = _dct_matrix(PHASH_SIZE * 4)
+
+
+def bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def dhash(gray, hash_size=PHASH_SIZE):
+    """64-bit difference hash: is each pixel brighter than its left neighbor."""
+    pixels = np.asarray(gray.resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    return bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray, hash_size=PHASH_SIZE):
+    """64-bit perceptual hash: signs of the lowest DCT frequencies of a 32x32 thumbnail around their median."""
+    size = DCT_32.shape[0]
+    pixels = np.asarray(gray.resize((size, size), Image.LANCZOS), dtype=np.float64)
+    low = (DCT_32 @ pixels @ DCT_32.T)[:hash_size, :hash_size]
+    return bits_to_int(low > np.median(low))
+
+
+def image_hashes(image_path):
+    """
+    Reads an image file once for its SHA-256, pHash and dHash.
+
+    Returns:
+        tuple: (sha256 hex digest, phash, dhash), or None when the image cannot be read.
+    """
+    try:
+        with open(image_path, "rb") as f:
+            data = f.read()
+        img = Image.open(io.BytesIO(data))
+        # JPEGs are decoded at a reduced scale, the hashes only need a small thumbnail
+        img.draft("L", (64, 64))
+        gray = img.convert("L")
+        return hashlib.sha256(data).hexdigest(), phash(gray), dhash(gray)
+    except Exception as e:
+        logging.error(f"Error hashing {image_path}: {e}")
+        return None
+
+
+def popcount64(values):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    bytes_view = values.view(np.uint8).reshape(values.shape + (8,))
+    return np.unpackbits(bytes_view, axis=-1).sum(axis=-1)
+
+
+def hamming_pairs(phashes, dhashes, max_distance, max_block=1 << 22):
+    """
+    Multi-index hashing: finds the pairs whose pHash and dHash both differ in at most max_distance bits.
+
+    The pHash is split into max_distance + 1 bands, so two hashes within the distance agree
+    exactly on at least one band; only hashes that share a band value are compared.
+
+    Args:
+        phashes (np.ndarray): uint64 pHashes.
+        dhashes (np.ndarray): uint64 dHashes.
+        max_distance (int): Maximum number of differing bits.
+        max_block (int): Maximum number of hash pairs compared at once.
+
+    Returns:
+        tuple: (rows, cols), the two sides of every pair (a pair can be listed more than once).
+    """
+    rows, cols = [], []
+    n_bands = min(max_distance + 1, 64)
+    edges = np.linspace(0, 64, n_bands + 1).astype(int)
+    for low, high in zip(edges[:-1], edges[1:]):
+        band = (phashes >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+        order = np.argsort(band, kind="stable")
+        sorted_band = band[order]
+        starts = np.flatnonzero(np.r_[True, sorted_band[1:] != sorted_band[:-1]])
+        sizes = np.diff(np.append(starts, len(order)))
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start : start + size]
+            step = max(1, max_block // size)
+            for chunk in range(0, size, step):
+                a = members[chunk : chunk + step]
+                distance = np.maximum(
+                    popcount64(phashes[a][:, None] ^ phashes[members][None, :]),
+                    popcount64(dhashes[a][:, None] ^ dhashes[members][None, :]),
+                )
+                # every pair once: only members after the row
+                later = np.arange(len(members))[None, :] > np.arange(chunk, chunk + len(a))[:, None]
+                i, j = np.nonzero((distance <= max_distance) & later)
+                rows.append(a[i])
+                cols.append(members[j])
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(cols)
+
+
+def perceptual_prefilter(image_objects, max_distance=4, num_workers=None):
+    """
+    Collapses byte-identical images (SHA-256) and images whose pHash and dHash are within
+    max_distance bits, so that only one image of each group goes through the CNN.
+
+    Args:
+        image_objects (list): List of image metadata dictionaries with "image_path" key.
+        max_distance (int): Maximum Hamming distance between the hashes of duplicates.
+        num_workers (int): Number of hashing processes, defaults to the number of CPUs; 0 hashes in
+                           this process, like the DataLoader.
+
+    Returns:
+        tuple: (representatives, content_hashes, groups), the first image of every group in input
+               order, their SHA-256 and a dict mapping the index of each representative in
+               image_objects to the indices of the images it stands for. Unreadable images are dropped.
+    """
+    image_paths = [img_object["image_path"] for img_object in image_objects]
+    executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers != 0 else None
+    with executor or nullcontext():
+        hashes = list(
+            tqdm(
+                executor.map(image_hashes, image_paths, chunksize=64)
+                if executor is not None
+                else map(image_hashes, image_paths),
+                total=len(image_paths),
+                desc="Hashing images",
+            )
+        )
+    readable = np.array([i for i, h in enumerate(hashes) if h is not None], dtype=np.int64)
+    if not len(readable):
+        return [], [], {}
+    # byte-identical images have identical perceptual hashes, so equal hash pairs are collapsed first
+    keys = np.array(
+        [(hashes[i][1], hashes[i][2]) for i in readable], dtype=np.uint64
+    ).reshape(-1, 2)
+    unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    rows, cols = hamming_pairs(unique_keys[:, 0], unique_keys[:, 1], max_distance)
+    key_labels = connected_components(len(unique_keys), rows, cols)
+
+    # the representative of a group is its first readable image
+    labels = key_labels[inverse]
+    first = np.full(len(unique_keys), len(readable), dtype=np.int64)
+    np.minimum.at(first, labels, np.arange(len(readable)))
+    representative_of = readable[first[labels]]
+    groups = {}
+    for img_idx, rep_idx in zip(readable.tolist(), representative_of.tolist()):
+        groups.setdefault(rep_idx, []).append(img_idx)
+    representatives = sorted(groups)
+    logging.info(
+        f"Perceptual hash prefilter: {len(readable)} readable images in {len(representatives)} groups, "
+        f"{len(readable) - len(representatives)} duplicates skip the CNN"
+    )
+    return (
+        [image_objects[i] for i in representatives],
+        [hashes[i][0] for i in representatives],
+        {rep: members for rep, members in groups.items() if len(members) > 1},
+    )
+
+
+def write_prefilter_groups(file_name, groups, image_objects):
+    dir_name = os.path.dirname(file_name)
+    base_name, _ = os.path.splitext(os.path.basename(file_name))
+    out_file_name = os.path.join(dir_name, f"{base_name}_hash_duplicates.jsonl")
+    with open(out_file_name, "w", encoding="utf-8") as out_file:
+        for rep, members in groups.items():
+            image_path = image_objects[rep]["image_path"]
+            duplicates = [image_objects[i]["image_path"] for i in members if i != rep]
+            out_file.write(json.dumps({image_path: duplicates}, ensure_ascii=False) + "\n")
+    logging.info(f"Hash duplicate groups saved to {out_file_name}")
+
+
+class ExactIndex:
+    """Exact search by blocked matrix products (NumPy/BLAS), also on memory-mapped features."""
+
+    name = "exact"
+
+    def __init__(self, threads=0, block_size=4096):
+        self.threads = threads
+        self.block_size = block_size
+
+    def blas_threads(self):
+        # threads > 0 caps the BLAS thread pool during build and search, 0 leaves it at all cores
+        if not self.threads:
+            return nullcontext()
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            logging.warning(
+                "threadpoolctl is not installed, the exact index ignores threads=%d "
+                "(set OMP_NUM_THREADS/OPENBLAS_NUM_THREADS instead)",
+                self.threads,
+            )
+            return nullcontext()
+        return threadpool_limits(limits=self.threads, user_api="blas")
+
+    def build(self, features):
+        self.features = features
+        self.sq_norms = np.concatenate(
+            [
+                np.square(features[start : start + self.block_size], dtype=np.float32).sum(axis=1)
+                for start in range(0, len(features), self.block_size)
+            ]
+        )
+
+    def search(self, queries, k):
+        with self.blas_threads():
+            return self._search(queries, k)
+
+    def _search(self, queries, k):
+        n_queries = len(queries)
+        indices = np.empty((n_queries, k), dtype=np.int64)
+        dists = np.empty((n_queries, k), dtype=np.float32)
+        for q_start in tqdm(range(0, n_queries, self.block_size), desc="Exact search"):
+            query = np.asarray(queries[q_start : q_start + self.block_size], dtype=np.float32)
+            query_norms = np.square(query).sum(axis=1)
+            # running k nearest of the query block, merged with every block of the features
+            best_i = np.full((len(query), k), -1, dtype=np.int64)
+            best_d = np.full((len(query), k), np.inf, dtype=np.float32)
+            for start in range(0, len(self.features), self.block_size):
+                block = np.asarray(self.features[start : start + self.block_size], dtype=np.float32)
+                # squared L2 distances as |q|^2 + |x|^2 - 2 q.x
+                block_d = query_norms[:, None] + self.sq_norms[None, start : start + len(block)]
+                block_d -= 2 * (query @ block.T)
+                np.maximum(block_d, 0, out=block_d)
+                cand_d = np.hstack([best_d, block_d])
+                positions = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+                from_block = positions >= k
+                best_d = np.take_along_axis(cand_d, positions, axis=1)
+                best_i = np.where(
+                    from_block,
+                    start + positions - k,
+                    np.take_along_axis(best_i, np.where(from_block, 0, positions), axis=1),
+                )
+            # nearest first, as the other backends return them
+            order = np.argsort(best_d, axis=1, kind="stable")
+            indices[q_start : q_start + len(query)] = np.take_along_axis(best_i, order, axis=1)
+            dists[q_start : q_start + len(query)] = np.take_along_axis(best_d, order, axis=1)
+        return indices, dists
+
+
+class FlannIndex:
+    """FLANN randomized kd-trees (pyflann)."""
+
+    name = "flann"
+
+    def __init__(self, threads=0, trees=8, checks=64):
+        self.threads = threads
+        self.trees = trees
+        self.checks = checks
+
+    def build(self, features):
+        from pyflann import FLANN
+
+        self.flann = FLANN()
+        self.flann.build_index(
+            np.ascontiguousarray(features, dtype=np.float32),
+            algorithm="kdtree",
+            trees=self.trees,
+            checks=self.checks,
+        )
+
+    def search(self, queries, k):
+        indices, dists = self.flann.nn_index(
+            np.ascontiguousarray(queries, dtype=np.float32),
+            num_neighbors=k,
+            checks=self.checks,
+            cores=self.threads,
+        )
+        return indices.reshape(len(queries), k), dists.reshape(len(queries), k)
+
+
+class HnswIndex:
+    """Approximate search on an HNSW graph (hnswlib)."""
+
+    name = "hnsw"
+
+    def __init__(self, threads=0, m=32, ef_construction=200, ef_search=128, block_size=65536):
+        self.threads = threads or -1
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.block_size = block_size
+
+    def build(self, features):
+        import hnswlib
+
+        self.index = hnswlib.Index(space="l2", dim=features.shape[1])
+        self.index.init_index(
+            max_elements=len(features), ef_construction=self.ef_construction, M=self.m
+        )
+        for start in tqdm(range(0, len(features), self.block_size), desc="Building HNSW"):
+            block = np.asarray(features[start : start + self.block_size], dtype=np.float32)
+            self.index.add_items(
+                block, np.arange(start, start + len(block)), num_threads=self.threads
+            )
+
+    def search(self, queries, k):
+        self.index.set_ef(max(self.ef_search, k))
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        dists = np.empty((len(queries), k), dtype=np.float32)
+        for start in range(0, len(queries), self.block_size):
+            block = np.asarray(queries[start : start + self.block_size], dtype=np.float32)
+            labels, block_d = self.index.knn_query(block, k=k, num_threads=self.threads)
+            indices[start : start + len(block)] = labels
+            dists[start : start + len(block)] = block_d
+        return indices, dists
+
+
+class IvfPqIndex:
     """
-    Compute duplicate images using FLANN nearest neighbors search.
+    Approximate search on product-quantized inverted lists (faiss IndexIVFPQ), about dim / 8 bytes per image.
+
+    The `rerank` * k nearest candidates by compressed distance are re-ranked by their exact
+    distance, read from the (memory-mapped) features.
+    """
+
+    name = "ivfpq"
+
+    def __init__(
+        self,
+        threads=0,
+        n_lists=None,
+        n_subquantizers=None,
+        n_probe=32,
+        rerank=4,
+        block_size=65536,
+    ):
+        self.threads = threads
+        self.n_lists = n_lists
+        self.n_subquantizers = n_subquantizers
+        self.n_probe = n_probe
+        self.rerank = rerank
+        self.block_size = block_size
+
+    def build(self, features):
+        import faiss
+
+        if self.threads:
+            faiss.omp_set_num_threads(self.threads)
+        n_points, dim = features.shape
+        n_lists = self.n_lists or max(1, min(int(4 * np.sqrt(n_points)), n_points // 39))
+        # sub-vectors of 8 dimensions, 8 bits per code when there are enough points to train on
+        n_subquantizers = self.n_subquantizers or next(
+            m for m in range(max(dim // 8, 1), 0, -1) if dim % m == 0
+        )
+        n_bits = int(min(8, max(1, np.log2(max(n_points // 39, 2)))))
+        quantizer = faiss.IndexFlatL2(dim)
+        self.index = faiss.IndexIVFPQ(quantizer, dim, n_lists, n_subquantizers, n_bits)
+        rng = np.random.default_rng(0)
+        n_train = min(n_points, max(n_lists, 2**n_bits) * 64)
+        sample = np.sort(rng.choice(n_points, n_train, replace=False))
+        self.index.train(np.asarray(features[sample], dtype=np.float32))
+        self.features = features
+        for start in tqdm(range(0, n_points, self.block_size), desc="Building IVF-PQ"):
+            self.index.add(np.asarray(features[start : start + self.block_size], dtype=np.float32))
+        self.index.nprobe = min(self.n_probe, n_lists)
+
+    def search(self, queries, k):
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        dists = np.empty((len(queries), k), dtype=np.float32)
+        n_candidates = min(k * self.rerank, self.index.ntotal)
+        # the candidate rows of a block of queries are gathered at once, about 64 MB of float32
+        block_size = max(1, min(self.block_size, 2**24 // (n_candidates * self.features.shape[1])))
+        for start in tqdm(range(0, len(queries), block_size), desc="IVF-PQ search"):
+            block = np.asarray(queries[start : start + block_size], dtype=np.float32)
+            _, labels = self.index.search(block, n_candidates)
+            # faiss pads missing neighbors with -1
+            missing = labels < 0
+            rows = np.asarray(
+                self.features[np.where(missing, 0, labels).ravel()], dtype=np.float32
+            ).reshape(len(block), n_candidates, -1)
+            block_d = np.square(rows - block[:, None, :]).sum(axis=2)
+            block_d[missing] = np.inf
+            positions = np.argsort(block_d, axis=1, kind="stable")[:, :k]
+            indices[start : start + len(block)] = np.take_along_axis(labels, positions, axis=1)
+            dists[start : start + len(block)] = np.take_along_axis(block_d, positions, axis=1)
+        return indices, dists
+
+
+INDEXES = {
+    index.name: index for index in (FlannIndex, ExactIndex, HnswIndex, IvfPqIndex)
+}
+
+
+def l2_normalize(features, block_size=65536):
+    # float16 copy with unit rows, in blocks so that memory-mapped features are never converted at once
+    normalized = np.empty(features.shape, dtype=np.float16)
+    for start in range(0, len(features), block_size):
+        block = np.asarray(features[start : start + block_size], dtype=np.float32)
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        normalized[start : start + len(block)] = block / np.maximum(norms, 1e-12)
+    return normalized
+
+
+def compute_duplicates(
+    features,
+    output_file_name,
+    threshold,
+    index="flann",
+    max_neighbors=32,
+    threads=0,
+    metric="l2",
+):
+    """
+    Compute duplicate images with a nearest neighbors index.
+
+    All points are queried at once for their `max_neighbors` nearest neighbors, of which
+    those within the threshold are kept.
 
     Args:
         features (np.ndarray): Feature matrix where each row corresponds to an image feature vector.
         output_file_name (str): Path to save the duplicate detection results.
-        threshold (float): Radius for nearest neighbor search.
+        threshold (float): Squared L2 distance (as in FLANN) or, with metric "cosine", cosine distance.
+        index (str): "flann", "exact", "hnsw" or "ivfpq", see INDEXES.
+        max_neighbors (int): Maximum number of neighbors per point.
+        threads (int): Number of search threads, 0 for all cores.
+        metric (str): "l2" or "cosine".
 
     Returns:
-        tuple: (nbr_distances, nbr_indices) containing neighbor distances and indices.
+        tuple: (nbr_distances, nbr_indices, nonduplicate_indices, duplicate_indices).
     """
     nearest_neighbor_start_time = time.time()
-    flann = FLANN()
-    flann.build_index(features, algorithm="kdtree", trees=8, checks=64)
-    nbr_distances = np.empty(features.shape[0], dtype=object)
-    nbr_indices = np.empty(features.shape[0], dtype=object)
-
-    for i in tqdm(range(features.shape[0])):
-        indices, dists = flann.nn_radius(features[i], threshold)
-        nbr_indices[i] = np.sort(indices)
-        ind = np.argsort(indices)
-        nbr_distances[i] = [dists[j] for j in ind]
+    n_points = features.shape[0]
+    if metric == "cosine":
+        # squared L2 between unit vectors is twice the cosine distance
+        features = l2_normalize(features)
+    nn_index = INDEXES[index](threads=threads)
+    nn_index.build(features)
+    k = min(max_neighbors, n_points)
+    indices, dists = nn_index.search(features, k)
+    if metric == "cosine":
+        dists = dists / 2
+
+    within = (dists <= threshold) & (indices >= 0)
+    n_saturated = int(within[:, -1].sum()) if k < n_points else 0
+    if n_saturated:
+        logging.warning(
+            f"{n_saturated} images have at least {k} neighbors within the threshold, "
+            f"raise --max_neighbors to list them all (groups are still joined transitively)"
+        )
+    # neighbors of every row sorted by index, with their distances
+    order = np.argsort(np.where(within, indices, n_points), axis=1, kind="stable")
+    indices = np.take_along_axis(indices, order, axis=1)
+    dists = np.take_along_axis(dists, order, axis=1)
+    counts = within.sum(axis=1)
+    nbr_indices = np.empty(n_points, dtype=object)
+    nbr_distances = np.empty(n_points, dtype=object)
+    for i in range(n_points):
+        nbr_indices[i] = indices[i, : counts[i]]
+        nbr_distances[i] = list(dists[i, : counts[i]])
 
     dir_name = os.path.dirname(output_file_name)
     base_name = os.path.basename(output_file_name)
@@ -199,28 +1012,34 @@ def compute_duplicate_flann(features, output_file_name, threshold):
     )
 
     logging.info(
-        "Nearest neighbor calculation time: %.3f seconds",
+        "Nearest neighbor calculation time (%s): %.3f seconds",
+        index,
         (time.time() - nearest_neighbor_start_time),
     )
     with open(out_all_neighbor_info_file, "wb") as f:
         pickle.dump((nbr_distances, nbr_indices), f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    seen_indices = set()
-    nonduplicate_indices = set()
-    duplicate_indices = dict()
-    for i in range(nbr_indices.size):
-        if i in seen_indices:
-            continue
-        nonduplicate_indices.add(int(i))
-        dups = []
-        for j in nbr_indices[i]:
-            seen_indices.add(int(j))
-            dups.append(int(j))
-        duplicate_indices[i] = dups
+    nonduplicate_indices, duplicate_indices = group_duplicates(n_points, nbr_indices)
 
     return nbr_distances, nbr_indices, nonduplicate_indices, duplicate_indices
 
 
+def compute_duplicate_flann(
+    features, output_file_name, threshold, max_neighbors=32, cores=0
+):
+    """
+    Compute duplicate images using FLANN nearest neighbors search, see compute_duplicates.
+    """
+    return compute_duplicates(
+        features,
+        output_file_name,
+        threshold,
+        index="flann",
+        max_neighbors=max_neighbors,
+        threads=cores,
+    )
+
+
 def make_serializable(obj):
     if isinstance(obj, np.float32):
         return float(obj)
@@ -246,8 +1065,8 @@ def write_nn_results(file_name, nbr_indices, nbr_distances, image_objects):
 
             data = {
                 neighbor["image_path"]: dist
-                for neighbor, dist in zip(neighbors, distances)
-                if not (dist == 0.0 and neighbor["image_path"] == image_path)
+                for j, neighbor, dist in zip(nbr_indices[index], neighbors, distances)
+                if j != index
             }
 
             if data:
@@ -273,8 +1092,9 @@ if __name__ == "__main__":
         "-i",
         "--input_file",
         type=str,
+        nargs="+",
         required=True,
-        help="Input file containing image paths",
+        help="Input file(s) containing image paths, deduplicated together",
     )
     parser.add_argument(
         "-o",
@@ -288,7 +1108,22 @@ if __name__ == "__main__":
         "--threshold",
         type=float,
         default=1.5,
-        help="Threshold for duplicate detection",
+        help="Threshold for duplicate detection: squared L2 distance, or cosine distance with --metric cosine",
+    )
+    parser.add_argument(
+        "--index",
+        type=str,
+        default="flann",
+        choices=list(INDEXES),
+        help="Nearest neighbor index: flann (kd-trees, pyflann), exact (NumPy/BLAS), "
+        "hnsw (hnswlib) or ivfpq (faiss, compressed)",
+    )
+    parser.add_argument(
+        "--metric",
+        type=str,
+        default="l2",
+        choices=["l2", "cosine"],
+        help="Distance the threshold applies to",
     )
     parser.add_argument(
         "-f",
@@ -297,27 +1132,123 @@ if __name__ == "__main__":
         default=512,
         help="Feture dimension",
     )
+    parser.add_argument(
+        "-k",
+        "--max_neighbors",
+        type=int,
+        default=32,
+        help="Maximum number of neighbors searched per image",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch_size",
+        type=int,
+        default=64,
+        help="Number of images per forward pass",
+    )
+    parser.add_argument(
+        "-w",
+        "--num_workers",
+        type=int,
+        default=None,
+        help="Number of image decoding and hashing processes, 0 to work in the main process (default: number of CPUs, at most 8 for decoding)",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        choices=["cuda", "cpu"],
+        help="Device for feature extraction (default: cuda when available)",
+    )
+    parser.add_argument(
+        "-s",
+        "--store_dir",
+        type=str,
+        default=None,
+        help="Embedding store shared across runs (default: embedding_store next to the output file)",
+    )
+    parser.add_argument(
+        "--no_store",
+        action="store_true",
+        help="Embed every image and save the features to <output>.npy instead of using the store",
+    )
+    parser.add_argument(
+        "--phash_distance",
+        type=int,
+        default=4,
+        help="Images whose pHash and dHash differ in at most this many bits are duplicates before the CNN",
+    )
+    parser.add_argument(
+        "--no_prefilter",
+        action="store_true",
+        help="Skip the SHA-256/perceptual hash stage and embed every image",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of CPU threads for the model and the neighbor search (default: all cores)",
+    )
     args = parser.parse_args()
 
     logging.info(f"Input arguments: {args}")
-
-    images_objects = read_image_list_jsonl(args.input_file)
-
-    model = load_model()
-    features, filtered_image_objects = extract_features(
-        model,
-        images_objects,
-        args.output_file,
-        fc_dim=args.fc_dim,
-        calculate_img_scores=True,
-    )
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    check_dir(os.path.dirname(os.path.abspath(args.output_file)))
+
+    images_objects = []
+    for input_file in args.input_file:
+        images_objects.extend(read_image_list_jsonl(input_file))
+
+    candidate_objects, content_hashes = images_objects, None
+    if not args.no_prefilter:
+        candidate_objects, content_hashes, hash_groups = perceptual_prefilter(
+            images_objects, args.phash_distance, args.num_workers
+        )
+        write_prefilter_groups(args.output_file, hash_groups, images_objects)
+
+    model = load_model(args.device)
+    if args.no_store:
+        features, filtered_image_objects = extract_features(
+            model,
+            candidate_objects,
+            args.output_file,
+            fc_dim=args.fc_dim,
+            calculate_img_scores=True,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            device=args.device,
+        )
+    else:
+        store_dir = args.store_dir or os.path.join(
+            os.path.dirname(os.path.abspath(args.output_file)), "embedding_store"
+        )
+        store = EmbeddingStore(store_dir, args.fc_dim)
+        features, filtered_image_objects = extract_features_incremental(
+            model,
+            candidate_objects,
+            store,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            device=args.device,
+            content_hashes=content_hashes,
+        )
 
     (
         nbr_distances,
         nbr_indices,
         nonduplicate_indices,
         duplicate_indices,
-    ) = compute_duplicate_flann(features, args.output_file, args.threshold)
+    ) = compute_duplicates(
+        features,
+        args.output_file,
+        args.threshold,
+        index=args.index,
+        max_neighbors=args.max_neighbors,
+        threads=args.threads or 0,
+        metric=args.metric,
+    )
     write_nn_results(
         args.output_file, nbr_indices, nbr_distances, filtered_image_objects
     )
@@ -325,6 +1256,9 @@ if __name__ == "__main__":
 
     # generate_nn_html(file_name, nbr_indices, nbr_distances, images_objects, images_objects, source,threshold)
 
+    if not args.no_store:
+        store.close()
+
     logging.info(f"Original number of images: {len(images_objects)}")
     logging.info(f"Number of images after filtering: {len(nonduplicate_indices)}")
     logging.info(f"Total execution time: {datetime.datetime.now() - start_time}")
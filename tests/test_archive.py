@@ -0,0 +1,104 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nativqa.archive import ResponseArchive, read_archived_queries, ARCHIVE_FILE, INDEX_FILE
+from nativqa.fake_serpapi import FakeSerpApi
+from nativqa.nativqa_framework import extract_completed_img_vid_queries, run_nativqa
+from nativqa.utils import iter_summary_data, read_txt_data
+
+
+def response(query, n=3):
+    return {'search_parameters': {'q': query, 'category': 'food'},
+            'images_results': [{'position': i, 'original': f'http://img/{query}/{i}'} for i in range(n)]}
+
+
+class TestResponseArchive(unittest.TestCase):
+    def test_random_access(self):
+        queries = [f'query {i}' for i in range(10)]
+        with TemporaryDirectory() as tmp_dir:
+            with ResponseArchive(tmp_dir, chunk_size=4) as archive:
+                for query in queries:
+                    self.assertTrue(archive.write(response(query)))
+                self.assertFalse(archive.write(response('query 0')))
+            with ResponseArchive(tmp_dir) as archive:
+                self.assertEqual(len(archive), 10)
+                self.assertIn('query 7', archive)
+                self.assertNotIn('query 10', archive)
+                self.assertEqual(archive.get('query 7'), response('query 7'))
+                self.assertIsNone(archive.get('query 10'))
+                self.assertEqual([r['search_parameters']['q'] for r in archive], queries)
+            self.assertEqual(list(read_archived_queries(tmp_dir)), queries)
+
+    def test_recovers_from_partial_write(self):
+        with TemporaryDirectory() as tmp_dir:
+            with ResponseArchive(tmp_dir, chunk_size=2) as archive:
+                for query in ('a', 'b', 'c'):
+                    archive.write(response(query))
+            index_size = os.path.getsize(os.path.join(tmp_dir, INDEX_FILE))
+            # a crash after an unindexed frame and half an index row
+            with open(os.path.join(tmp_dir, ARCHIVE_FILE), 'ab') as f:
+                f.write(b'garbage')
+            with open(os.path.join(tmp_dir, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write('deadbeef\t12')
+            with ResponseArchive(tmp_dir) as archive:
+                self.assertEqual(os.path.getsize(os.path.join(tmp_dir, INDEX_FILE)), index_size)
+                self.assertEqual(len(archive), 3)
+                archive.write(response('d'))
+            with ResponseArchive(tmp_dir) as archive:
+                self.assertEqual([r['search_parameters']['q'] for r in archive], ['a', 'b', 'c', 'd'])
+                self.assertEqual(archive.get('c'), response('c'))
+
+    def test_extract_completed_queries_from_archive(self):
+        with TemporaryDirectory() as tmp_dir:
+            for iteration, queries in (('iteration_1', ['Machboos', 'Karak tea']), ('iteration_2', ['Karak  tea'])):
+                output_dir = os.path.join(tmp_dir, iteration, 'output')
+                os.makedirs(output_dir)
+                with ResponseArchive(output_dir) as archive:
+                    for query in queries:
+                        archive.write(response(query))
+            output_file = extract_completed_img_vid_queries(tmp_dir)
+            self.assertEqual(len(read_txt_data(output_file)), 2)
+
+    def test_extract_completed_queries_from_summary(self):
+        # runs without --response_archive only have summary.jsonl
+        with TemporaryDirectory() as tmp_dir:
+            output_dir = os.path.join(tmp_dir, 'iteration_1', 'output')
+            os.makedirs(output_dir)
+            with open(os.path.join(output_dir, 'summary.jsonl'), 'w', encoding='utf-8') as f:
+                for query in ('Machboos', 'Karak tea', 'Karak  tea'):
+                    f.write(json.dumps(response(query)) + '\n')
+            output_file = extract_completed_img_vid_queries(tmp_dir)
+            self.assertEqual(read_txt_data(output_file), ['Machboos', 'Karak tea'])
+
+    def test_archive_is_opt_in(self):
+        with TemporaryDirectory() as tmp_dir, FakeSerpApi() as fake:
+            with mock.patch.dict(os.environ, {'SERPAPI_URL': fake.url}):
+                run_nativqa('google', 'text', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None,
+                            os.path.join(tmp_dir, 'default'), 'tests/envs/api_key.env', 1)
+                run_nativqa('google', 'text', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None,
+                            os.path.join(tmp_dir, 'archived'), 'tests/envs/api_key.env', 1, response_archive=True)
+            default_dir = os.path.join(tmp_dir, 'default', 'text', 'test_query', 'iteration_1', 'output')
+            archived_dir = os.path.join(tmp_dir, 'archived', 'text', 'test_query', 'iteration_1', 'output')
+            self.assertFalse(os.path.exists(os.path.join(default_dir, ARCHIVE_FILE)))
+            self.assertFalse(os.path.exists(os.path.join(default_dir, 'original_response.json')))
+            summary = os.path.join(archived_dir, 'summary.jsonl')
+            queries = [result['search_parameters']['q'] for result in iter_summary_data(summary)]
+            self.assertTrue(queries)
+            self.assertEqual(sorted(read_archived_queries(archived_dir)), sorted(queries))
+
+    def test_archive_and_original_response(self):
+        with TemporaryDirectory() as tmp_dir, FakeSerpApi() as fake:
+            with mock.patch.dict(os.environ, {'SERPAPI_URL': fake.url}):
+                run_nativqa('google', 'image', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None, tmp_dir,
+                            'tests/envs/api_key.env', 1, original_response=True, response_archive=True)
+            output_dir = os.path.join(tmp_dir, 'image', 'test_query', 'iteration_1', 'output')
+            with open(os.path.join(output_dir, 'original_response.json'), encoding='utf-8') as f:
+                original = [result['search_parameters']['q'] for result in json.load(f)]
+            self.assertTrue(original)
+            self.assertEqual(sorted(read_archived_queries(output_dir)), sorted(original))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import unittest
+from unittest import mock
+
+from nativqa.backends import EngineRouter, SerpApiBackend, StubBackend, open_backend
+from nativqa.fake_serpapi import FakeSerpApi
+from nativqa.search_client import SearchClient, SearchError
+
+
+class TestBackends(unittest.TestCase):
+    def test_stub_backend(self):
+        backend = StubBackend()
+        with SearchClient(concurrency=4, backend=backend) as client:
+            results = list(client.iter_responses({'engine': 'google'}, [['food', f'query {i}'] for i in range(10)]))
+        self.assertTrue(all(error is None for _, _, error in results))
+        self.assertEqual(results[3][1]['search_parameters']['q'], 'query 3')
+        self.assertEqual(len(backend.requests), 10)
+
+    def test_pooled_backend_reuses_sessions(self):
+        with FakeSerpApi() as fake, SerpApiBackend(fake.url) as backend:
+            with SearchClient(concurrency=2, backend=backend) as client:
+                results = list(client.iter_responses({'engine': 'google', 'api_key': 'test'},
+                                                     [['food', f'query {i}'] for i in range(20)]))
+            self.assertTrue(all(error is None for _, _, error in results))
+            self.assertLessEqual(len(backend._sessions), 2)
+            self.assertEqual(fake.requests, 20)
+
+    def test_http_errors(self):
+        with FakeSerpApi(throttle_rate=1.0, retry_after=3) as fake, SerpApiBackend(fake.url) as backend:
+            with self.assertRaises(SearchError) as raised:
+                backend.search({'engine': 'google', 'q': 'karak tea'})
+        self.assertTrue(raised.exception.throttled)
+        self.assertEqual(raised.exception.retry_after, 3.0)
+
+    def test_routes_engines(self):
+        images = StubBackend(lambda params: {'backend': 'images'})
+        default = StubBackend(lambda params: {'backend': 'default'})
+        router = EngineRouter({'google_images': images}, default)
+        self.assertEqual(router.search({'engine': 'google_images', 'q': 'x'}), {'backend': 'images'})
+        self.assertEqual(router.search({'engine': 'bing', 'q': 'x'}), {'backend': 'default'})
+        with mock.patch.dict(os.environ, {'API_KEY_GOOGLE_IMAGES': 'images-key'}):
+            backend = open_backend(check_quota=False)
+        self.assertIsInstance(backend, EngineRouter)
+        self.assertEqual(list(backend.backends['google_images'].key_pool.keys), ['images-key'])
+        self.assertIsNone(backend.default.key_pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nativqa.batch import read_manifest, run_batch
+from nativqa.search_client import SearchClient
+
+
+def fake_request(self, params):
+    return {'search_parameters': {'engine': params['engine'], 'q': params['q']},
+            'related_questions': [{'question': f"{params['q']} ({params['location']})?", 'snippet': 'answer',
+                                   'link': 'http://x/1'}]}
+
+
+class TestBatch(unittest.TestCase):
+    def write_files(self, tmp_dir, rows):
+        with open(os.path.join(tmp_dir, 'q.csv'), 'w', encoding='utf-8') as f:
+            f.write('topic,query\nfood,a\nfood,b\n')
+        with open(os.path.join(tmp_dir, 'key.env'), 'w', encoding='utf-8') as f:
+            f.write('API_KEY="test"\n')
+        manifest = os.path.join(tmp_dir, 'jobs.csv')
+        with open(manifest, 'w', encoding='utf-8') as f:
+            f.write('input_file,location,country_code,search_type,engine,name\n' + rows)
+        return manifest
+
+    def test_read_manifest(self):
+        with TemporaryDirectory() as tmp_dir:
+            manifest = self.write_files(tmp_dir, 'q.csv,"Doha, Qatar",qa,,,\nq.csv,Amman,jo,image,bing,amman\n')
+            jobs = read_manifest(manifest)
+            self.assertEqual([job['name'] for job in jobs], ['doha_qatar_qa_text', 'amman'])
+            self.assertEqual(jobs[0]['engine'], 'google')
+            self.assertEqual(jobs[1]['gl'], 'jo')
+            self.assertEqual(jobs[1]['input_file'], os.path.join(tmp_dir, 'q.csv'))
+
+    def test_jobs_share_one_worker_pool(self):
+        with TemporaryDirectory() as tmp_dir:
+            manifest = self.write_files(tmp_dir, 'q.csv,Doha,qa,,,\nq.csv,Amman,jo,,,\nq.csv,Cairo,eg,,yahoo_x,\n')
+            result_dir = os.path.join(tmp_dir, 'out')
+            with mock.patch.object(SearchClient, '_request', fake_request):
+                batch_jobs = run_batch(read_manifest(manifest), os.path.relpath(result_dir),
+                                       os.path.join(tmp_dir, 'key.env'), 1, concurrency=2, max_jobs=2)
+            self.assertEqual([batch_job.status for batch_job in batch_jobs], ['done', 'done', 'failed'])
+            self.assertEqual([batch_job.client.responses for batch_job in batch_jobs], [2, 2, 0])
+            self.assertTrue(os.path.exists(os.path.join(result_dir, 'amman_jo_text', 'text', 'q', 'dataset',
+                                                        'q.tsv')))
+
+    def test_jobs_report_their_cache_hits(self):
+        with TemporaryDirectory() as tmp_dir:
+            manifest = self.write_files(tmp_dir, 'q.csv,Doha,qa,,,first\nq.csv,Doha,qa,,,second\n')
+            with mock.patch.object(SearchClient, '_request', fake_request), \
+                    self.assertLogs('nativqa.nativqa_framework', level='INFO') as logs:
+                run_batch(read_manifest(manifest), os.path.join(tmp_dir, 'out'), os.path.join(tmp_dir, 'key.env'), 1,
+                          cache_file=os.path.join(tmp_dir, 'cache.sqlite'), max_jobs=1)
+            cache_lines = [record.getMessage() for record in logs.records if 'response cache' in record.getMessage()]
+            # the second job finds every query in the cache the first job filled
+            self.assertEqual(cache_lines, ['Iteration 1 response cache: 0 hits, 2 misses',
+                                           'Iteration 1 response cache: 2 hits, 0 misses'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.cache import ResponseCache, cache_key
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'cache.sqlite')
+        self.params = {'engine': 'google', 'q': 'doha weather', 'location': 'Doha, Qatar', 'gl': 'qa',
+                       'safe': 'active', 'api_key': 'secret'}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_ignores_api_key_and_whitespace(self):
+        other = dict(self.params, q='  doha   weather ', api_key='other', gl='QA')
+        self.assertEqual(cache_key(self.params), cache_key(other))
+        self.assertNotEqual(cache_key(self.params), cache_key(dict(self.params, location='Cairo, Egypt')))
+
+    def test_hit_and_miss(self):
+        cache = ResponseCache(self.path)
+        self.assertIsNone(cache.get(self.params))
+        cache.put(self.params, {'search_parameters': {'q': 'doha weather'}})
+        self.assertEqual(cache.get(self.params)['search_parameters']['q'], 'doha weather')
+        self.assertEqual(cache.reset_stats(), (1, 1))
+        cache.close()
+
+    def test_expired_entries_are_misses(self):
+        cache = ResponseCache(self.path, ttl=-1)
+        cache.put(self.params, {'q': 'doha weather'})
+        self.assertIsNone(cache.get(self.params))
+        self.assertEqual(len(cache), 0)
+        cache.close()
+
+    def test_size_eviction(self):
+        cache = ResponseCache(self.path, max_size=2048)
+        for i in range(50):
+            cache.put(dict(self.params, q=f'query {i}'), {'payload': os.urandom(64).hex()})
+        self.assertLess(len(cache), 50)
+        self.assertIsNotNone(cache.get(dict(self.params, q='query 49')))
+        cache.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
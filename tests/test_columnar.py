@@ -0,0 +1,48 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from nativqa.columnar import ColumnarWriter, MEDIA_COLUMNS
+from nativqa.consolidate import QA_HEADER, consolidate_qa
+from nativqa.utils import write_csv_file
+
+
+@unittest.skipIf(pa is None, 'pyarrow is not installed')
+class TestColumnar(unittest.TestCase):
+    def test_writes_row_groups(self):
+        with TemporaryDirectory() as tmp_dir:
+            filepath = os.path.join(tmp_dir, 'image_results.parquet')
+            with ColumnarWriter(filepath, MEDIA_COLUMNS['image'], row_group_size=2) as writer:
+                for i in range(5):
+                    writer.write({'data_id': str(i), 'position': i + 1, 'original': f'http://img/{i}',
+                                  'original_width': 'unknown'})
+            parquet_file = pq.ParquetFile(filepath)
+            self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+            table = parquet_file.read(columns=['data_id', 'position', 'original_width'])
+            self.assertEqual(table.column('position').to_pylist(), [1, 2, 3, 4, 5])
+            self.assertEqual(table.column('original_width').to_pylist(), [None] * 5)
+
+    def test_consolidate_qa_to_arrow(self):
+        rows = [['1', 'food', 'q1', 'What is machboos?', 'A rice dish.', 'related_questions', 'http://a'],
+                ['2', 'food', 'q2', 'What is machboos?', 'A rice dish.', 'related_questions', 'http://b']]
+        with TemporaryDirectory() as tmp_dir:
+            iteration_dir = os.path.join(tmp_dir, 'iteration_1', 'output')
+            os.makedirs(iteration_dir)
+            write_csv_file(os.path.join(iteration_dir, 'all_related_question_answers.tsv'), [QA_HEADER] + rows)
+            dataset_file = os.path.join(tmp_dir, 'dataset.arrow')
+            duplicate_file = os.path.join(tmp_dir, 'dataset.duplicate_qa.arrow')
+            self.assertEqual(consolidate_qa(tmp_dir, dataset_file, duplicate_file, output_format='arrow'), (1, 1))
+            with pa.memory_map(dataset_file) as source:
+                table = pa.ipc.open_file(source).read_all()
+            self.assertEqual(table.column_names, QA_HEADER)
+            self.assertEqual([list(row.values()) for row in table.to_pylist()], rows[:1])
+
+
+if __name__ == '__main__':
+    unittest.main()
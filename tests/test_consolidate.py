@@ -0,0 +1,34 @@
+import csv
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.consolidate import QA_HEADER, consolidate_qa
+from nativqa.utils import write_csv_file
+
+
+class TestConsolidate(unittest.TestCase):
+    def test_consolidate_qa(self):
+        rows = [
+            ['1', 'food', 'q1', 'What is machboos?', 'A rice dish.', 'related_questions', 'http://a'],
+            ['2', 'food', 'q2', 'What  is machboos?', 'A rice dish. ', 'related_questions', 'http://b'],
+            ['', 'food', 'q3', 'Not Available', 'NA', 'NA', 'NA'],
+            ['3', 'food', 'q2', 'What is machboos?', 'A spiced rice dish.', 'related_questions', 'http://c'],
+        ]
+        with TemporaryDirectory() as tmp_dir:
+            for i, chunk in enumerate([rows[:2], rows[2:]]):
+                iteration_dir = os.path.join(tmp_dir, f'iteration_{i + 1}', 'output')
+                os.makedirs(iteration_dir)
+                write_csv_file(os.path.join(iteration_dir, 'all_related_question_answers.tsv'), [QA_HEADER] + chunk)
+            dataset_file = os.path.join(tmp_dir, 'dataset.tsv')
+            duplicate_file = os.path.join(tmp_dir, 'dataset.duplicate_qa.tsv')
+            for spill in (False, True):
+                counts = consolidate_qa(tmp_dir, dataset_file, duplicate_file, spill=spill)
+                self.assertEqual(counts, (2, 2))
+                with open(dataset_file, encoding='utf-8') as f:
+                    unique = list(csv.reader(f, delimiter='\t'))
+                self.assertEqual(unique, [QA_HEADER, rows[0], rows[3]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.fake_serpapi import FakeSerpApi, ResponseStore
+from nativqa.search_client import SearchClient, SearchError
+
+
+PARAMS = {'engine': 'google', 'location': 'Doha, Qatar', 'gl': 'qa', 'api_key': 'test'}
+
+
+class TestFakeSerpApi(unittest.TestCase):
+    def test_replays_recorded_responses(self):
+        recorded = {'search_parameters': {'engine': 'google', 'q': 'machboos recipe'},
+                    'related_questions': [{'question': 'How do you make machboos?', 'snippet': 'Rice.'}]}
+        with TemporaryDirectory() as tmp_dir:
+            summary = os.path.join(tmp_dir, 'summary.jsonl')
+            with open(summary, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(recorded) + '\n')
+            store = ResponseStore([tmp_dir], generate=False)
+        with FakeSerpApi(store) as fake, SearchClient(base_url=fake.url) as client:
+            self.assertEqual(client.fetch(dict(PARAMS, q='machboos  recipe')), recorded)
+            self.assertIn('error', client.fetch(dict(PARAMS, q='karak tea')))
+
+    def test_generated_responses_are_stable(self):
+        with FakeSerpApi() as fake, SearchClient(base_url=fake.url) as client:
+            first = client.fetch(dict(PARAMS, q='karak tea'))
+            self.assertEqual(client.fetch(dict(PARAMS, q='karak tea')), first)
+            self.assertTrue(first['related_questions'])
+            images = client.fetch(dict(PARAMS, engine='google_images', q='karak tea'))
+            self.assertTrue(images['images_results'])
+
+    def test_errors_and_throttling(self):
+        with FakeSerpApi(throttle_rate=1.0, retry_after=0) as fake:
+            with SearchClient(max_retries=2, base_delay=0.0, base_url=fake.url) as client:
+                with self.assertRaises(SearchError) as raised:
+                    client.fetch(dict(PARAMS, q='karak tea'))
+            self.assertEqual(raised.exception.status_code, 429)
+            self.assertEqual(client.retries, 2)
+            self.assertEqual(fake.throttled, 3)
+        with FakeSerpApi(error_rate=1.0) as fake:
+            with SearchClient(max_retries=0, base_url=fake.url) as client:
+                with self.assertRaises(SearchError) as raised:
+                    client.fetch(dict(PARAMS, q='karak tea'))
+            self.assertEqual(raised.exception.status_code, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
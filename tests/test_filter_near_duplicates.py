@@ -0,0 +1,197 @@
+import importlib.util
+import json
+import os
+import unittest
+from collections import deque
+from tempfile import TemporaryDirectory
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts',
+                      'filter_near_duplicates_flann.py')
+
+try:
+    import numpy as np
+    spec = importlib.util.spec_from_file_location('filter_near_duplicates_flann', SCRIPT)
+    fnd = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fnd)
+except ImportError:
+    np = fnd = None
+
+
+def bfs_groups(n_points, edges):
+    adjacency = [[] for _ in range(n_points)]
+    for i, j in edges:
+        adjacency[i].append(j)
+        adjacency[j].append(i)
+    groups = {}
+    seen = [False] * n_points
+    for start in range(n_points):
+        if seen[start]:
+            continue
+        seen[start] = True
+        group, queue = [], deque([start])
+        while queue:
+            i = queue.popleft()
+            group.append(i)
+            for j in adjacency[i]:
+                if not seen[j]:
+                    seen[j] = True
+                    queue.append(j)
+        groups[start] = sorted(group)
+    return sorted(groups), groups
+
+
+def neighbor_lists(n_points, edges):
+    nbr_indices = [[] for _ in range(n_points)]
+    for i, j in edges:
+        nbr_indices[i].append(j)
+    return nbr_indices
+
+
+@unittest.skipIf(fnd is None, 'numpy, torch or torchvision is not installed')
+class TestGroupDuplicates(unittest.TestCase):
+    def test_matches_bfs_and_ignores_edge_order(self):
+        rng = np.random.default_rng(0)
+        for n_points, n_edges in ((1, 0), (10, 0), (30, 12), (60, 40), (200, 150)):
+            edges = [(int(i), int(j)) for i, j in rng.integers(0, n_points, (n_edges, 2))]
+            expected = bfs_groups(n_points, edges)
+            self.assertEqual(fnd.group_duplicates(n_points, neighbor_lists(n_points, edges)), expected)
+            for _ in range(3):
+                shuffled = [edges[i] if rng.random() < 0.5 else edges[i][::-1]
+                            for i in rng.permutation(n_edges)]
+                self.assertEqual(fnd.group_duplicates(n_points, neighbor_lists(n_points, shuffled)), expected)
+
+    def test_chain_is_one_group(self):
+        # a path whose labels have to propagate through every point
+        n_points = 64
+        rows = np.arange(n_points - 1)[::-1]
+        labels = fnd.connected_components(n_points, rows, rows + 1)
+        self.assertTrue((labels == 0).all())
+
+
+@unittest.skipIf(fnd is None, 'numpy, torch or torchvision is not installed')
+class TestIndexes(unittest.TestCase):
+    def test_exact_index_matches_brute_force(self):
+        rng = np.random.default_rng(1)
+        features = rng.standard_normal((300, 16)).astype(np.float16)
+        queries = features[:70].astype(np.float32)
+        brute = np.square(queries[:, None, :] - features.astype(np.float32)[None, :, :]).sum(axis=2)
+        expected_d = np.sort(brute, axis=1)[:, :10]
+        for threads in (0, 1):
+            # blocks smaller than k and than the features exercise the running top-k merge
+            index = fnd.ExactIndex(threads=threads, block_size=7)
+            index.build(features)
+            indices, dists = index.search(queries, 10)
+            np.testing.assert_allclose(dists, expected_d, rtol=1e-4, atol=1e-3)
+            np.testing.assert_allclose(np.take_along_axis(brute, indices, axis=1), expected_d, rtol=1e-4, atol=1e-3)
+            self.assertTrue((indices[:, 0] == np.arange(70)).all())
+
+    def test_backends_find_planted_duplicates(self):
+        rng = np.random.default_rng(2)
+        originals = rng.standard_normal((400, 32)).astype(np.float32)
+        copies = originals[:50] + 0.01 * rng.standard_normal((50, 32)).astype(np.float32)
+        features = np.vstack([originals, copies]).astype(np.float16)
+        for name, index_class in fnd.INDEXES.items():
+            index = index_class()
+            try:
+                index.build(features)
+            except ImportError:
+                continue
+            with self.subTest(index=name):
+                indices, dists = index.search(features[:50], 2)
+                self.assertEqual(sorted(indices[:, 1].tolist()), list(range(400, 450)))
+                self.assertTrue((dists[:, 0] <= dists[:, 1]).all())
+
+
+@unittest.skipIf(fnd is None, 'numpy, torch or torchvision is not installed')
+class TestPerceptualHashes(unittest.TestCase):
+    def test_hamming_pairs_matches_brute_force(self):
+        rng = np.random.default_rng(3)
+        for max_distance in (0, 2, 4, 7):
+            # clusters of hashes a few bit flips apart, exact copies and unrelated hashes
+            centers = rng.integers(0, 2 ** 63, (12, 2), dtype=np.uint64)
+            keys = centers[rng.integers(0, 12, 150)]
+            flips = rng.integers(0, 64, (150, 2, 3)).astype(np.uint64)
+            for f in range(3):
+                keys ^= np.where(rng.random((150, 2)) < 0.5, np.uint64(1) << flips[:, :, f], np.uint64(0))
+            keys = np.vstack([keys, keys[:10], rng.integers(0, 2 ** 63, (50, 2), dtype=np.uint64)])
+            phashes, dhashes = keys[:, 0].copy(), keys[:, 1].copy()
+            expected = {(i, j) for i in range(len(keys)) for j in range(i + 1, len(keys))
+                        if bin(int(phashes[i] ^ phashes[j])).count('1') <= max_distance
+                        and bin(int(dhashes[i] ^ dhashes[j])).count('1') <= max_distance}
+            # a small max_block splits the bucket comparisons into chunks
+            rows, cols = fnd.hamming_pairs(phashes, dhashes, max_distance, max_block=64)
+            found = {(min(i, j), max(i, j)) for i, j in zip(rows.tolist(), cols.tolist())}
+            self.assertEqual(found, expected, f'max_distance={max_distance}')
+
+    def test_prefilter_groups_are_utf8(self):
+        image_objects = [{'image_path': f'صور/{i}.jpg'} for i in range(3)]
+        with TemporaryDirectory() as tmp_dir:
+            fnd.write_prefilter_groups(os.path.join(tmp_dir, 'filtered.jsonl'), {0: [0, 2]}, image_objects)
+            with open(os.path.join(tmp_dir, 'filtered_hash_duplicates.jsonl'), encoding='utf-8') as f:
+                self.assertEqual([json.loads(line) for line in f], [{'صور/0.jpg': ['صور/2.jpg']}])
+
+    def test_prefilter_without_worker_processes(self):
+        from PIL import Image
+
+        rng = np.random.default_rng(5)
+        with TemporaryDirectory() as tmp_dir:
+            paths = [os.path.join(tmp_dir, name) for name in ('0.png', '1.png', '2.png', 'copy.png', 'missing.png')]
+            for path in paths[:3]:
+                Image.fromarray(rng.integers(0, 256, (48, 48, 3), dtype=np.uint8)).save(path)
+            # a byte-identical copy of the first image and a file that does not exist
+            with open(paths[0], 'rb') as f:
+                data = f.read()
+            with open(paths[3], 'wb') as f:
+                f.write(data)
+            image_objects = [{'image_path': path} for path in paths]
+            # num_workers=0 is the CPU-only path of --num_workers, hashing runs in this process
+            representatives, content_hashes, groups = fnd.perceptual_prefilter(image_objects, num_workers=0)
+        self.assertEqual(representatives, image_objects[:3])
+        self.assertEqual(content_hashes[0], fnd.hashlib.sha256(data).hexdigest())
+        self.assertEqual(groups, {0: [0, 3]})
+
+
+@unittest.skipIf(fnd is None, 'numpy, torch or torchvision is not installed')
+class TestEmbeddingStore(unittest.TestCase):
+    def test_interrupted_append_is_cut_off(self):
+        rng = np.random.default_rng(4)
+        features = rng.standard_normal((5, 8)).astype(np.float16)
+        hashes = [f'{i:064x}' for i in range(5)]
+        with TemporaryDirectory() as tmp_dir:
+            store = fnd.EmbeddingStore(tmp_dir, 8)
+            store.append(hashes[:3], features[:3])
+            store.close()
+            # a crash after the embeddings of the next batch and half of its id line
+            with open(store.embeddings_file, 'ab') as f:
+                f.write(features[3:].tobytes() + b'\0\0\0')
+            with open(store.ids_file, 'a', encoding='ascii') as f:
+                f.write(hashes[3][:20])
+
+            store = fnd.EmbeddingStore(tmp_dir, 8)
+            self.assertEqual(len(store), 3)
+            np.testing.assert_array_equal(store.matrix(), features[:3])
+            store.append(hashes[3:], features[3:])
+            store.close()
+
+            store = fnd.EmbeddingStore(tmp_dir, 8)
+            self.assertEqual(list(store.index), hashes)
+            np.testing.assert_array_equal(store.take(hashes[::-1]), features[::-1])
+            store.close()
+
+    def test_rejects_features_of_another_width(self):
+        with TemporaryDirectory() as tmp_dir:
+            store = fnd.EmbeddingStore(tmp_dir, 16)
+            with self.assertRaises(ValueError):
+                store.append(['0' * 64], np.zeros((1, 8), dtype=np.float32))
+            self.assertEqual(os.path.getsize(store.embeddings_file), 0)
+            store.close()
+            # nothing was stored, so the store can be reopened with the right width
+            store = fnd.EmbeddingStore(tmp_dir, 8)
+            store.append(['0' * 64], np.ones((1, 8), dtype=np.float32))
+            store.close()
+            with self.assertRaises(ValueError):
+                fnd.EmbeddingStore(tmp_dir, 16)
+
+
+if __name__ == '__main__':
+    unittest.main()
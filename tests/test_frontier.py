@@ -0,0 +1,28 @@
+import unittest
+
+from nativqa.frontier import QueryFrontier
+
+
+class TestQueryFrontier(unittest.TestCase):
+    def test_dedup_and_completed(self):
+        frontier = QueryFrontier(completed={'What is Doha?'})
+        self.assertTrue(frontier.add('travel', 'Best time to visit Doha', parent='doha'))
+        self.assertFalse(frontier.add('travel', 'Best  time to visit Doha ', parent='qatar'))
+        self.assertFalse(frontier.add('travel', 'What is Doha?', parent='doha'))
+        self.assertFalse(frontier.add('travel', 'Not Available', parent='doha'))
+        self.assertEqual(frontier.select(), [['travel', 'Best time to visit Doha']])
+
+    def test_priority_and_limits(self):
+        frontier = QueryFrontier(max_size=3, category_quota=2)
+        frontier.add('food', 'machboos', parent='a')
+        frontier.add('food', 'karak', parent='a')
+        frontier.add('food', 'karak', parent='b')
+        frontier.add('food', 'karak', parent='b')
+        frontier.add('food', 'luqaimat', parent='c')
+        frontier.add('travel', 'corniche', parent='a')
+        frontier.add('travel', 'souq waqif', parent='a')
+        self.assertEqual(frontier.select(), [['food', 'karak'], ['food', 'machboos'], ['travel', 'corniche']])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.journal import QueryJournal, DONE, FAILED
+from nativqa.utils import open_jsonl_append
+
+
+class TestQueryJournal(unittest.TestCase):
+    def test_resume_drops_uncommitted_responses(self):
+        data = [['food', f'query {i}'] for i in range(5)]
+        with TemporaryDirectory() as tmp_dir:
+            journal_file = os.path.join(tmp_dir, 'journal.jsonl')
+            summary = os.path.join(tmp_dir, 'summary.jsonl')
+
+            journal = QueryJournal(journal_file, sync_every=1000, sync_interval=1000)
+            summary_writer = open_jsonl_append(summary)
+            journal.bind_summary(summary_writer)
+            journal.add_pending(data)
+            for example in journal.track(data[:3]):
+                summary_writer.write(json.dumps({'q': example[1]}) + '\n')
+                journal.done(example)
+            journal.commit()
+            # written but never checkpointed, as if the process was killed here
+            for example in journal.track(data[3:4]):
+                summary_writer.write(json.dumps({'q': example[1]}) + '\n')
+                journal.done(example)
+            journal.failed(data[4], 'HTTP 401')
+            summary_writer.close()
+
+            journal = QueryJournal(journal_file)
+            summary_writer = open_jsonl_append(summary, journal.summary_offset)
+            summary_writer.close()
+            with open(summary, encoding='utf-8') as f:
+                self.assertEqual(len(f.readlines()), 3)
+            self.assertEqual(journal.state('query 2'), DONE)
+            self.assertEqual(journal.attempts('query 2'), 1)
+            self.assertEqual(journal.outstanding(data), data[3:])
+            journal.failed(data[4], 'HTTP 401')
+            journal.close()
+            self.assertEqual(QueryJournal(journal_file).state(' query  4'), FAILED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from collections import Counter
+
+from nativqa.backends import SerpApiBackend
+from nativqa.fake_serpapi import FakeSerpApi
+from nativqa.key_pool import KeyPool
+from nativqa.search_client import SearchClient
+
+
+class TestKeyPool(unittest.TestCase):
+    def test_weighted_round_robin(self):
+        pool = KeyPool.from_spec('key-a:3, key-b, key-c:2')
+        picks = [pool.acquire() for _ in range(60)]
+        self.assertEqual(Counter(picks), {'key-a': 30, 'key-b': 10, 'key-c': 20})
+        # smooth: the heaviest key is never picked more than its share in a row
+        self.assertNotIn(['key-a'] * 4, [picks[i:i + 4] for i in range(len(picks) - 3)])
+
+    def test_retires_keys_without_quota(self):
+        pool = KeyPool.from_spec('key-a::2,key-b')
+        picks = [pool.acquire() for _ in range(6)]
+        self.assertEqual(picks.count('key-a'), 2)
+        self.assertEqual(pool.stats()['...ey-a']['retired'], 'quota used up')
+        pool.retire('key-b', 'invalid key')
+        self.assertIsNone(pool.acquire())
+
+    def test_rotates_to_next_key_when_exhausted(self):
+        pool = KeyPool.from_spec('key-a,key-b')
+        data = [['food', f'query {i}'] for i in range(8)]
+        with FakeSerpApi(quota=3) as fake, SerpApiBackend(fake.url, pool) as backend:
+            backend.refresh_quota()
+            self.assertEqual([api_key.remaining for api_key in pool.keys.values()], [3, 3])
+            with SearchClient(backend=backend, max_retries=0) as client:
+                results = list(client.iter_responses({'engine': 'google'}, data))
+        self.assertEqual([error is None for _, _, error in results], [True] * 6 + [False] * 2)
+        self.assertEqual(fake.searches, {'key-a': 3, 'key-b': 3})
+        self.assertEqual(pool.active, [])
+
+    def test_retires_key_on_out_of_searches(self):
+        pool = KeyPool.from_spec('key-a:3,key-b')
+        with FakeSerpApi(quota=2) as fake, SerpApiBackend(fake.url, pool) as backend:
+            # quota not read from the account API: the 429 "out of searches" retires the key
+            for i in range(4):
+                backend.search({'engine': 'google', 'q': f'query {i}'})
+        self.assertEqual(fake.searches, {'key-a': 2, 'key-b': 2})
+        self.assertEqual(pool.stats()['...ey-a']['errors'], 1)
+        self.assertIn('run out of searches', pool.stats()['...ey-a']['retired'])
+
+
+if __name__ == '__main__':
+    unittest.main()
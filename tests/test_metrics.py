@@ -0,0 +1,111 @@
+import json
+import os
+import unittest
+import urllib.request
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from nativqa.backends import StubBackend
+from nativqa.fake_serpapi import FakeSerpApi
+from nativqa.metrics import Metrics, metrics_delta, serve_metrics
+from nativqa.nativqa_framework import run_nativqa
+from nativqa.rate_limit import TokenBucket
+from nativqa.search_client import SearchClient, SearchError
+
+
+class TestMetrics(unittest.TestCase):
+    def test_stages_counters_and_delta(self):
+        metrics = Metrics()
+        with metrics.stage('fetch'):
+            metrics.incr('responses', 3)
+        before = metrics.snapshot()
+        with metrics.stage('fetch'):
+            metrics.incr('responses', 2)
+        metrics.observe_latency(0.07)
+        metrics.observe_latency(42)
+        delta = metrics_delta(metrics.snapshot(), before)
+        self.assertEqual(delta['counters']['responses'], 2)
+        self.assertEqual(delta['stages']['fetch']['count'], 1)
+        latency = delta['request_latency_seconds']
+        self.assertEqual(latency['count'], 2)
+        self.assertEqual(latency['buckets']['0.05'], 0)
+        self.assertEqual(latency['buckets']['0.1'], 1)
+        self.assertEqual(latency['buckets']['+Inf'], 2)
+
+    def test_search_client_metrics(self):
+        calls = []
+
+        def handler(params):
+            calls.append(params['q'])
+            if len(calls) == 1:
+                raise SearchError('throttled', 429)
+            return {'search_parameters': {'q': params['q']}}
+
+        metrics = Metrics()
+        client = SearchClient(rate_limiter=TokenBucket(1000, 10), base_delay=0.01, max_delay=0.02,
+                              backend=StubBackend(handler), metrics=metrics)
+        client.fetch({'q': 'doha'})
+        counters = metrics.snapshot()['counters']
+        self.assertEqual((counters['requests'], counters['throttled'], counters['retries'], counters['responses']),
+                         (2, 1, 1, 1))
+        self.assertEqual(metrics.snapshot()['request_latency_seconds']['count'], 2)
+
+    def test_prometheus_endpoint(self):
+        metrics = Metrics()
+        metrics.incr('responses', 5)
+        with metrics.stage('consolidate'):
+            pass
+        server = serve_metrics(metrics, 0, host='127.0.0.1')
+        try:
+            url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+            with urllib.request.urlopen(url) as response:
+                body = response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertIn('nativqa_responses_total 5', body)
+        self.assertIn('nativqa_stage_runs_total{stage="consolidate"} 1', body)
+        self.assertIn('nativqa_request_latency_seconds_bucket{le="+Inf"} 0', body)
+
+    def test_run_writes_metrics_files(self):
+        with TemporaryDirectory() as tmp_dir, FakeSerpApi() as fake:
+            with mock.patch.dict(os.environ, {'SERPAPI_URL': fake.url}):
+                run_nativqa('google', 'text', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None, tmp_dir,
+                            'tests/envs/api_key.env', 2)
+            run_dir = os.path.join(tmp_dir, 'text', 'test_query')
+            with open(os.path.join(run_dir, 'iteration_1', 'output', 'metrics.json')) as f:
+                first = json.load(f)
+            with open(os.path.join(run_dir, 'iteration_2', 'output', 'metrics.json')) as f:
+                second = json.load(f)
+            with open(os.path.join(run_dir, 'metrics.json')) as f:
+                run = json.load(f)
+        self.assertEqual(first['counters']['responses'], first['counters']['queries'])
+        self.assertIn('expand', first['stages'])
+        self.assertGreater(first['counters']['bytes_written'], 0)
+        self.assertEqual(run['counters']['responses'],
+                         first['counters']['responses'] + second['counters'].get('responses', 0))
+        self.assertEqual(run['stages']['consolidate']['count'], 1)
+        self.assertEqual(run['request_latency_seconds']['count'], fake.requests)
+
+    def test_resumed_run_keeps_iteration_metrics(self):
+        with TemporaryDirectory() as tmp_dir, FakeSerpApi() as fake:
+            metrics_file = os.path.join(tmp_dir, 'text', 'test_query', 'iteration_1', 'output', 'metrics.json')
+            with mock.patch.dict(os.environ, {'SERPAPI_URL': fake.url}):
+                run_nativqa('google', 'text', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None, tmp_dir,
+                            'tests/envs/api_key.env', 1)
+                with open(metrics_file) as f:
+                    first = json.load(f)
+                # every query of the iteration is journaled, the second run fetches nothing
+                run_nativqa('google', 'text', 'tests/data/test_query.csv', 'qa', 'Doha, Qatar', None, tmp_dir,
+                            'tests/envs/api_key.env', 1)
+            with open(metrics_file) as f:
+                resumed = json.load(f)
+        self.assertGreater(first['counters']['responses'], 0)
+        self.assertEqual(resumed['counters']['responses'], first['counters']['responses'])
+        self.assertEqual(resumed['request_latency_seconds'], first['request_latency_seconds'])
+        self.assertEqual(resumed['stages']['read_queries']['count'], 2)
+        self.assertEqual(resumed['queries_per_second'], first['queries_per_second'])
+
+
+if __name__ == '__main__':
+    unittest.main()
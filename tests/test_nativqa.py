@@ -1,7 +1,10 @@
+import os
 import unittest
 import sys
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from unittest import mock
+from nativqa.fake_serpapi import FakeSerpApi
 from nativqa.nativqa_framework import run_nativqa
 
 
@@ -14,10 +17,15 @@ class TestNativQA(unittest.TestCase):
         result_path = Path(cls.result_path) / cls.input_file
         result_path.parent.mkdir(parents=True, exist_ok=True)
         result_path.touch(exist_ok=True)
+        # offline stand-in for SerpAPI
+        cls.fake_serpapi = FakeSerpApi()
+        cls.fake_serpapi.start()
 
     def test_scrape(self):
         try:
             args = {
+                "engine": 'google',
+                "search_type": 'text',
                 "input_file": self.input_file,
                 "location": 'Doha, Qatar',
                 "gl": 'qa',
@@ -26,12 +34,17 @@ class TestNativQA(unittest.TestCase):
                 "env": 'tests/envs/api_key.env',
                 "n_iter": 3
             }
-            run_nativqa(**args)
+            with mock.patch.dict(os.environ, {'SERPAPI_URL': self.fake_serpapi.url}):
+                run_nativqa(**args)
         except Exception as e:
             self.fail(f"scrape execution failed with error: {e}")
+        run_dir = os.path.join(self.result_path, 'text', 'test_query')
+        self.assertTrue(os.path.exists(os.path.join(run_dir, 'iteration_3', 'output', 'summary.jsonl')))
+        self.assertTrue(os.path.exists(os.path.join(run_dir, 'dataset', 'test_query.tsv')))
 
     @classmethod
     def tearDownClass(cls):
+        cls.fake_serpapi.stop()
         cls.result_dir.cleanup()
 
 
@@ -0,0 +1,49 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.nativqa_framework import run_pipeline
+from nativqa.search_client import SearchClient
+
+
+class FakeSearchClient(SearchClient):
+    def _request(self, params):
+        q = params['q']
+        return {'search_parameters': {'engine': params['engine'], 'q': q},
+                'related_questions': [{'question': f'{q} q{i}?', 'snippet': 'answer', 'link': f'http://x/{i}'}
+                                      for i in range(2)],
+                'related_searches': [{'query': f'{q} rs', 'link': 'http://x/rs'}]}
+
+
+class TestPipeline(unittest.TestCase):
+    def run_pipeline(self, tmp_dir, **kwargs):
+        os.makedirs(os.path.join(tmp_dir, 'iteration_1'))
+        with open(os.path.join(tmp_dir, 'iteration_1', 'q.csv'), 'w', encoding='utf-8') as f:
+            f.write('topic,query\nfood,a\nfood,b\n')
+        with FakeSearchClient(concurrency=4) as client:
+            return run_pipeline('text', 'google', 'q.csv', 'Doha', 'qa', tmp_dir, 3, client=client, **kwargs)
+
+    def summary_queries(self, output_dir):
+        with open(os.path.join(output_dir, 'summary.jsonl'), encoding='utf-8') as f:
+            return sorted(json.loads(line)['search_parameters']['q'] for line in f)
+
+    def test_fetches_all_iterations(self):
+        with TemporaryDirectory() as tmp_dir:
+            output_dirs = self.run_pipeline(tmp_dir)
+            self.assertEqual(len(output_dirs), 3)
+            self.assertEqual(self.summary_queries(output_dirs[0]), ['a', 'b'])
+            self.assertEqual(len(self.summary_queries(output_dirs[1])), 6)
+            self.assertEqual(len(self.summary_queries(output_dirs[2])), 18)
+            with open(os.path.join(tmp_dir, 'iteration_2', 'q.csv'), encoding='utf-8') as f:
+                self.assertEqual(len(f.read().splitlines()), 7)
+
+    def test_frontier_limit(self):
+        with TemporaryDirectory() as tmp_dir:
+            output_dirs = self.run_pipeline(tmp_dir, max_frontier=4)
+            self.assertEqual(len(self.summary_queries(output_dirs[1])), 4)
+            self.assertEqual(len(self.summary_queries(output_dirs[2])), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
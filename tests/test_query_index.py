@@ -0,0 +1,32 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.query_index import CompletedQueryIndex
+
+
+class TestCompletedQueryIndex(unittest.TestCase):
+    def test_incremental_export(self):
+        with TemporaryDirectory() as tmp_dir:
+            index_file = os.path.join(tmp_dir, 'completed_queries.sqlite')
+            txt_file = os.path.join(tmp_dir, 'completed_queries.txt')
+            index = CompletedQueryIndex(index_file)
+            self.assertTrue(index.add('What is Doha?'))
+            self.assertFalse(index.add(' What  is Doha? '))
+            self.assertEqual(index.add_many(['Best time to visit Doha', 'What is Doha?', '']), 1)
+            self.assertIn('What is Doha?', index)
+            self.assertEqual(index.export_new(txt_file), 2)
+            index.close()
+
+            index = CompletedQueryIndex(index_file)
+            self.assertEqual(len(index), 2)
+            index.add('Where is Souq Waqif?')
+            self.assertEqual(index.export_new(txt_file), 1)
+            index.close()
+            with open(txt_file, encoding='utf-8') as f:
+                self.assertEqual(f.read().splitlines(),
+                                 ['What is Doha?', 'Best time to visit Doha', 'Where is Souq Waqif?'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import hashlib
+import unittest
+from urllib.parse import urlparse, parse_qs
+
+from nativqa.records import (get_id_hash, link_query, normalize_response, iter_records, ResponseRecord, QARecord,
+                             SearchRecord, MediaRecord)
+
+
+class TestRecords(unittest.TestCase):
+    def test_md5_ids_are_unchanged(self):
+        self.assertEqual(get_id_hash('md5')('doha weather'), hashlib.md5('doha weather'.encode()).hexdigest())
+        self.assertEqual(len(get_id_hash('blake2b')('doha weather')), 32)
+        with self.assertRaises(ValueError):
+            get_id_hash('sha1')
+
+    def test_link_query_matches_parse_qs(self):
+        for link in ['https://www.google.com/search?q=doha+weather&tbm=isch',
+                     'https://www.google.com/search?tbm=isch&q=%D8%A7%D9%84%D8%AF%D9%88%D8%AD%D8%A9&q=x',
+                     'https://www.google.com/search?safe=active&q=caf%C3%A9%26bar#frag']:
+            self.assertEqual(link_query(link), parse_qs(urlparse(link).query)['q'][0])
+        with self.assertRaises(KeyError):
+            link_query('https://www.google.com/search?tbm=isch')
+
+    def test_text_records(self):
+        response = {'search_parameters': {'q': 'doha'},
+                    'related_questions': [{'question': 'Where is Doha?', 'snippet': 'Qatar', 'link': 'http://a'},
+                                          {'question': 'No link?', 'snippet': 'x'}],
+                    'questions_and_answers': [{'question': 'Is Doha hot?', 'answer': 'Yes'}],
+                    'related_searches': [{'query': 'doha map'}, {'link': 'http://b'}]}
+        response = normalize_response(response, 'text', 'city')
+        records = list(iter_records(response, 'text'))
+        self.assertIsInstance(records[0], ResponseRecord)
+        self.assertEqual([record.query for record in records if isinstance(record, SearchRecord)], ['doha map'])
+        qa = [record for record in records if isinstance(record, QARecord)]
+        self.assertEqual([(record.question, record.answer, record.question_type) for record in qa],
+                         [('Where is Doha?', 'Qatar', 'related_questions'),
+                          ('Is Doha hot?', 'Yes', 'questions_and_answers')])
+        self.assertEqual(qa[0].data_id, hashlib.md5('doha Where is Doha?'.encode()).hexdigest())
+
+    def test_image_records(self):
+        response = {'search_parameters': {'q': 'doha'},
+                    'images_results': [{'original': 'http://img/1'}],
+                    'suggested_searches': [{'link': 'https://www.google.com/search?q=doha+skyline'}]}
+        records = list(iter_records(normalize_response(response, 'image', 'city', get_id_hash('blake2b')), 'image'))
+        search, media = records[1], records[2]
+        self.assertEqual((search.kind, search.query, search.entry['input_query']),
+                         ('suggested_searches', 'doha skyline', 'doha'))
+        self.assertIsInstance(media, MediaRecord)
+        self.assertEqual(media.data_id, hashlib.blake2b(b'http://img/1', digest_size=16).hexdigest())
+        self.assertEqual(media.entry['category'], 'city')
+
+
+if __name__ == '__main__':
+    unittest.main()
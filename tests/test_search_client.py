@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from nativqa.rate_limit import TokenBucket, backoff_delay
+from nativqa.search_client import SearchClient, SearchError
+
+
+class FlakyClient(SearchClient):
+    def __init__(self, failures, status_code=429, **kwargs):
+        super().__init__(base_delay=0.01, max_delay=0.02, **kwargs)
+        self.failures = failures
+        self.status_code = status_code
+        self.calls = 0
+
+    def _request(self, search_params):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise SearchError('throttled', self.status_code)
+        return {'search_parameters': {'q': search_params['q']}}
+
+
+class TestSearchClient(unittest.TestCase):
+    def test_retries_throttled_requests(self):
+        client = FlakyClient(failures=2, rate_limiter=TokenBucket(1000, 10), max_retries=3)
+        response = client.fetch({'q': 'doha'})
+        self.assertEqual(response['search_parameters']['q'], 'doha')
+        self.assertEqual(client.calls, 3)
+        self.assertEqual(client.retries, 2)
+
+    def test_gives_up_after_max_retries(self):
+        client = FlakyClient(failures=5, max_retries=2)
+        with self.assertRaises(SearchError):
+            client.fetch({'q': 'doha'})
+        self.assertEqual(client.calls, 3)
+
+    def test_does_not_retry_client_errors(self):
+        client = FlakyClient(failures=1, status_code=401, max_retries=3)
+        with self.assertRaises(SearchError):
+            client.fetch({'q': 'doha'})
+        self.assertEqual(client.calls, 1)
+
+    def test_responses_keep_input_order(self):
+        data = [['topic', f'query {i}'] for i in range(20)]
+        with FlakyClient(failures=0, concurrency=4) as client:
+            results = list(client.iter_responses({}, data))
+        self.assertEqual([example for example, _, _ in results], data)
+        self.assertTrue(all(error is None for _, _, error in results))
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_token_bucket_limits_rate(self):
+        bucket = TokenBucket(rate=50, burst=1)
+        start = time.monotonic()
+        for _ in range(6):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_backoff_delay_is_bounded(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt, 1.0, 8.0), 8.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import json
+import subprocess
+import sys
+import unittest
+
+# imported on first use only, each of them takes longer to import than the whole CLI
+HEAVY_MODULES = ('pyarrow', 'redis', 'requests', 'serpapi', 'tqdm', 'dotenv', 'xxhash', 'zstandard')
+
+IMPORT_CHECK = f'''
+import json, logging, sys, time
+started = time.perf_counter()
+import nativqa.nativqa_framework, nativqa.batch, nativqa.worker
+elapsed = time.perf_counter() - started
+print(json.dumps({{'elapsed': elapsed, 'handlers': len(logging.getLogger().handlers),
+                  'heavy': [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+'''
+
+
+def run_import_check():
+    output = subprocess.run([sys.executable, '-c', IMPORT_CHECK], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout)
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_is_light(self):
+        result = run_import_check()
+        self.assertEqual(result['heavy'], [])
+        self.assertEqual(result['handlers'], 0)
+
+    def test_import_time(self):
+        # best of three, well above the expected time but below what the eager imports used to cost
+        elapsed = min(run_import_check()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, 0.25)
+
+    def test_help(self):
+        output = subprocess.run([sys.executable, '-m', 'nativqa', '--help'], capture_output=True, text=True,
+                                check=True)
+        self.assertIn('--log_level', output.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
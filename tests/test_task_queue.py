@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.task_queue import MemoryTaskQueue, SQLiteTaskQueue, RedisTaskQueue, DONE, FAILED
+from nativqa.worker import run_worker
+from nativqa.search_client import SearchClient
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+def make_tasks(n, group='run:1'):
+    return [{'id': f'{group}:{i}', 'group': group, 'category': 'food', 'query': f'query {i}',
+             'search_type': 'text', 'params': {'engine': 'google'}} for i in range(n)]
+
+
+class TaskQueueTests:
+    def test_claim_complete_drain(self):
+        queue = self.make_queue()
+        self.assertEqual(queue.put(make_tasks(3)), 3)
+        self.assertEqual(queue.put(make_tasks(3)), 0)
+        claimed = queue.claim('w1', 2)
+        self.assertEqual([task['query'] for task in claimed], ['query 0', 'query 1'])
+        queue.complete(claimed[0]['id'], {'q': 'query 0'})
+        queue.fail(claimed[1]['id'], 'HTTP 401')
+        finished = {task['id']: task for task in queue.drain('run:1')}
+        self.assertEqual(finished['run:1:0']['state'], DONE)
+        self.assertEqual(finished['run:1:0']['result'], {'q': 'query 0'})
+        self.assertEqual(finished['run:1:1']['state'], FAILED)
+        self.assertEqual(queue.drain('run:1'), [])
+        # resubmitting hands a finished result over again and retries a failed task
+        queue.put(make_tasks(2))
+        self.assertEqual([task['id'] for task in queue.drain('run:1')], ['run:1:0'])
+        self.assertEqual(sorted(task['id'] for task in queue.claim('w1', 5)), ['run:1:1', 'run:1:2'])
+
+    def test_expired_lease_is_delivered_again(self):
+        queue = self.make_queue()
+        queue.put(make_tasks(1))
+        self.assertEqual(len(queue.claim('w1', 1, lease_seconds=0.05)), 1)
+        self.assertEqual(queue.claim('w2', 1), [])
+        time.sleep(0.1)
+        claimed = queue.claim('w2', 1, lease_seconds=0.05)
+        self.assertEqual(claimed[0]['attempts'], 2)
+        time.sleep(0.1)
+        self.assertEqual(queue.claim('w3', 1)[0]['attempts'], 3)
+        queue.complete('run:1:0', {'q': 'late'})
+        queue.complete('run:1:0', {'q': 'later'})
+        self.assertEqual([task['result'] for task in queue.drain('run:1')], [{'q': 'late'}])
+
+    def test_shutdown(self):
+        queue = self.make_queue()
+        self.assertIsNone(queue.closed_at)
+        queue.shutdown()
+        self.assertIsNotNone(queue.closed_at)
+        queue.put(make_tasks(1))
+        self.assertIsNone(queue.closed_at)
+
+
+class TestMemoryTaskQueue(TaskQueueTests, unittest.TestCase):
+    def make_queue(self):
+        return MemoryTaskQueue()
+
+
+class TestSQLiteTaskQueue(TaskQueueTests, unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_queue(self):
+        return SQLiteTaskQueue(os.path.join(self.tmp_dir.name, 'queue.sqlite'))
+
+
+@unittest.skipIf(fakeredis is None, 'fakeredis is not installed')
+class TestRedisTaskQueue(TaskQueueTests, unittest.TestCase):
+    def make_queue(self):
+        return RedisTaskQueue(fakeredis.FakeRedis(), prefix='test')
+
+
+class FakeSearchClient(SearchClient):
+    def _request(self, params):
+        return {'search_parameters': {'engine': params['engine'], 'q': params['q']}}
+
+
+class TestWorker(unittest.TestCase):
+    def test_workers_share_the_queue(self):
+        queue = MemoryTaskQueue()
+        queue.put(make_tasks(20))
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            run_worker(queue, FakeSearchClient(concurrency=2), f'w{i}', poll_interval=0.01)))
+            for i in range(3)]
+        for thread in threads:
+            thread.start()
+        finished = []
+        while len(finished) < 20:
+            finished += queue.drain('run:1')
+            time.sleep(0.01)
+        queue.shutdown()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(n_done for n_done, _ in results), 20)
+        self.assertEqual(sorted(task['query'] for task in finished), sorted(f'query {i}' for i in range(20)))
+        self.assertEqual(finished[0]['result']['search_parameters']['category'], 'food')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from nativqa.utils import (normalize_query, read_seed_queries, iter_summary_data, open_jsonl_append,
+                           JsonArrayWriter)
+
+
+class TestUtils(unittest.TestCase):
+    def test_normalize_query_whitespace_and_nfc(self):
+        self.assertEqual(normalize_query('  What  is\tDoha? '), 'What is Doha?')
+        self.assertEqual(normalize_query('café'), 'café')
+
+    def test_normalize_query_arabic_diacritics(self):
+        query = 'مَا هِيــ الدوحة'
+        self.assertEqual(normalize_query(query), query)
+        self.assertEqual(normalize_query(query, strip_diacritics=True),
+                         'ما هي الدوحة')
+
+    def test_read_seed_queries_dedup(self):
+        with TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'seeds.csv')
+            with open(fpath, 'w', encoding='utf-8') as f:
+                f.write('topic,query\n'
+                        'food,What food is Doha famous for?\n'
+                        'food,What  food is Doha famous for? \n'
+                        'travel,Best time to visit Doha\n')
+            data = read_seed_queries(fpath)
+        self.assertEqual(data, [['food', 'What food is Doha famous for?'], ['travel', 'Best time to visit Doha']])
+
+    def test_json_array_writer_matches_json_dump(self):
+        data = [{'q': 'الدوحة', 'n': 1}, {'q': 'doha', 'n': [1, 2]}]
+        with TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'out.json')
+            with JsonArrayWriter(fpath) as writer:
+                for obj in data:
+                    writer.write(obj)
+            with open(fpath, encoding='utf-8') as f:
+                self.assertEqual(f.read(), json.dumps(data, ensure_ascii=False))
+
+    def test_append_after_truncated_line(self):
+        with TemporaryDirectory() as tmp_dir:
+            fpath = os.path.join(tmp_dir, 'summary.jsonl')
+            with open(fpath, 'w', encoding='utf-8') as f:
+                f.write('{"q": 1}\n{"q": 2}\n{"q": ')
+            self.assertEqual(list(iter_summary_data(fpath)), [{'q': 1}, {'q': 2}])
+            with open_jsonl_append(fpath) as f:
+                f.write('{"q": 3}\n')
+            self.assertEqual(list(iter_summary_data(fpath)), [{'q': 1}, {'q': 2}, {'q': 3}])
+
+
+if __name__ == "__main__":
+    unittest.main()